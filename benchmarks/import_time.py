@@ -0,0 +1,166 @@
+"""Import-time benchmark for the entry points.
+
+Imports each entry module in a fresh interpreter with ``-X importtime``
+and records how long the import took, how long the whole interpreter ran
+and which dependencies came along with it. Headless modules must not pull
+in Qt, and nothing may import the heavy dependencies that are only meant
+to be loaded once they are used; either makes the run exit with status 1,
+as does a module that got slower than the tolerance against a baseline.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --save-baseline benchmarks/imports.json
+    python benchmarks/import_time.py --baseline benchmarks/imports.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Bump when cases change in a way that makes old baselines meaningless
+SUITE_VERSION = 1
+
+# Dependencies that are imported where they are used, never at module level
+LAZY_MODULES = ('imageio', 'imageio_ffmpeg', 'pkg_resources')
+# What a module may not have imported by the time its import is done
+CASES = {
+    'cli': ('PyQt5', 'numpy', 'PIL') + LAZY_MODULES,
+    'server': ('PyQt5', 'numpy', 'PIL') + LAZY_MODULES,
+    'processors.gif_processor': ('PyQt5',) + LAZY_MODULES,
+    'ui.main_window': ('numpy', 'PIL') + LAZY_MODULES,
+}
+
+# Prints the top-level packages that were imported, for the forbidden check
+PROBE = "import json, sys, {module}; print(json.dumps(sorted({{name.split('.')[0] for name in sys.modules}})))"
+
+
+def parse_importtime(output, module):
+    """Return (total_us, [(name, cumulative_us), ...] of its direct imports) from -X importtime output.
+
+    Each line reads ``import time: self | cumulative | name``, with name
+    indented by two spaces per level of nesting.
+    """
+    children = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        cumulative = int(fields[1])
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        if depth == 0 and name.strip() == module:
+            return cumulative, children
+        if depth == 1:
+            children.append((name.strip(), cumulative))
+        elif depth == 0:
+            # Finished imports of its own dependencies are listed before it,
+            # those of anything else start a new tree
+            children = []
+    return None, []
+
+
+def measure(module):
+    """Import module in a fresh interpreter; return (import_ms, wall_ms, slowest imports, loaded packages)"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (ROOT, os.environ.get('PYTHONPATH')))))
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE.format(module=module)],
+                             cwd=ROOT, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{process.stderr.strip()[-2000:]}")
+    total, children = parse_importtime(process.stderr, module)
+    slowest = sorted(children, key=lambda child: child[1], reverse=True)[:3]
+    return ((total or 0) / 1000, wall * 1000, [(name, us / 1000) for name, us in slowest],
+            json.loads(process.stdout.splitlines()[-1]))
+
+
+def run_suite(modules, repeat=5, log=print):
+    """Measure every module repeat times; the fastest run counts"""
+    results = {}
+    log(f"{'module':<26} {'import':>9} {'process':>9}  slowest imports")
+    for module in modules:
+        runs = [measure(module) for _ in range(repeat)]
+        import_ms, wall_ms, slowest, loaded = min(runs, key=lambda run: run[0])
+        forbidden = sorted(set(CASES[module]) & set(loaded))
+        results[module] = {
+            'import_ms': import_ms,
+            'wall_ms': min(run[1] for run in runs),
+            'slowest': slowest,
+            'forbidden': forbidden,
+        }
+        details = ', '.join(f"{name} {ms:.0f} ms" for name, ms in slowest)
+        log(f"{module:<26} {import_ms:>6.1f} ms {results[module]['wall_ms']:>6.1f} ms  {details}")
+        if forbidden:
+            log(f"{'':<26} imports {', '.join(forbidden)}")
+    return results
+
+
+def compare(results, baseline, max_slowdown, min_ms):
+    """Return a list of human-readable regressions of results against baseline results"""
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if not before or not before.get('import_ms'):
+            continue
+        # Small modules jitter by more than any sensible percentage
+        limit = max(before['import_ms'] * (1 + max_slowdown), before['import_ms'] + min_ms)
+        if result['import_ms'] > limit:
+            regressions.append(f"{name}: imports in {result['import_ms']:.1f} ms, was {before['import_ms']:.1f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('modules', nargs='*', help=f"Modules to measure (default: {', '.join(CASES)})")
+    parser.add_argument('--repeat', type=int, default=5, help='Imports per module; the fastest one counts')
+    parser.add_argument('--output', default=None, help='Where to write the results JSON')
+    parser.add_argument('--baseline', default=None, help='Results JSON to compare against')
+    parser.add_argument('--save-baseline', default=None, help='Also write the results here as a new baseline')
+    parser.add_argument('--max-slowdown', type=float, default=0.25,
+                        help='Allowed growth of import time against the baseline (0.25 = 25%%)')
+    parser.add_argument('--min-ms', type=float, default=5,
+                        help='Growth in ms that is never a regression, however small the module')
+    args = parser.parse_args(argv)
+
+    unknown = [module for module in args.modules if module not in CASES]
+    if unknown:
+        parser.error(f"unknown module {unknown[0]}, use one of {', '.join(CASES)}")
+
+    results = run_suite(args.modules or list(CASES), repeat=max(1, args.repeat))
+    document = {
+        'suite_version': SUITE_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'results': results,
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"Results written to {path}")
+
+    regressions = [f"{name}: imports {', '.join(result['forbidden'])}"
+                   for name, result in results.items() if result['forbidden']]
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('suite_version') != SUITE_VERSION:
+            print("Baseline was made by a different version of the suite, not comparing")
+            return 1
+        regressions += compare(results, baseline.get('results', {}), args.max_slowdown, args.min_ms)
+
+    if regressions:
+        print("REGRESSIONS:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("No regressions" + (f" against {args.baseline}" if args.baseline else ""))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""Benchmarks for the framing pipeline.
+
+Generates synthetic GIFs and videos (frame counts x resolutions x motion
+levels), frames each of them with GifProcessor and decodes the videos
+with VideoConverter. Every case runs in a fresh process so its peak RSS
+is its own. Results are written as JSON and can be compared against a
+saved baseline; any case that got slower, bigger or hungrier than the
+tolerance makes the run exit with status 1.
+
+    python benchmarks/run_benchmarks.py --quick
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json
+
+Everything runs headless and offline; videos are encoded with the ffmpeg
+binary bundled with imageio-ffmpeg.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Bump when cases change in a way that makes old baselines meaningless
+SUITE_VERSION = 1
+
+FULL_MATRIX = {
+    'kinds': ('gif', 'mp4'),
+    'frames': (10, 30),
+    'sizes': ((320, 640), (720, 1280)),
+    'motions': ('static', 'low', 'high'),
+}
+QUICK_MATRIX = {
+    'kinds': ('gif', 'mp4'),
+    'frames': (10,),
+    'sizes': ((320, 640),),
+    'motions': ('static', 'low', 'high'),
+}
+
+
+def synthetic_frames(count, size, motion, seed=0):
+    """Yield count RGB frames of the given (width, height) with the given amount of motion.
+
+    "static" repeats one frame, "low" moves a small box over a fixed
+    background (like a cursor in a screen recording) and "high" changes
+    every pixel of every frame.
+    """
+    width, height = size
+    random = np.random.RandomState(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    background = np.stack([x * 255 // max(1, width - 1), y * 255 // max(1, height - 1),
+                           np.full_like(x, 128)], axis=-1).astype(np.uint8)
+    box = max(8, width // 8)
+    for index in range(count):
+        if motion == 'static':
+            frame = background.copy()
+            frame[box:2 * box, box:2 * box] = 255
+        elif motion == 'low':
+            frame = background.copy()
+            left = (index * box // 2) % max(1, width - box)
+            top = (index * box // 3) % max(1, height - box)
+            frame[top:top + box, left:left + box] = (255, 64, 0)
+        else:
+            noise = random.randint(0, 64, size=(height, width, 3), dtype=np.uint8)
+            frame = np.roll(background, index * 7, axis=1) // 2 + noise
+        yield frame
+
+
+def write_input(path, kind, count, size, motion, fps=10):
+    frames = synthetic_frames(count, size, motion)
+    if kind == 'gif':
+        images = [Image.fromarray(frame) for frame in frames]
+        images[0].save(path, save_all=True, append_images=images[1:], duration=1000 // fps, loop=0)
+    else:
+        import imageio_ffmpeg
+        writer = imageio_ffmpeg.write_frames(path, size, fps=fps, codec='libx264', pix_fmt_out='yuv420p',
+                                             macro_block_size=1, ffmpeg_log_level='error')
+        writer.send(None)
+        for frame in frames:
+            writer.send(np.ascontiguousarray(frame))
+        writer.close()
+
+
+def build_cases(matrix, scale, workers):
+    cases = []
+    for kind, count, size, motion in itertools.product(matrix['kinds'], matrix['frames'],
+                                                       matrix['sizes'], matrix['motions']):
+        name = f"{kind}-{count}f-{size[0]}x{size[1]}-{motion}"
+        cases.append({'name': f"frame/{name}", 'task': 'frame', 'kind': kind, 'frames': count,
+                      'size': size, 'motion': motion, 'scale': scale, 'workers': workers})
+        if kind == 'mp4':
+            cases.append({'name': f"decode/{name}", 'task': 'decode', 'kind': kind, 'frames': count,
+                          'size': size, 'motion': motion})
+    return cases
+
+
+def run_case(case, input_path, frame_path, work_dir):
+    """Run one case in this process and return its measurements"""
+    from processors.gif_processor import GifProcessor
+    from processors.video_converter import VideoConverter
+    from utils.metrics import PerfRecorder
+    from utils.signals import CallbackSignals
+
+    if case['task'] == 'decode':
+        metrics = PerfRecorder()
+        metrics.start()
+        decoded = sum(1 for _ in VideoConverter(metrics=metrics).iter_frames(input_path, fps=None, buffers=2))
+        report = metrics.report()
+        return _result(report, decoded, None)
+
+    errors = []
+    signals = CallbackSignals()
+    signals.error.connect(errors.append)
+    output_path = os.path.join(work_dir, case['name'].replace('/', '_') + '.gif')
+    trace_path = output_path + '.json'
+    GifProcessor(input_path, frame_path, output_path, signals, workers=case['workers'], scale=case['scale'],
+                 cache=False, trace_path=trace_path).run()
+    if errors:
+        raise RuntimeError(errors[0])
+    with open(trace_path) as f:
+        report = json.load(f)
+    return _result(report, case['frames'], os.path.getsize(output_path))
+
+
+def _result(report, frames, output_bytes):
+    elapsed = report['elapsed']
+    return {
+        'frames': frames,
+        'seconds': elapsed,
+        'fps': frames / elapsed if elapsed else None,
+        'peak_rss': report['memory'].get('peak_rss'),
+        'output_bytes': output_bytes,
+        'stages': {name: round(stage['wall'], 4) for name, stage in report['stages'].items()},
+    }
+
+
+def warm_up():
+    """Detect the bundled frame's screen once, so no case pays for it, and return its path"""
+    from processors.frame_asset import FrameAsset
+    from utils.file_utils import find_resource_path
+
+    frame_path = find_resource_path('frame.png')
+    FrameAsset.load(frame_path)
+    return frame_path
+
+
+def in_fresh_process(function, *args):
+    """Call function in a new process, so it starts cold and its peak RSS is its own.
+
+    Linux carries the peak RSS of a process over into the programs it
+    starts, which is why this script does nothing heavy itself.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(function, *args).result()
+
+
+def run_suite(cases, work_dir, repeat=1, log=print):
+    frame_path = in_fresh_process(warm_up)
+    inputs = {}
+    results = {}
+    for case in cases:
+        key = (case['kind'], case['frames'], tuple(case['size']), case['motion'])
+        if key not in inputs:
+            path = os.path.join(work_dir, "input-{}-{}f-{}x{}-{}.{}".format(key[0], key[1], *key[2], key[3], key[0]))
+            in_fresh_process(write_input, path, *key)
+            inputs[key] = path
+
+        runs = [in_fresh_process(run_case, case, inputs[key], frame_path, work_dir) for _ in range(repeat)]
+        # The fastest run is the least disturbed by whatever else the host was doing
+        best = min(runs, key=lambda run: run['seconds'])
+        best['peak_rss'] = max(run['peak_rss'] or 0 for run in runs) or None
+        results[case['name']] = best
+        log(f"{case['name']:<40} {best['fps']:8.1f} frames/s  {_mb(best['peak_rss']):>8}  "
+            f"{_kb(best['output_bytes']):>9}")
+    return results
+
+
+def compare(results, baseline, max_slowdown, max_growth, speed=True):
+    """Return a list of human-readable regressions of results against baseline results.
+
+    With speed False frames/s are not compared, only memory and output size.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if not before:
+            continue
+        if speed and before.get('fps') and result['fps'] < before['fps'] * (1 - max_slowdown):
+            regressions.append(f"{name}: {result['fps']:.1f} frames/s, was {before['fps']:.1f}")
+        for field, label in (('peak_rss', 'peak RSS'), ('output_bytes', 'output size')):
+            if before.get(field) and result.get(field) and result[field] > before[field] * (1 + max_growth):
+                regressions.append(f"{name}: {label} {result[field]} bytes, was {before[field]}")
+    return regressions
+
+
+def host_info():
+    import platform
+    return {
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def _mb(value):
+    return f"{value / 1024 ** 2:.0f} MB" if value else "-"
+
+
+def _kb(value):
+    return f"{value / 1024:.0f} KB" if value else "-"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--quick', action='store_true', help='Small matrix, for a fast check')
+    parser.add_argument('--filter', default=None, help='Only run cases whose name contains this')
+    parser.add_argument('--scale', type=float, default=0.25, help='Output scale of the framing cases')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes of the framing cases')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case; the fastest one counts')
+    parser.add_argument('--output', default=None, help='Where to write the results JSON')
+    parser.add_argument('--baseline', default=None, help='Results JSON to compare against')
+    parser.add_argument('--save-baseline', default=None, help='Also write the results here as a new baseline')
+    parser.add_argument('--max-slowdown', type=float, default=0.15,
+                        help='Allowed drop in frames/s against the baseline (0.15 = 15%%)')
+    parser.add_argument('--max-growth', type=float, default=0.15,
+                        help='Allowed growth of peak RSS and output size against the baseline')
+    parser.add_argument('--work-dir', default=None, help='Keep generated inputs and outputs here')
+    args = parser.parse_args(argv)
+
+    cases = build_cases(QUICK_MATRIX if args.quick else FULL_MATRIX, args.scale, args.workers)
+    if args.filter:
+        cases = [case for case in cases if args.filter in case['name']]
+    if not cases:
+        parser.error("no benchmark cases selected")
+
+    with tempfile.TemporaryDirectory(prefix='gifframingtool-bench-') as tmp_dir:
+        work_dir = args.work_dir or tmp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        # Keep the frame index and render cache out of the user's cache directory
+        os.environ['GIFFRAMINGTOOL_CACHE_DIR'] = os.path.join(work_dir, 'cache')
+        started = time.time()
+        results = run_suite(cases, work_dir, repeat=max(1, args.repeat))
+
+    document = {
+        'suite_version': SUITE_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'duration': time.time() - started,
+        'host': host_info(),
+        'settings': {'scale': args.scale, 'workers': args.workers, 'repeat': args.repeat},
+        'results': results,
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"Results written to {path}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('suite_version') != SUITE_VERSION:
+        print("Baseline was made by a different version of the suite, not comparing")
+        return 1
+    if baseline.get('settings') != document['settings'] or baseline.get('host', {}).get('machine') != \
+            document['host']['machine']:
+        print("Warning: baseline was made with other settings or on another kind of machine")
+
+    # Frames/s of parallel decoding and encoding depend on the number of
+    # cores, so they are only compared against a baseline made with as many
+    cpu_count = baseline.get('host', {}).get('cpu_count')
+    speed = cpu_count == document['host']['cpu_count']
+    if not speed:
+        print(f"Baseline was made with {cpu_count} CPUs, this host has {document['host']['cpu_count']}: "
+              f"only comparing memory and output size")
+    regressions = compare(results, baseline.get('results', {}), args.max_slowdown, args.max_growth, speed=speed)
+    if regressions:
+        print("REGRESSIONS:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
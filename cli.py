@@ -0,0 +1,455 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils.file_utils import find_resource_path, is_gif_file, is_video_file
+from utils.signals import CallbackSignals
+
+# Subcommands handled here instead of starting the GUI
+COMMANDS = ('batch', 'cache', 'serve')
+
+
+def collect_inputs(patterns):
+    """Expand files, directories and glob patterns into a sorted list of media files"""
+    inputs = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        elif os.path.exists(pattern):
+            candidates = [pattern]
+        else:
+            candidates = glob.glob(pattern, recursive=True)
+
+        for path in candidates:
+            if os.path.isfile(path) and (is_gif_file(path) or is_video_file(path)):
+                inputs.append(os.path.abspath(path))
+
+    # The same file may match several patterns
+    return sorted(set(inputs))
+
+
+def output_path_for(input_path, output_dir=None, suffix='_framed', extension='.gif'):
+    """Output path for an input, next to it unless an output directory is given"""
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    folder = output_dir or os.path.dirname(input_path)
+    return os.path.join(folder, f"{base_name}{suffix}{extension}")
+
+
+def frame_labels(frame_paths):
+    """Return what each device frame adds to output names: nothing with one frame, else its file name"""
+    if len(frame_paths) <= 1:
+        return [''] * len(frame_paths)
+    labels = []
+    for index, path in enumerate(frame_paths, start=1):
+        label = '_' + os.path.splitext(os.path.basename(path))[0]
+        # e.g. two frame.png files from different folders
+        labels.append(f"{label}{index}" if label in labels else label)
+    return labels
+
+
+def parse_formats(value):
+    """Parse a comma separated list of output formats ("gif,webp,mp4")"""
+    from processors.encoders import FORMAT_EXTENSIONS
+
+    formats = [name.strip().lower() for name in value.split(',') if name.strip()]
+    unknown = [name for name in formats if name not in FORMAT_EXTENSIONS]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(f"invalid format list: {value!r}, "
+                                         f"use {', '.join(FORMAT_EXTENSIONS)}")
+    # One rendition per format, in the order given
+    return list(dict.fromkeys(formats))
+
+
+def parse_time(value):
+    """Parse seconds ("12.5") or a clock time ("1:05", "0:01:05.5") into seconds"""
+    try:
+        seconds = 0.0
+        for part in value.split(':'):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time: {value!r}")
+    if seconds < 0:
+        raise argparse.ArgumentTypeError(f"time can't be negative: {value!r}")
+    return seconds
+
+
+def parse_size(value):
+    """Parse a file size in bytes, or with a KB, MB or GB unit ("10MB", "9.5 mb", "500k")"""
+    units = {'': 1, 'b': 1, 'k': 1024, 'kb': 1024, 'm': 1024 ** 2, 'mb': 1024 ** 2,
+             'g': 1024 ** 3, 'gb': 1024 ** 3}
+    number = value.strip().lower()
+    unit = number.lstrip('0123456789.')
+    try:
+        size = float(number[:len(number) - len(unit)]) * units[unit.strip()]
+    except (ValueError, KeyError):
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r}")
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"size must be positive: {value!r}")
+    return int(size)
+
+
+def _run_job(job_id, input_path, frame_path, output_paths, options, events, trace_dir=None, profile=False,
+             processor_class=None, templates=()):
+    """Frame a single input into one or more outputs, reporting progress as (job_id, event, value) tuples on events.
+
+    templates are (frame_path, output paths) pairs of more device frames
+    rendered from the same decode of the input.
+    """
+    from processors.gif_processor import GifProcessor
+
+    processor_class = processor_class or GifProcessor
+    output_path, extra_outputs = output_paths[0], list(output_paths[1:])
+    if trace_dir:
+        base = os.path.join(trace_dir, os.path.splitext(os.path.basename(output_path))[0])
+        options = dict(options, trace_path=base + '.trace.json',
+                       profile_path=base + '.prof' if profile else None)
+
+    all_outputs = list(output_paths) + [path for _, paths in templates for path in paths]
+    result = {'output': output_path, 'outputs': all_outputs, 'error': None, 'elapsed': None}
+    signals = CallbackSignals()
+    signals.progress.connect(lambda value: events.put((job_id, 'progress', value)))
+    signals.status.connect(lambda message: events.put((job_id, 'status', message)))
+    signals.finished.connect(lambda path, elapsed: result.update(elapsed=elapsed))
+    signals.error.connect(lambda message: result.update(error=message))
+
+    events.put((job_id, 'started', input_path))
+    try:
+        processor = processor_class(input_path, frame_path, output_path, signals, extra_outputs=extra_outputs,
+                                    templates=templates, **options)
+        processor.run()
+        if processor.budget_report is not None:
+            result['budget'] = processor.budget_report
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+class TextReporter:
+    """Prints human readable progress lines"""
+
+    def __init__(self, jobs, stream=None):
+        self.jobs = jobs
+        # Looked up now rather than at import, so redirected output is honoured
+        self.stream = stream or sys.stdout
+        self._last_progress = {}
+
+    def _label(self, job_id):
+        return f"[{job_id + 1}/{len(self.jobs)}] {os.path.basename(self.jobs[job_id][0])}"
+
+    def event(self, job_id, kind, value):
+        if kind == 'progress':
+            # Only every 10% to keep CI logs readable
+            step = value // 10
+            if step == self._last_progress.get(job_id):
+                return
+            self._last_progress[job_id] = step
+            self._write(f"{self._label(job_id)}: {value}%")
+        elif kind == 'status':
+            self._write(f"{self._label(job_id)}: {value}")
+        elif kind == 'done':
+            self._write(f"{self._label(job_id)}: done in {value['elapsed']:.2f}s -> "
+                        f"{', '.join(value.get('outputs') or [value['output']])}")
+        elif kind == 'failed':
+            self._write(f"{self._label(job_id)}: FAILED: {value['error']}")
+
+    def summary(self, succeeded, failed, elapsed):
+        self._write(f"{succeeded} succeeded, {failed} failed in {elapsed:.2f}s")
+
+    def _write(self, line):
+        self.stream.write(line + "\n")
+        self.stream.flush()
+
+
+class JsonReporter(TextReporter):
+    """Prints one JSON object per line, for other tools to consume"""
+
+    def event(self, job_id, kind, value):
+        record = {'event': kind, 'job': job_id, 'input': self.jobs[job_id][0]}
+        if isinstance(value, dict):
+            record.update(value)
+        elif kind != 'started':
+            record['value'] = value
+        self._write(json.dumps(record))
+
+    def summary(self, succeeded, failed, elapsed):
+        self._write(json.dumps({'event': 'summary', 'succeeded': succeeded, 'failed': failed,
+                                'elapsed': round(elapsed, 3)}))
+
+
+class _InlineEvents:
+    """Delivers events straight to the reporter when jobs run in this process"""
+
+    def __init__(self, reporter):
+        self.reporter = reporter
+
+    def put(self, event):
+        self.reporter.event(*event)
+
+
+def run_batch(jobs, frame_path, options, workers, reporter, trace_dir=None, profile=False):
+    """Run (input, output paths, templates) jobs on up to ``workers`` processes.
+
+    Returns:
+        Number of failed jobs
+    """
+    failed = 0
+
+    def report_result(job_id, result, events):
+        nonlocal failed
+        if result['error']:
+            failed += 1
+            events.put((job_id, 'failed', result))
+        else:
+            events.put((job_id, 'done', result))
+
+    if workers <= 1 or len(jobs) <= 1:
+        events = _InlineEvents(reporter)
+        for job_id, (input_path, output_paths, templates) in enumerate(jobs):
+            result = _run_job(job_id, input_path, frame_path, output_paths, options, events, trace_dir, profile,
+                              templates=templates)
+            report_result(job_id, result, events)
+        return failed
+
+    with multiprocessing.Manager() as manager:
+        # Workers and this process both post here; one thread does all the printing
+        events = manager.Queue()
+
+        def forward_events():
+            while True:
+                event = events.get()
+                if event is None:
+                    return
+                reporter.event(*event)
+
+        printer = threading.Thread(target=forward_events, daemon=True)
+        printer.start()
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(_run_job, job_id, input_path, frame_path, output_paths, options, events,
+                                trace_dir, profile, templates=templates): job_id
+                    for job_id, (input_path, output_paths, templates) in enumerate(jobs)
+                }
+                for future in as_completed(futures):
+                    job_id = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # e.g. a worker process that died
+                        _, output_paths, templates = jobs[job_id]
+                        outputs = output_paths + [path for _, paths in templates for path in paths]
+                        result = {'output': output_paths[0], 'outputs': outputs, 'error': str(e), 'elapsed': None}
+                    report_result(job_id, result, events)
+        finally:
+            events.put(None)
+            printer.join()
+    return failed
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='gifframingtool', description='Frame GIFs and videos in device frames')
+    subparsers = parser.add_subparsers(dest='command')
+
+    batch = subparsers.add_parser('batch', help='Frame many GIFs/videos without the GUI')
+    batch.add_argument('inputs', nargs='+', help='Input files, directories or glob patterns')
+    batch.add_argument('--frame', action='append', default=None, dest='frames',
+                       help='Device frame PNG (default: bundled frame.png). Repeat it to frame every input '
+                            'into several devices from one decode; outputs are then named after each frame')
+    batch.add_argument('--output-dir', default=None, help='Where to write outputs (default: next to each input)')
+    batch.add_argument('--suffix', default='_framed', help='Suffix added to output file names')
+    batch.add_argument('--format', type=parse_formats, default=['gif'], dest='formats',
+                       help='Output formats, comma separated: gif, webp, apng, mp4 (default: gif). '
+                            'All of them are written from one pass over each input')
+    batch.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                       help='Number of inputs processed in parallel (default: CPU count)')
+    batch.add_argument('--decode-segments', type=int, default=1,
+                       help='Decode videos as this many time segments at once, each by its own ffmpeg process '
+                            '(0: one per CPU). Pays off for long inputs with few -j workers')
+    batch.add_argument('--fps', type=float, default=10, help='Sampling rate for video inputs')
+    batch.add_argument('--start', type=parse_time, default=None, help='Start time, e.g. 12.5 or 1:05')
+    batch.add_argument('--end', type=parse_time, default=None, help='End time, e.g. 20 or 1:20')
+    batch.add_argument('--max-duration', type=parse_time, default=None,
+                       help='Longest stretch of each input to use, counted from the start time')
+    batch.add_argument('--scale', type=float, default=1.0,
+                       help='Output size relative to the frame image, e.g. 0.25')
+    batch.add_argument('--max-width', type=int, default=None, help='Largest output width in pixels')
+    batch.add_argument('--palette', choices=('global', 'adaptive'), default='global',
+                       help='One shared palette, or one palette per frame')
+    batch.add_argument('--colors', type=int, default=256, help='Palette size')
+    batch.add_argument('--dither', action='store_true', help='Dither frames to the palette')
+    batch.add_argument('--keep-duplicates', action='store_true',
+                       help='Do not merge identical consecutive frames')
+    batch.add_argument('--engine', choices=('pillow', 'ffmpeg'), default='pillow',
+                       help='Render in Python, or as one ffmpeg filter graph (falls back to Pillow on failure)')
+    batch.add_argument('--max-size', type=parse_size, default=None,
+                       help='Largest size of every output, e.g. 10MB. --fps, --scale and --colors become upper '
+                            'limits that are lowered until a sample render predicts the outputs fit')
+    batch.add_argument('--max-seconds', type=parse_time, default=None,
+                       help='Longest each input may take to render, sampling included, e.g. 60. '
+                            'Lowers the settings like --max-size')
+    batch.add_argument('--trace-dir', default=None,
+                       help='Write a JSON performance trace per input (stage times, latency, memory) here')
+    batch.add_argument('--profile', action='store_true', help='Also write cProfile stats (needs --trace-dir)')
+    batch.add_argument('--trace-memory', action='store_true',
+                       help='Trace allocations with tracemalloc in the trace (slower)')
+    batch.add_argument('--no-cache', action='store_true', help='Render from scratch, bypassing the render cache')
+    batch.add_argument('--cache-frames', action='store_true',
+                       help='Also cache the resized source frames, so later runs with another device frame of '
+                            'the same screen size skip decoding. Takes a lot of disk space')
+    batch.add_argument('--json', action='store_true', help='Print progress as JSON lines')
+
+    cache = subparsers.add_parser('cache', help='Inspect or purge the render cache')
+    cache.add_argument('action', choices=('info', 'purge', 'trim'), nargs='?', default='info',
+                       help='info lists entries, purge removes everything, trim evicts down to --max-mb')
+    cache.add_argument('--max-mb', type=float, default=None, help='Size to trim the cache to, in MB')
+    cache.add_argument('--json', action='store_true', help='Print the result as JSON')
+
+    serve = subparsers.add_parser('serve', help='Run a local job server with a pool of warm workers')
+    serve.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    serve.add_argument('--port', type=int, default=8765, help='Port to listen on (default: 8765)')
+    serve.add_argument('--socket', default=None, help='Listen on this Unix socket instead of a TCP port')
+    serve.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                       help='Number of jobs rendered at once (default: CPU count)')
+    serve.add_argument('--frame', default=None, help='Device frame PNG of jobs that name none (default: bundled)')
+    serve.add_argument('--verbose', action='store_true', help='Log every request')
+    return parser
+
+
+def batch_command(args):
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        sys.stderr.write("No GIF or video inputs found\n")
+        return 1
+
+    frame_paths = args.frames or [find_resource_path('frame.png')]
+    for frame_path in frame_paths:
+        if not os.path.exists(frame_path):
+            sys.stderr.write(f"Frame image not found: {frame_path}\n")
+            return 1
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    if args.start is not None and args.end is not None and args.end <= args.start:
+        sys.stderr.write("--end has to be after --start\n")
+        return 1
+
+    from processors.encoders import FORMAT_EXTENSIONS
+
+    extensions = [FORMAT_EXTENSIONS[name] for name in args.formats]
+    labels = frame_labels(frame_paths)
+    jobs = []
+    used = set()
+    for path in inputs:
+        suffix = args.suffix
+        if output_path_for(path, args.output_dir, suffix + labels[0], extensions[0]) in used:
+            # e.g. clip.gif and clip.mp4 in the same folder
+            extension = os.path.splitext(path)[1].lstrip('.')
+            suffix = f"_{extension}{args.suffix}"
+        # One list of outputs per device frame
+        output_paths = [[output_path_for(path, args.output_dir, suffix + label, ext) for ext in extensions]
+                        for label in labels]
+        used.update(output for paths in output_paths for output in paths)
+        jobs.append((path, output_paths[0], list(zip(frame_paths[1:], output_paths[1:]))))
+    options = {
+        'fps': args.fps,
+        'start': args.start,
+        'end': args.end,
+        'max_duration': args.max_duration,
+        'scale': args.scale,
+        'max_width': args.max_width,
+        'palette': args.palette,
+        'palette_colors': args.colors,
+        'dither': args.dither,
+        'collapse_duplicates': not args.keep_duplicates,
+        'engine': args.engine,
+        'decode_segments': max(0, args.decode_segments),
+        'max_bytes': args.max_size,
+        'max_seconds': args.max_seconds,
+        'cache': not args.no_cache,
+        'cache_frames': args.cache_frames,
+        'trace_memory': args.trace_memory,
+    }
+    if args.profile and not args.trace_dir:
+        sys.stderr.write("--profile needs --trace-dir\n")
+        return 1
+    if args.trace_dir:
+        os.makedirs(args.trace_dir, exist_ok=True)
+
+    reporter = (JsonReporter if args.json else TextReporter)(jobs)
+    start_time = time.time()
+    failed = run_batch(jobs, frame_paths[0], options, max(1, args.workers), reporter, args.trace_dir,
+                       args.profile)
+    reporter.summary(len(jobs) - failed, failed, time.time() - start_time)
+    return 1 if failed else 0
+
+
+def cache_command(args):
+    from processors.render_cache import RenderCache
+
+    cache = RenderCache()
+    if args.action == 'purge':
+        result = {'removed_files': cache.purge()}
+    elif args.action == 'trim':
+        max_bytes = cache.max_bytes if args.max_mb is None else int(args.max_mb * 1024 * 1024)
+        result = {'removed': cache.evict(max_bytes)}
+    else:
+        entries = cache.entries()
+        result = {
+            'path': cache.root,
+            'entries': len(entries),
+            'size': sum(entry['size'] for entry in entries),
+            'max_size': cache.max_bytes,
+            'items': entries,
+        }
+
+    if args.json:
+        print(json.dumps(result))
+    elif args.action == 'purge':
+        print(f"Removed {result['removed_files']} files from the render cache")
+    elif args.action == 'trim':
+        print(f"Evicted {len(result['removed'])} entries")
+    else:
+        print(f"{result['path']}: {result['entries']} entries, "
+              f"{result['size'] / 1024 ** 2:.1f} of {result['max_size'] / 1024 ** 2:.0f} MB")
+        for entry in reversed(entries):
+            last_used = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used']))
+            print(f"  {entry['key']}  {entry['size'] / 1024 ** 2:9.1f} MB  {last_used}")
+    return 0
+
+
+def serve_command(args):
+    import server
+
+    frame_path = args.frame or find_resource_path('frame.png')
+    if not os.path.exists(frame_path):
+        sys.stderr.write(f"Frame image not found: {frame_path}\n")
+        return 1
+    try:
+        return server.serve(frame_path, max(1, args.workers), args.host, args.port, args.socket, args.verbose)
+    except ValueError as e:
+        sys.stderr.write(f"{e}\n")
+        return 1
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'batch':
+        return batch_command(args)
+    if args.command == 'cache':
+        return cache_command(args)
+    if args.command == 'serve':
+        return serve_command(args)
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -1,11 +1,19 @@
 import sys
 import threading
-from PyQt5.QtWidgets import QApplication
-
-from ui.main_window import FrameGifApp
-from utils.styles import get_application_stylesheet
+import multiprocessing
 
 def main():
+    # Headless subcommands, e.g. `gifframingtool batch ...`, never load Qt
+    if len(sys.argv) > 1:
+        import cli
+        if sys.argv[1] in cli.COMMANDS:
+            sys.exit(cli.main(sys.argv[1:]))
+
+    from PyQt5.QtWidgets import QApplication
+
+    from ui.main_window import FrameGifApp
+    from utils.styles import get_application_stylesheet
+
     app = QApplication(sys.argv)
     
     # Set application style
@@ -17,4 +25,6 @@ def main():
     sys.exit(app.exec_())
 
 if __name__ == "__main__":
+    # Needed for the worker process pool in the bundled app
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,419 @@
+import math
+import os
+import tempfile
+import time
+from collections import namedtuple
+import numpy as np
+from PIL import Image
+
+from processors.compositor import Compositor
+from processors.encoders import FORMAT_EXTENSIONS, FfmpegEncoder, frame_rate_for
+from processors.frame_source import DEFAULT_DURATION, frames_in_range, gif_durations
+from processors.gif_writer import StreamingGifWriter
+from processors.palette import DEFAULT_SAMPLE_PIXELS, GlobalPalette
+from processors.video_reader import VideoFrameReader, probe_video
+from utils.file_utils import is_video_file
+
+# Runs of consecutive input frames a budget is sampled from, and frames per
+# run at the highest frame rate tried
+SAMPLE_RUNS = 3
+SAMPLE_RUN_FRAMES = 6
+# Seconds of video decoded to tiny frames to time ffmpeg's decoding alone
+DECODE_SAMPLE_SECONDS = 2
+# Part of a budget predictions have to stay within; they are usually off by
+# less than the rest either way, and budgets are hard limits
+HEADROOM = 0.9
+# Most pixels of framed output a sample is rendered at; larger candidates are
+# predicted from a render at this size, scaled up by their number of pixels
+SAMPLE_PIXELS = 360 * 640
+# Part of a time budget planning may take; sampling stops once it is spent
+PLANNING_SHARE = 0.25
+
+# What every setting is lowered to, step by step, relative to the configured value
+FPS_STEPS = (1, 0.8, 0.6, 0.5, 0.4, 0.3)
+SCALE_STEPS = (1, 0.85, 0.7, 0.6, 0.5, 0.4, 0.3, 0.25, 0.2, 0.15, 0.1)
+COLOR_STEPS = (256, 128, 64, 32)
+# The setting each rung of the ladder lowers, over and over; the scale goes
+# down twice as often as the frame rate and the palette size, as it saves
+# both bytes and time the fastest
+LADDER_PATTERN = ('scale', 'fps', 'scale', 'colors')
+
+# Settings a render can be fitted to a budget with; fps is None for GIF inputs
+Candidate = namedtuple('Candidate', 'fps scale colors')
+# Predicted size of the largest output in bytes, seconds to render and output frames
+Estimate = namedtuple('Estimate', 'bytes seconds frames')
+# What a sample render measured: bytes of a run's first frame and bytes every
+# later frame adds, by format, seconds of work per frame and setup seconds
+Sample = namedtuple('Sample', 'first_bytes added_bytes frame_seconds setup')
+
+
+def budget_ladder(fps, scale, colors, tune_fps=True, tune_colors=True):
+    """Return Candidates from the given settings down to the smallest, every one a step below the last"""
+    options = {
+        'fps': [round(fps * step, 2) for step in FPS_STEPS] if tune_fps else [fps],
+        'scale': [scale * step for step in SCALE_STEPS],
+        'colors': [colors] + [step for step in COLOR_STEPS if step < colors] if tune_colors else [colors],
+    }
+    position = dict.fromkeys(options, 0)
+    ladder = [Candidate(fps, scale, colors)]
+    while any(position[name] + 1 < len(values) for name, values in options.items()):
+        for name in LADDER_PATTERN:
+            if position[name] + 1 < len(options[name]):
+                position[name] += 1
+                ladder.append(Candidate(**{key: options[key][position[key]] for key in options}))
+    return ladder
+
+
+def format_bytes(size):
+    """Human readable size, e.g. 9.6 MB"""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024 or unit == 'MB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024.0
+
+
+class BudgetPlanner:
+    """Predicts output size and render time from a sample render, to fit settings to a budget.
+
+    A few short runs of consecutive input frames are decoded once, at the
+    largest screen size tried or smaller, so that framed they have no more
+    than SAMPLE_PIXELS. Every candidate frames and encodes them the way a
+    render with its settings would, into throwaway files; candidates larger
+    than that are rendered at that size and their bytes and time per frame
+    scaled up by their number of pixels. The first frame of an animation is
+    stored whole and the rest only as changes, so the size of a run's first
+    frame and the bytes every later frame adds are measured apart and scaled
+    to the number of frames of the full render. Time is what the sample
+    took per frame, plus the decode and palette costs measured while
+    sampling.
+
+    Runs are spread over the input, so the prediction holds for recordings
+    whose busy and quiet parts alternate; a clip that is still for most of
+    its length except where no run lands is predicted too large.
+    """
+
+    def __init__(self, input_path, asset, formats, max_bytes=None, max_seconds=None, start=None, end=None,
+                 palette="global", palette_sample_frames=8, palette_sample_pixels=DEFAULT_SAMPLE_PIXELS,
+                 dither=False):
+        """
+        Args:
+            input_path: The video or GIF to render
+            asset: FrameAsset of the device frame at its full size
+            formats: Formats of the outputs, e.g. ['gif', 'mp4']; each of them has to fit max_bytes
+            max_bytes: Largest size of any output, or None
+            max_seconds: Longest the whole render may take, sampling included, or None
+            start, end: Part of the input to render, in seconds
+            palette, palette_sample_frames, palette_sample_pixels, dither: As for GifProcessor
+        """
+        self.input_path = input_path
+        self.asset = asset
+        self.formats = list(dict.fromkeys(formats))
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.start = start
+        self.end = end
+        self.palette = palette
+        self.palette_sample_frames = palette_sample_frames
+        self.palette_sample_pixels = palette_sample_pixels
+        self.dither = dither
+        self.video = is_video_file(input_path)
+        self.estimates = {}
+        self.sample_scale = None
+        self._runs = None
+        self._samples = {}
+        self._assets = {}
+
+    def choose(self, ladder, elapsed=lambda: 0):
+        """Return (candidate, estimate, fits) for the first rung of the ladder that fits the budget.
+
+        Sizes and times only go down along the ladder, so after the top
+        rung the rungs are bisected. elapsed returns the seconds already
+        spent, which the time budget has to cover as well. A rung fits when
+        its prediction stays within HEADROOM of the budget. Without any rung
+        that fits, the last one is returned.
+
+        Once planning has taken PLANNING_SHARE of the time budget, no rung
+        that needs a sample render of its own is tried any more: the first
+        of the others that fits is returned, or else the last rung.
+        """
+        def fits(index):
+            estimate = self.estimate(ladder[index])
+            if self.max_bytes and estimate.bytes > self.max_bytes * HEADROOM:
+                return False
+            return not self.max_seconds or estimate.seconds + elapsed() <= self.max_seconds * HEADROOM
+
+        if fits(0) or len(ladder) == 1:
+            return ladder[0], self.estimates[ladder[0]], fits(0)
+        # The last rung is taken to fit until the search ends up there
+        low, high = 1, len(ladder) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if not self._affordable(ladder[middle], elapsed):
+                break
+            if fits(middle):
+                high = middle
+            else:
+                low = middle + 1
+        # The search took time as well, so rungs that fitted when they were
+        # measured may not any more; take the first one that still does of
+        # those that need no more sampling
+        for index in range(low, len(ladder) - 1):
+            if self._measured(ladder[index]) and fits(index):
+                return ladder[index], self.estimates[ladder[index]], True
+        return ladder[-1], self.estimate(ladder[-1]), fits(len(ladder) - 1)
+
+    def _measured(self, candidate):
+        # Whether a candidate can be estimated without a sample render of its own
+        return candidate in self.estimates or self._sampled(candidate) in self._samples
+
+    def _affordable(self, candidate, elapsed):
+        # Whether a candidate can be estimated within the planning share of the time budget
+        if not self.max_seconds or self._measured(candidate):
+            return True
+        return elapsed() < self.max_seconds * PLANNING_SHARE
+
+    def _sampled(self, candidate):
+        # The candidate a candidate's sample render is made with
+        if self.sample_scale is None:
+            return candidate
+        return candidate._replace(scale=min(candidate.scale, self.sample_scale))
+
+    def estimate(self, candidate):
+        """Return the Estimate of rendering with a candidate's settings, from its sample render"""
+        if candidate in self.estimates:
+            return self.estimates[candidate]
+        if self._runs is None:
+            self._runs = self.sample(candidate)
+
+        sampled = self._sampled(candidate)
+        if sampled not in self._samples:
+            self._samples[sampled] = self.render_sample(sampled)
+        sample = self._samples[sampled]
+
+        started = time.perf_counter()
+        size, screen_size = self.scaled_sizes(candidate.scale)
+        # Bytes and work per frame grow with the pixels framed
+        pixels = _area(size) / _area(self.scaled_sizes(sampled.scale)[0])
+        frames = self.frame_count(candidate)
+        setup = sample.setup
+        if self.video:
+            decode = self.decode_seconds(frames, screen_size)
+            if 'gif' in self.formats and self.palette == "global":
+                # The full render may build its palette from more frames, found by seeking
+                setup += min(self.palette_sample_frames * self.seek_seconds, decode)
+        setup += time.perf_counter() - started
+
+        sizes = [(np.mean(sample.first_bytes[kind]) + (frames - 1) * np.mean(sample.added_bytes[kind] or [0]))
+                 * pixels for kind in self.formats]
+        frame_seconds = sample.frame_seconds * pixels
+        if self.video and (os.cpu_count() or 1) > 1:
+            # ffmpeg decodes in a process of its own, alongside the framing
+            seconds = setup + max(decode, frames * frame_seconds)
+        elif self.video:
+            seconds = setup + decode + frames * frame_seconds
+        else:
+            seconds = setup + frames * (frame_seconds + self.decode_frame_seconds)
+        estimate = Estimate(int(max(sizes)), seconds, frames)
+        self.estimates[candidate] = estimate
+        return estimate
+
+    def render_sample(self, candidate):
+        """Frame and encode the sample runs with a candidate's settings and return the Sample measured"""
+        started = time.perf_counter()
+        asset = self.scaled_asset(candidate.scale)
+        runs = [self._pick(run, candidate.fps) for run in self._runs]
+        setup = time.perf_counter() - started
+        palette = None
+        if 'gif' in self.formats and self.palette == "global":
+            sampled = [pixels for run in runs for pixels, _ in run]
+            count = max(1, min(self.palette_sample_frames, len(sampled)))
+            started = time.perf_counter()
+            picked = [sampled[int(number * len(sampled) / count)] for number in range(count)]
+            palette = GlobalPalette.build(picked, static_image=asset.image, screen_rect=asset.screen_rect,
+                                          colors=candidate.colors, sample_pixels=self.palette_sample_pixels,
+                                          dither=self.dither)
+            # The full render may build its palette from more frames
+            setup += (time.perf_counter() - started) * max(1.0, self.palette_sample_frames / count)
+        frame_rate = candidate.fps if self.video else frame_rate_for(gif_durations(self.input_path))
+
+        compositor = Compositor.from_asset(asset, batch_size=1)
+        first_sizes = {kind: [] for kind in self.formats}
+        added_sizes = {kind: [] for kind in self.formats}
+        work = 0.0
+        with tempfile.TemporaryDirectory(prefix='gifframingtool-budget-') as work_dir:
+            for number, run in enumerate(runs):
+                paths = {kind: os.path.join(work_dir, f"{number}{FORMAT_EXTENSIONS[kind]}")
+                         for kind in self.formats}
+                firsts = {kind: os.path.join(work_dir, f"{number}-first{FORMAT_EXTENSIONS[kind]}")
+                          for kind in self.formats}
+                # Only the run itself counts as work; the single-frame files
+                # that split off the size of the first frame don't
+                started = time.perf_counter()
+                writers = [self._writer(path, kind, asset, palette, frame_rate) for kind, path in paths.items()]
+                for index, (pixels, duration) in enumerate(run):
+                    paused = time.perf_counter()
+                    screen = self._resized(pixels, asset.screen_size)
+                    if self.video:
+                        # Renders of videos have ffmpeg scale them while decoding
+                        started += time.perf_counter() - paused
+                    framed = compositor.composite(screen)
+                    for writer in writers:
+                        writer.add_frame(framed, duration)
+                    if index == 0:
+                        paused = time.perf_counter()
+                        for kind, path in firsts.items():
+                            with self._writer(path, kind, asset, palette, frame_rate) as first:
+                                first.add_frame(framed, duration)
+                        started += time.perf_counter() - paused
+                for writer in writers:
+                    writer.close()
+                work += time.perf_counter() - started
+                for kind in self.formats:
+                    first_size = os.path.getsize(firsts[kind])
+                    first_sizes[kind].append(first_size)
+                    if len(run) > 1:
+                        added_sizes[kind].append((os.path.getsize(paths[kind]) - first_size) / (len(run) - 1))
+        return Sample(first_sizes, added_sizes, work / sum(len(run) for run in runs), setup)
+
+    def scaled_asset(self, scale):
+        """The device frame at an output scale, scaled once for every candidate that has it"""
+        if scale not in self._assets:
+            # A draft scale only changes the bezel's edges, which the output stores once
+            self._assets[scale] = self.asset.scaled(scale, draft=True)
+        return self._assets[scale]
+
+    def scaled_sizes(self, scale):
+        """(framed size, screen size) at an output scale, without scaling the device frame"""
+        _, _, width, height = self.asset.screen_rect
+        return ([max(1, round(side * scale)) for side in self.asset.size],
+                (max(1, round(width * scale)), max(1, round(height * scale))))
+
+    def frame_count(self, candidate):
+        """Number of output frames a render with the candidate's settings has"""
+        if self.video:
+            return VideoFrameReader(self.input_path, candidate.fps, meta=self.meta, start=self.start,
+                                    end=self.end).estimate_frame_count()
+        return len(frames_in_range(gif_durations(self.input_path), self.start, self.end))
+
+    def sample(self, top):
+        """Decode the sample runs at the frame rate of the top candidate, and its size up to SAMPLE_PIXELS.
+
+        Returns:
+            A list of runs, each a list of (RGB or RGBA array, duration in ms)
+        """
+        self.sample_scale = top.scale * min(1.0, math.sqrt(SAMPLE_PIXELS / _area(self.scaled_sizes(top.scale)[0])))
+        size = self.scaled_asset(self.sample_scale).screen_size
+        if self.video:
+            return self._sample_video(top.fps, size)
+        return self._sample_gif()
+
+    def _sample_video(self, fps, size):
+        self.meta = probe_video(self.input_path)
+        start = self.start or 0
+        end = self.meta.get('duration') or 0
+        if self.end is not None:
+            end = min(end, self.end) if end else self.end
+        self.range_seconds = max(0.0, end - start)
+        run_seconds = SAMPLE_RUN_FRAMES / fps
+        if self.range_seconds <= run_seconds * SAMPLE_RUNS:
+            # Too short to spread runs over, so take it from the start
+            starts, limit = [start], SAMPLE_RUN_FRAMES * SAMPLE_RUNS
+        else:
+            spacing = (self.range_seconds - run_seconds) / SAMPLE_RUNS
+            starts, limit = [start + (number + 0.5) * spacing for number in range(SAMPLE_RUNS)], SAMPLE_RUN_FRAMES
+
+        # Decoding costs time per second of video, whatever is kept of it, and
+        # scaling and passing on the kept frames time per frame and pixel. The
+        # first is timed on tiny frames, the rest of the runs' time is the second.
+        middle = start + self.range_seconds / 2
+        span = min(DECODE_SAMPLE_SECONDS, self.range_seconds / 2)
+        self.seek_seconds, self.decode_rate = self._time_decode(
+            VideoFrameReader(self.input_path, None, (16, 16), meta=self.meta, start=middle, end=middle + span))
+
+        runs, frame_costs = [], []
+        duration = 1000.0 / fps
+        for run_start in starts:
+            reader = VideoFrameReader(self.input_path, fps, size, meta=self.meta, start=run_start,
+                                      end=self.end, limit=limit)
+            run = []
+            seek, rate = self._time_decode(reader, run, duration)
+            if run:
+                runs.append(run)
+            if len(run) > 1:
+                frame_costs.append(max(0.0, rate - self.decode_rate) / fps)
+        if not runs:
+            raise ValueError("The input has no frames in the selected time range")
+        self.frame_decode_seconds = float(np.mean(frame_costs)) if frame_costs else 0.0
+        self.sampled_pixels = size[0] * size[1]
+        return runs
+
+    @staticmethod
+    def _time_decode(reader, frames=None, duration=None):
+        """Read every frame of a reader; return the seconds to the first frame and per second of video after it"""
+        started = time.perf_counter()
+        first, count = None, 0
+        for _, pixels, _ in reader:
+            if first is None:
+                first = time.perf_counter()
+            count += 1
+            if frames is not None:
+                frames.append((pixels, duration))
+        if first is None:
+            return time.perf_counter() - started, 0.0
+        seconds = (count - 1) / reader.frame_rate
+        return first - started, (time.perf_counter() - first) / seconds if seconds else 0.0
+
+    def decode_seconds(self, frames, screen_size):
+        """Seconds ffmpeg takes to decode the whole range into frames of a screen size"""
+        pixels = screen_size[0] * screen_size[1] / self.sampled_pixels
+        return (self.seek_seconds + self.decode_rate * self.range_seconds
+                + frames * self.frame_decode_seconds * pixels)
+
+    def _sample_gif(self):
+        indices = frames_in_range(gif_durations(self.input_path), self.start, self.end)
+        if not indices:
+            raise ValueError("The input has no frames in the selected time range")
+        if len(indices) <= SAMPLE_RUN_FRAMES * SAMPLE_RUNS:
+            runs = [indices]
+        else:
+            spacing = (len(indices) - SAMPLE_RUN_FRAMES) / SAMPLE_RUNS
+            runs = [indices[int((number + 0.5) * spacing):][:SAMPLE_RUN_FRAMES] for number in range(SAMPLE_RUNS)]
+
+        sampled = []
+        started = time.perf_counter()
+        with Image.open(self.input_path) as im:
+            for run in runs:
+                frames = []
+                for index in run:
+                    im.seek(index)
+                    frames.append((np.asarray(im.convert("RGBA")), im.info.get('duration') or DEFAULT_DURATION))
+                sampled.append(frames)
+        # Seeking a GIF decodes every frame before the one sought
+        self.decode_frame_seconds = (time.perf_counter() - started) / (runs[-1][-1] + 1)
+        return sampled
+
+    def _pick(self, run, fps):
+        """The frames of a run a lower frame rate keeps, with their longer durations"""
+        if not self.video or not run:
+            return run
+        base = 1000.0 / run[0][1]
+        if fps >= base:
+            return run
+        indices = sorted(set(int(round(number * base / fps)) for number in range(int(len(run) * fps / base) + 1)))
+        return [(run[index][0], 1000.0 / fps) for index in indices if index < len(run)]
+
+    @staticmethod
+    def _resized(pixels, size):
+        if pixels.shape[1::-1] == tuple(size):
+            return pixels
+        return np.asarray(Image.fromarray(pixels).resize(size, Image.Resampling.LANCZOS))
+
+    @staticmethod
+    def _writer(path, kind, asset, palette, frame_rate):
+        if kind == 'gif':
+            return StreamingGifWriter(path, palette=palette, static_region=asset.screen_rect)
+        return FfmpegEncoder(path, asset.size, frame_rate, format=kind)
+
+
+def _area(size):
+    return size[0] * size[1]
@@ -0,0 +1,207 @@
+import functools
+import numpy as np
+from PIL import Image, ImageDraw
+
+from utils.metrics import DISABLED
+
+
+@functools.lru_cache(maxsize=16)
+def corner_mask(size, radius):
+    """Return the rounded-corner alpha mask for a (width, height) screen.
+
+    The mask is built once per (size, radius) and shared, so it is
+    returned read-only as a (height, width) uint8 array.
+    """
+    w, h = size
+    circle = Image.new('L', (radius * 2, radius * 2), 0)
+    draw = ImageDraw.Draw(circle)
+    draw.ellipse((0, 0, radius * 2, radius * 2), fill=255)
+    alpha = Image.new('L', (w, h), 255)
+    alpha.paste(circle.crop((0, 0, radius, radius)), (0, 0))
+    alpha.paste(circle.crop((0, radius, radius, radius * 2)), (0, h - radius))
+    alpha.paste(circle.crop((radius, 0, radius * 2, radius)), (w - radius, 0))
+    alpha.paste(circle.crop((radius, radius, radius * 2, radius * 2)), (w - radius, h - radius))
+    mask = np.array(alpha, dtype=np.uint8)
+    mask.flags.writeable = False
+    return mask
+
+
+def _div255(values):
+    """Exact round(values / 255) for uint16 arrays, done in place."""
+    values += 128
+    values += values >> 8
+    values >>= 8
+    return values
+
+
+class Compositor:
+    """Composites batches of screen frames onto a device frame with NumPy.
+
+    Output frames are written into a ring of preallocated buffers that
+    already hold the device frame, so each batch only rewrites the screen
+    area and nothing is allocated per frame. A returned batch stays valid
+    until ``ring_size`` more batches have been composited.
+    """
+
+    def __init__(self, frame_image, screen_size=(2257, 4854), radius=275, batch_size=2, ring_size=1,
+                 position=None, metrics=None):
+        self.background = np.array(frame_image.convert("RGBA"), dtype=np.uint8)
+        frame_h, frame_w = self.background.shape[:2]
+        self.screen_size = tuple(screen_size)
+        self.radius = radius
+        self.batch_size = batch_size
+        # Copying frames in counts as "composite", blending the rounded corners as "mask"
+        self.metrics = metrics or DISABLED
+
+        # Screen placement, centered on the device frame unless given
+        screen_w, screen_h = self.screen_size
+        if position is None:
+            position = ((frame_w - screen_w) // 2, (frame_h - screen_h) // 2)
+        self.position = tuple(position)
+        self._screen = (
+            slice(self.position[1], self.position[1] + screen_h),
+            slice(self.position[0], self.position[0] + screen_w),
+        )
+        self.mask = corner_mask(screen_size, radius)
+        self._background_screen = self.background[self._screen]
+        self._opaque_background = bool(self._background_screen[..., 3].min() == 255)
+
+        # Only the four corner squares of the mask are partially transparent
+        self._corners = [
+            (slice(y, y + radius), slice(x, x + radius))
+            for y in (0, screen_h - radius) for x in (0, screen_w - radius)
+        ] if 0 < radius <= min(screen_w, screen_h) // 2 else None
+        # The bezel's share of each blended corner pixel never changes
+        self._corner_bezel = [
+            self._background_screen[corner][..., :3] * (255 - self.mask[corner][..., np.newaxis]).astype(np.uint16)
+            for corner in self._corners or ()
+        ]
+
+        self._ring = [
+            np.repeat(self.background[np.newaxis], batch_size, axis=0)
+            for _ in range(ring_size)
+        ]
+        self._next_buffer = 0
+        self._work = {}
+
+    @classmethod
+    def from_asset(cls, asset, **kwargs):
+        """Create a compositor for a FrameAsset's detected screen"""
+        return cls(asset.image, asset.screen_size, asset.radius, position=asset.screen_position, **kwargs)
+
+    @property
+    def frame_size(self):
+        return (self.background.shape[1], self.background.shape[0])
+
+    def composite_batch(self, screens, out=None):
+        """Composite a stack of screen frames.
+
+        Args:
+            screens: uint8 array of shape (n, height, width, 3 or 4) matching screen_size
+            out: Optional (n, frame_height, frame_width, 4) buffer to write into
+                 instead of the ring; it must already hold the device frame
+
+        Returns:
+            uint8 array of shape (n, frame_height, frame_width, 4)
+        """
+        screens = np.asarray(screens)
+        count = screens.shape[0]
+        if count > self.batch_size:
+            raise ValueError(f"Batch of {count} frames exceeds batch size {self.batch_size}")
+        if screens.shape[1:3] != self.mask.shape:
+            raise ValueError(f"Screen frames must be {self.screen_size[0]}x{self.screen_size[1]}")
+
+        if out is None:
+            if not self._ring:
+                raise ValueError("Compositor has no output buffers, pass out=")
+            out = self._ring[self._next_buffer][:count]
+            self._next_buffer = (self._next_buffer + 1) % len(self._ring)
+        out_screen = out[(slice(None),) + self._screen]
+
+        opaque_source = screens.shape[3] == 3 or screens[..., 3].min() == 255
+        if opaque_source and (self._corners or self.radius <= 0):
+            # Inside the rounded corners the frame simply replaces the screen,
+            # whether or not the device frame shows through there
+            with self.metrics.stage("composite", count):
+                out_screen[..., :3] = screens[..., :3]
+                out_screen[..., 3] = 255
+            with self.metrics.stage("mask", count):
+                for corner, bezel in zip(self._corners or (), self._corner_bezel):
+                    region = (slice(None),) + corner
+                    if self._opaque_background:
+                        self._blend_corner(screens[region][..., :3], self.mask[corner], bezel, out_screen[region])
+                    else:
+                        alpha = np.broadcast_to(self.mask[corner], (count,) + self.mask[corner].shape)
+                        self._blend(screens[region][..., :3], alpha, out_screen[region],
+                                    self._background_screen[corner])
+            return out
+
+        with self.metrics.stage("mask", count):
+            alpha = self._buffer("alpha", (count,) + self.mask.shape)
+            np.multiply(self.mask, screens[..., 3] if screens.shape[3] == 4 else 255, out=alpha, dtype=np.uint16)
+            _div255(alpha)
+        with self.metrics.stage("composite", count):
+            if self._opaque_background:
+                self._blend_opaque(screens[..., :3], alpha, out_screen, self._background_screen)
+            else:
+                self._blend(screens[..., :3], alpha, out_screen, self._background_screen)
+        return out
+
+    def composite(self, screen):
+        """Composite a single screen frame and return it as an RGBA image."""
+        out = self.composite_batch(np.asarray(screen)[np.newaxis])
+        return Image.fromarray(out[0]).copy()
+
+    def _buffer(self, name, shape):
+        """Return a reusable uint16 scratch buffer of at least the given shape."""
+        buffer = self._work.get(name)
+        if buffer is None or buffer.shape[1:] != shape[1:] or buffer.shape[0] < shape[0]:
+            buffer = np.empty((max(shape[0], self.batch_size),) + shape[1:], dtype=np.uint16)
+            self._work[name] = buffer
+        return buffer[:shape[0]]
+
+    def _blend_corner(self, rgb, mask, bezel, out):
+        # out = (src * mask + precomputed bezel term) / 255
+        work = self._buffer(f"work{rgb.shape[1:]}", rgb.shape)
+        np.multiply(rgb, mask[..., np.newaxis], out=work, dtype=np.uint16)
+        work += bezel
+        _div255(work)
+        out[..., :3] = work
+
+    def _blend_opaque(self, rgb, alpha, out, background):
+        # out = (src * a + bg * (255 - a)) / 255, kept in uint16
+        shape = rgb.shape
+        work = self._buffer(f"work{shape[1:]}", shape)
+        blend = self._buffer(f"blend{shape[1:]}", shape)
+        inverse = self._buffer(f"inverse{shape[1:]}", shape[:3])
+        np.subtract(255, alpha, out=inverse, dtype=np.uint16)
+        np.multiply(rgb, alpha[..., np.newaxis], out=work, dtype=np.uint16)
+        np.multiply(background[..., :3], inverse[..., np.newaxis], out=blend, dtype=np.uint16)
+        work += blend
+        _div255(work)
+        out[..., :3] = work
+        out[..., 3] = 255
+
+    def _blend(self, rgb, alpha, out, background):
+        # Full "over" operator for device frames with see-through screens,
+        # kept in uint16: the background's weight is bg_a * (255 - a) / 255,
+        # so a + weight <= 255 and src * a + bg * weight never exceeds 255 * 255
+        shape = rgb.shape
+        work = self._buffer(f"work{shape[1:]}", shape)
+        blend = self._buffer(f"blend{shape[1:]}", shape)
+        weight = self._buffer(f"inverse{shape[1:]}", shape[:3])
+        out_alpha = self._buffer(f"out_alpha{shape[1:]}", shape[:3])
+        np.subtract(255, alpha, out=weight, dtype=np.uint16)
+        weight *= background[..., 3]
+        _div255(weight)
+        np.add(alpha, weight, out=out_alpha, dtype=np.uint16)
+        np.multiply(rgb, alpha[..., np.newaxis], out=work, dtype=np.uint16)
+        np.multiply(background[..., :3], weight[..., np.newaxis], out=blend, dtype=np.uint16)
+        work += blend
+        # Un-premultiply with rounding; fully transparent pixels stay black
+        np.right_shift(out_alpha, 1, out=weight)
+        work += weight[..., np.newaxis]
+        np.maximum(out_alpha, 1, out=weight)
+        np.floor_divide(work, weight[..., np.newaxis], out=work)
+        out[..., :3] = work
+        out[..., 3] = out_alpha
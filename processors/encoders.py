@@ -0,0 +1,203 @@
+import math
+import os
+import subprocess
+import tempfile
+import numpy as np
+from PIL import Image
+
+from processors.video_reader import FFMPEG_AVAILABLE, ffmpeg_exe
+from utils.metrics import DISABLED
+
+# Output formats by file extension, and the extension cached renders of each format get
+OUTPUT_FORMATS = {'.gif': 'gif', '.webp': 'webp', '.png': 'apng', '.apng': 'apng', '.mp4': 'mp4'}
+FORMAT_EXTENSIONS = {'gif': '.gif', 'webp': '.webp', 'apng': '.png', 'mp4': '.mp4'}
+
+# Fastest tick ffmpeg encoders are fed at when frame durations have no common divisor
+MAX_FRAME_RATE = 50
+
+
+def output_format(path):
+    """Return the animation format written for an output path, going by its extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in OUTPUT_FORMATS:
+        supported = ', '.join(sorted(OUTPUT_FORMATS))
+        raise ValueError(f"Unsupported output type '{extension or path}', use one of {supported}")
+    return OUTPUT_FORMATS[extension]
+
+
+def frame_rate_for(durations, limit=MAX_FRAME_RATE):
+    """Return the slowest constant frame rate that shows frames of the given durations (ms) exactly"""
+    step = 0
+    for duration in durations:
+        step = math.gcd(step, int(duration))
+    if not step:
+        return 10
+    return min(limit, 1000 / step)
+
+
+class FfmpegEncoder:
+    """Writes an animated WebP, APNG or H.264 MP4 with one ffmpeg process, fed RGBA frames over a pipe.
+
+    ffmpeg reads frames at a constant rate, so every frame is written once
+    per tick of ``frame_rate`` its duration covers, rounded against the
+    running total so long animations don't drift. WebP folds the repeats
+    back into one frame and H.264 stores them almost for free; APNG keeps
+    them as frames of their own, which is why the rate is the slowest one
+    that fits the durations.
+    """
+
+    FORMAT_OPTIONS = {
+        'webp': ['-c:v', 'libwebp_anim', '-quality', '80', '-loop', '0', '-pix_fmt', 'yuva420p', '-f', 'webp'],
+        'apng': ['-c:v', 'apng', '-plays', '0', '-pix_fmt', 'rgba', '-f', 'apng'],
+        'mp4': ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '20', '-pix_fmt', 'yuv420p',
+                '-movflags', '+faststart', '-f', 'mp4'],
+    }
+
+    def __init__(self, output_path, size, frame_rate=10, duration=100, format=None, background='white',
+                 metrics=None):
+        """
+        Args:
+            output_path: File to write
+            size: (width, height) of every frame
+            frame_rate: Ticks per second that frame durations are rounded to
+            duration: Frame duration in ms when add_frame is given none
+            format: 'webp', 'apng' or 'mp4', by default from the output path
+            background: ffmpeg color MP4 frames are flattened onto, as H.264 has no alpha
+            metrics: PerfRecorder; time spent handing frames to ffmpeg counts as "encode"
+        """
+        self.output_path = output_path
+        self.format = format or output_format(output_path)
+        if self.format not in self.FORMAT_OPTIONS:
+            raise ValueError(f"ffmpeg does not write {self.format} here")
+        if not FFMPEG_AVAILABLE:
+            raise RuntimeError(f"Writing {self.format} needs imageio-ffmpeg: pip install imageio-ffmpeg")
+        self.size = tuple(size)
+        self.frame_rate = frame_rate
+        self.duration = duration
+        self.background = background
+        self.metrics = metrics or DISABLED
+        self.frame_count = 0
+        self._elapsed_ms = 0
+        self._process = None
+        self._errors = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._kill()
+            if self._errors is not None:
+                self._errors.close()
+
+    def command(self):
+        width, height = self.size
+        rate = f"{self.frame_rate:g}"
+        command = [ffmpeg_exe(), '-nostdin', '-v', 'error', '-y',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f"{width}x{height}", '-r', rate, '-i', '-']
+        if self.format == 'mp4':
+            # Flatten onto a background canvas, rounded up to the even size H.264 needs
+            canvas = f"{width + width % 2}x{height + height % 2}"
+            command += ['-filter_complex',
+                        f"color=c={self.background}:s={canvas}:r={rate}[bg];[bg][0:v]overlay=shortest=1"]
+        return command + self.FORMAT_OPTIONS[self.format] + [self.output_path]
+
+    def add_frame(self, frame, duration=None):
+        """Write an RGBA frame (image or uint8 array) shown for duration ms"""
+        duration = self.duration if duration is None else duration
+        if isinstance(frame, Image.Image):
+            frame = frame.convert("RGBA")
+        pixels = np.ascontiguousarray(frame, dtype=np.uint8)
+        if pixels.shape != (self.size[1], self.size[0], 4):
+            raise ValueError(f"Frames must be {self.size[0]}x{self.size[1]} RGBA")
+
+        ticks_before = round(self._elapsed_ms * self.frame_rate / 1000)
+        self._elapsed_ms += duration
+        repeats = round(self._elapsed_ms * self.frame_rate / 1000) - ticks_before
+        if self._process is None:
+            # A frame shorter than a tick may be dropped, but never the first one
+            repeats = max(1, repeats)
+            self._start()
+
+        data = memoryview(pixels).cast('B')
+        with self.metrics.stage("encode", 1):
+            try:
+                for _ in range(repeats):
+                    self._process.stdin.write(data)
+            except OSError:
+                raise self._failure() from None
+        self.frame_count += 1
+
+    def close(self):
+        """Let ffmpeg finish the file"""
+        if self._process is None:
+            raise ValueError(f"No frames were written to the {self.format.upper()}")
+        with self.metrics.stage("encode"):
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+            returncode = self._process.wait()
+        if returncode != 0:
+            raise self._failure()
+        self._process = None
+        self._errors.close()
+
+    def _start(self):
+        # A file rather than a pipe, so a chatty ffmpeg can never block on it
+        self._errors = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(self.command(), stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                         stderr=self._errors)
+
+    def _failure(self):
+        self._kill()
+        self._errors.seek(0)
+        message = self._errors.read().decode('utf-8', 'replace').strip()
+        self._errors.close()
+        return RuntimeError(f"ffmpeg could not write {self.output_path}: {message}")
+
+    def _kill(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        if process.poll() is None:
+            process.kill()
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        process.wait()
+
+
+class FanOutWriter:
+    """Hands every frame to several writers, so one pass of decoding and compositing feeds them all"""
+
+    def __init__(self, writers):
+        self.writers = list(writers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            for writer in self.writers:
+                writer.__exit__(exc_type, exc_value, traceback)
+
+    def add_frame(self, frame, duration=None):
+        for writer in self.writers:
+            writer.add_frame(frame, duration)
+
+    def close(self):
+        # Every writer gets to finish its file before the first error is raised
+        error = None
+        for writer in self.writers:
+            try:
+                writer.close()
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
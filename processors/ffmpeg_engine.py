@@ -0,0 +1,230 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+
+from processors.compositor import corner_mask
+from processors.encoders import FfmpegEncoder
+from processors.frame_source import frames_in_range, gif_durations
+from processors.video_reader import FFMPEG_AVAILABLE, ffmpeg_exe
+from utils.metrics import DISABLED
+
+# Rendering engines GifProcessor can use
+ENGINES = ('pillow', 'ffmpeg')
+
+
+class FilterGraphRenderer:
+    """Renders a whole job with one ffmpeg process running one filter graph.
+
+    The graph samples the input at fps, scales it to the screen, gives it
+    the rounded corners, places it in the device frame and maps it to the
+    palette, then writes every output from the same frames. Pixels never
+    pass through Python, and frames stream through the graph: a global
+    palette is the GlobalPalette sampled up front, because palettegen would
+    hold back every frame until it has seen the last one. Adaptive palettes
+    come from palettegen one frame at a time.
+
+    The device frame is laid over the screen rather than the other way
+    round, so the output takes its timestamps from the input. Their alpha
+    channels are prepared here so that the result is the screen "over" the
+    frame, as the Compositor blends it. The content's own transparency and
+    merging of duplicate frames are left out, and ffmpeg's GIF encoder only
+    stores the changed part of frames without see-through pixels, so GIFs
+    of frames with a transparent surround are larger than Pillow's.
+    """
+
+    def __init__(self, asset, fps=None, start=None, end=None, palette=None, colors=256, dither=False,
+                 frame_rate=None, background='white', metrics=None):
+        """
+        Args:
+            asset: FrameAsset at output size
+            fps: Rate to sample video inputs at, or None to keep every frame
+            start, end: Part of the input to render, in seconds
+            palette: GlobalPalette for GIF outputs, or None for one palette per frame
+            colors: Palette size of per-frame palettes
+            dither: Dither GIF frames to their palette
+            frame_rate: Constant rate GIF inputs are rendered at when there is a WebP, APNG or MP4 output
+            background: Color MP4 frames are flattened onto, as H.264 has no alpha
+            metrics: PerfRecorder; the whole ffmpeg run counts as "render"
+        """
+        if not FFMPEG_AVAILABLE:
+            raise RuntimeError("The ffmpeg engine needs imageio-ffmpeg: pip install imageio-ffmpeg")
+        self.asset = asset
+        self.fps = fps
+        self.start = start
+        self.end = end
+        self.palette = palette
+        self.colors = colors
+        self.dither = dither
+        self.frame_rate = frame_rate
+        self.background = background
+        self.metrics = metrics or DISABLED
+
+    def layers(self):
+        """Return the device frame and the screen alpha, prepared for laying the frame over the screen.
+
+        Returns:
+            (frame, screen_alpha): an RGBA array of the frame whose screen
+            area is as see-through as the screen covers it, and a uint8
+            mask the screen gets as its alpha channel
+        """
+        frame = np.array(self.asset.image, dtype=np.uint8)
+        x, y, width, height = self.asset.screen_rect
+        mask = corner_mask((width, height), self.asset.radius).astype(np.float32) / 255
+        region = frame[y:y + height, x:x + width]
+        bezel = region[..., 3].astype(np.float32) / 255
+
+        # Frame over screen equals screen over frame when the frame keeps
+        # bezel * (1 - mask) of its alpha and the screen makes up the rest
+        covered = bezel * (1 - mask)
+        remaining = 1 - covered
+        screen_alpha = np.divide(mask, remaining, out=np.ones_like(mask), where=remaining > 0)
+        region[..., 3] = np.round(covered * 255)
+        return frame, np.round(np.clip(screen_alpha, 0, 1) * 255).astype(np.uint8)
+
+    def palette_image(self):
+        """The global palette as the 16x16 RGBA image paletteuse reads, transparent entry included"""
+        colors = self.palette.colors
+        entries = np.zeros((256, 4), dtype=np.uint8)
+        entries[:len(colors), :3] = colors
+        entries[:len(colors), 3] = 255
+        # paletteuse wants 256 entries, so unused ones repeat the first color
+        entries[len(colors):] = entries[0]
+        if self.palette.transparent_index is not None:
+            entries[self.palette.transparent_index] = 0
+        return entries.reshape(16, 16, 4)
+
+    def filter_graph(self, formats, video_input=True):
+        """Build the filter_complex graph with one labelled output per format, [out0], [out1], ..."""
+        x, y, width, height = self.asset.screen_rect
+        frame_width, frame_height = self.asset.size
+        dither = 'floyd_steinberg' if self.dither else 'none'
+
+        screen = [f"scale={width}:{height}:flags=lanczos", "format=rgba"]
+        if video_input and self.fps:
+            screen.insert(0, f"fps={self.fps:g}")
+        elif not video_input and self.frame_rate and set(formats) - {'gif'}:
+            # GIF timing is variable, but WebP, APNG and MP4 are written at a
+            # constant rate. Only the input still knows how long its last
+            # frame lasts, so the rate is set before anything else.
+            screen.insert(0, f"fps={self.frame_rate:g}")
+        graph = [
+            f"[0:v]{','.join(screen)}[screen]",
+            f"[screen][2:v]alphamerge,pad={frame_width}:{frame_height}:{x}:{y}:color=black@0[placed]",
+            f"[placed][1:v]overlay=0:0:format=rgb,format=rgba,split={len(formats)}"
+            + ''.join(f"[framed{index}]" for index in range(len(formats))),
+        ]
+        for index, kind in enumerate(formats):
+            source, out = f"[framed{index}]", f"[out{index}]"
+            if kind == 'gif' and self.palette is not None:
+                graph.append(f"{source}[3:v]paletteuse=dither={dither}:alpha_threshold=128{out}")
+            elif kind == 'gif':
+                graph.append(f"{source}split[pick{index}][map{index}];"
+                             f"[pick{index}]palettegen=max_colors={self.colors}:reserve_transparent=1:"
+                             f"stats_mode=single[palette{index}];"
+                             f"[map{index}][palette{index}]paletteuse=new=1:dither={dither}:"
+                             f"alpha_threshold=128{out}")
+            elif kind == 'mp4':
+                # Flatten onto a background made from the frames themselves, so
+                # it has their timestamps, on the even size H.264 needs
+                graph.append(f"{source}pad=ceil(iw/2)*2:ceil(ih/2)*2:0:0:color=black@0,"
+                             f"split[bg{index}][fg{index}];"
+                             f"[bg{index}]drawbox=color={self.background}:t=fill:replace=1[canvas{index}];"
+                             f"[canvas{index}][fg{index}]overlay=0:0{out}")
+            else:
+                graph.append(f"{source}null{out}")
+        return ';'.join(graph)
+
+    def trim_options(self, input_path, video_input=True):
+        """Return the input options that cut the input to start..end"""
+        start, end = self.start, self.end
+        if not video_input and (start is not None or end is not None):
+            # Seek to where the first frame trim_frames keeps begins, so the
+            # frame straddling start is kept, though with its whole duration
+            durations = gif_durations(input_path)
+            indices = frames_in_range(durations, start, end)
+            if not indices:
+                raise ValueError("The input has no frames in the selected time range")
+            start = sum(durations[:indices[0]]) / 1000
+
+        options = []
+        if start:
+            options += ['-ss', f"{start:.3f}"]
+        if end is not None:
+            options += ['-t', f"{end - (start or 0):.3f}"]
+        return options
+
+    def command(self, input_path, outputs, layer_paths, video_input=True):
+        """Build the ffmpeg command for (path, format) outputs, given the raw frame, mask and palette files"""
+        frame_width, frame_height = self.asset.size
+        _, _, width, height = self.asset.screen_rect
+        trim = self.trim_options(input_path, video_input)
+
+        command = [ffmpeg_exe(), '-nostdin', '-v', 'error', '-y', '-nostats',
+                   '-progress', 'pipe:1', *trim, '-i', input_path,
+                   '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f"{frame_width}x{frame_height}",
+                   '-i', layer_paths['frame'],
+                   '-f', 'rawvideo', '-pix_fmt', 'gray', '-s', f"{width}x{height}", '-i', layer_paths['mask']]
+        if 'palette' in layer_paths:
+            command += ['-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '16x16', '-i', layer_paths['palette']]
+
+        formats = [kind for _, kind in outputs]
+        command += ['-filter_complex', self.filter_graph(formats, video_input)]
+        for index, (path, kind) in enumerate(outputs):
+            command += ['-map', f"[out{index}]"]
+            if kind == 'gif':
+                command += ['-f', 'gif', '-loop', '0', path]
+            else:
+                command += FfmpegEncoder.FORMAT_OPTIONS[kind] + [path]
+        return command
+
+    def render(self, input_path, outputs, video_input=True, progress=None):
+        """Write (path, format) outputs from input_path in one ffmpeg run.
+
+        Outputs of the same format are rendered once and copied. progress
+        is called with the number of frames rendered so far.
+        """
+        outputs = list(outputs)
+        first_paths = {}
+        for path, kind in outputs:
+            first_paths.setdefault(kind, path)
+        rendered = [(path, kind) for kind, path in first_paths.items()]
+
+        with tempfile.TemporaryDirectory(prefix='gifframingtool-') as work_dir:
+            frame, screen_alpha = self.layers()
+            layers = {'frame': frame, 'mask': screen_alpha}
+            if self.palette is not None and 'gif' in first_paths:
+                layers['palette'] = self.palette_image()
+            layer_paths = {}
+            for name, pixels in layers.items():
+                layer_paths[name] = os.path.join(work_dir, f"{name}.raw")
+                with open(layer_paths[name], 'wb') as f:
+                    f.write(np.ascontiguousarray(pixels).tobytes())
+
+            command = self.command(input_path, rendered, layer_paths, video_input)
+            with self.metrics.stage("render"), tempfile.TemporaryFile() as errors:
+                self._run(command, errors, progress)
+
+        for path, kind in outputs:
+            if path != first_paths[kind]:
+                shutil.copyfile(first_paths[kind], path)
+
+    def _run(self, command, errors, progress):
+        # Errors go to a file rather than a pipe, so ffmpeg can never block on them
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=errors)
+        try:
+            for line in process.stdout:
+                key, _, value = line.decode('ascii', 'replace').strip().partition('=')
+                if key == 'frame' and progress and value.isdigit():
+                    progress(int(value))
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            errors.seek(0)
+            message = errors.read().decode('utf-8', 'replace').strip()
+            raise RuntimeError(f"ffmpeg could not render the output: {message}")
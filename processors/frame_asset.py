@@ -0,0 +1,194 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import numpy as np
+from PIL import Image
+
+from utils.file_utils import get_cache_dir
+
+# Layout of the bundled frame.png, used when no screen can be detected
+DEFAULT_SCREEN_SIZE = (2257, 4854)
+DEFAULT_RADIUS = 275
+
+# Per-channel difference still counted as part of a solid placeholder screen
+COLOR_TOLERANCE = 8
+
+_index_lock = threading.Lock()
+
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FrameAsset:
+    """A device frame image and the screen area inside it.
+
+    The screen is either a transparent hole in the frame or a solid
+    placeholder color in its middle. Detection results are stored in an
+    on-disk index keyed by the image's hash, so each frame PNG is only
+    analysed once.
+    """
+
+    INDEX_FILE = 'frame_index.json'
+
+    def __init__(self, image, screen_rect, radius):
+        self.image = image.convert("RGBA")
+        # (x, y, width, height) of the screen inside the frame image
+        self.screen_rect = tuple(screen_rect)
+        self.radius = radius
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def screen_size(self):
+        return self.screen_rect[2:]
+
+    @property
+    def screen_position(self):
+        return self.screen_rect[:2]
+
+    def scaled(self, scale, draft=False):
+        """Return this asset with its image, screen and corner radius scaled together.
+
+        Screen edges are rounded to whole pixels on their own, so the scaled
+        screen stays aligned with the hole or placeholder in the scaled image.
+        draft trades quality for speed, for previews.
+        """
+        if scale <= 0:
+            raise ValueError("Output scale must be positive")
+        if scale == 1:
+            return self
+
+        width, height = self.size
+        size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        x, y, screen_w, screen_h = self.screen_rect
+        left, top = int(round(x * scale)), int(round(y * scale))
+        right, bottom = int(round((x + screen_w) * scale)), int(round((y + screen_h) * scale))
+        rect = (left, top, max(1, right - left), max(1, bottom - top))
+        radius = min(int(round(self.radius * scale)), min(rect[2], rect[3]) // 2)
+        return FrameAsset(scale_frame_image(self.image, size, draft), rect, radius)
+
+    def scale_for(self, scale=None, max_width=None):
+        """Combine an output scale and a maximum output width into one scale factor"""
+        scale = scale or 1.0
+        if max_width:
+            scale = min(scale, max_width / float(self.size[0]))
+        return scale
+
+    @classmethod
+    def load(cls, frame_path, use_index=True):
+        """Open a frame image and find its screen, using the on-disk index when possible"""
+        image = Image.open(frame_path).convert("RGBA")
+        key = file_hash(frame_path) if use_index else None
+
+        entry = cls._read_index().get(key) if key else None
+        if entry:
+            return cls(image, entry['screen'], entry['radius'])
+
+        screen_rect, radius = cls.detect_screen(image)
+        if key:
+            cls._write_index(key, {'screen': list(screen_rect), 'radius': radius})
+        return cls(image, screen_rect, radius)
+
+    @staticmethod
+    def detect_screen(image):
+        """Find the screen rectangle and corner radius of a frame image.
+
+        Returns:
+            ((x, y, width, height), radius), falling back to the bundled
+            frame's layout centered in the image when nothing is found
+        """
+        pixels = np.asarray(image.convert("RGBA"))
+        height, width = pixels.shape[:2]
+        center_y, center_x = height // 2, width // 2
+
+        if pixels[center_y, center_x, 3] < 128:
+            # A see-through screen
+            screen = pixels[..., 3] < 128
+        else:
+            # A solid placeholder screen, e.g. the bundled frame.png
+            center = pixels[center_y, center_x].astype(np.int16)
+            screen = (np.abs(pixels.astype(np.int16) - center).max(axis=2) <= COLOR_TOLERANCE)
+
+        row = screen[center_y]
+        column = screen[:, center_x]
+        x0, x1 = _run_around(row, center_x)
+        y0, y1 = _run_around(column, center_y)
+        screen_w, screen_h = x1 - x0 + 1, y1 - y0 + 1
+
+        # Anything less than half the frame in either direction is not a screen
+        if screen_w < width // 2 or screen_h < height // 2:
+            screen_w, screen_h = DEFAULT_SCREEN_SIZE
+            rect = ((width - screen_w) // 2, (height - screen_h) // 2, screen_w, screen_h)
+            return rect, DEFAULT_RADIUS
+
+        # A rounded corner of radius r meets the diagonal r * (1 - 1/sqrt(2)) in
+        diagonal = min(screen_w, screen_h) // 2
+        inset = 0
+        while inset < diagonal and not screen[y0 + inset, x0 + inset]:
+            inset += 1
+        radius = int(round(inset / (1 - 1 / math.sqrt(2))))
+        radius = min(radius, min(screen_w, screen_h) // 2)
+
+        return (x0, y0, screen_w, screen_h), radius
+
+    @classmethod
+    def _index_path(cls):
+        return os.path.join(get_cache_dir(), cls.INDEX_FILE)
+
+    @classmethod
+    def _read_index(cls):
+        try:
+            with open(cls._index_path(), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @classmethod
+    def _write_index(cls, key, entry):
+        with _index_lock:
+            index = cls._read_index()
+            index[key] = entry
+            path = cls._index_path()
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(index, f, indent=2)
+                os.replace(tmp_path, path)
+            except OSError:
+                # The index is only an optimisation
+                pass
+
+
+def scale_frame_image(image, size, draft=False):
+    """Resize a device frame image to size, the same way in every process.
+
+    A draft resize first shrinks by a whole factor with a box filter, which
+    is several times faster for large reductions.
+    """
+    image = image.convert("RGBA")
+    if image.size == tuple(size):
+        return image
+    if draft:
+        return image.resize(tuple(size), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return image.resize(tuple(size), Image.Resampling.LANCZOS)
+
+
+def _run_around(line, start):
+    """Return the first and last index of the True run containing ``start``"""
+    if not line[start]:
+        return start, start - 1
+    end_false = np.flatnonzero(~line[start:])
+    last = start + end_false[0] - 1 if len(end_false) else len(line) - 1
+    start_false = np.flatnonzero(~line[:start])
+    first = start_false[-1] + 1 if len(start_false) else 0
+    return int(first), int(last)
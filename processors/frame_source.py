@@ -0,0 +1,126 @@
+import hashlib
+from collections import namedtuple
+import numpy as np
+from PIL import Image, ImageSequence
+
+# Shown when a GIF frame has no (or a zero) duration, like most browsers do
+DEFAULT_DURATION = 100
+
+
+class SourceFrame(namedtuple('SourceFrame', ['image', 'duration', 'count'])):
+    """An input frame with its display time in milliseconds.
+
+    ``count`` is the number of source frames merged into this one when
+    identical consecutive frames are collapsed.
+    """
+    __slots__ = ()
+
+    def __new__(cls, image, duration=DEFAULT_DURATION, count=1):
+        return super().__new__(cls, image, duration, count)
+
+
+def iter_gif_frames(input_gif):
+    """Yield the frames of a GIF one by one as RGBA SourceFrames"""
+    with Image.open(input_gif) as im:
+        for frame in ImageSequence.Iterator(im):
+            duration = frame.info.get('duration') or DEFAULT_DURATION
+            yield SourceFrame(frame.convert("RGBA"), duration)
+
+
+def frame_digest(image):
+    """Cheap content hash of an image or array, used to spot repeated frames"""
+    if isinstance(image, Image.Image):
+        data = image.tobytes()
+        shape = (image.mode,) + image.size
+    else:
+        data = np.ascontiguousarray(image)
+        shape = data.shape
+    digest = hashlib.blake2b(repr(shape).encode(), digest_size=16)
+    digest.update(memoryview(data).cast('B'))
+    return digest.digest()
+
+
+def collapse_duplicates(frames):
+    """Merge runs of identical consecutive frames, adding up their durations.
+
+    Only one frame is held back at a time, so this works on streams.
+    """
+    pending = None
+    pending_digest = None
+    for frame in frames:
+        digest = frame_digest(frame.image)
+        if pending is not None and digest == pending_digest:
+            pending = pending._replace(duration=pending.duration + frame.duration,
+                                       count=pending.count + frame.count)
+            continue
+        if pending is not None:
+            yield pending
+        pending, pending_digest = frame, digest
+    if pending is not None:
+        yield pending
+
+
+def trim_frames(frames, start=None, end=None):
+    """Keep only the part of a frame stream between start and end, in seconds.
+
+    Frames that straddle an edge are kept with their duration cut to the
+    part inside the range. Iteration stops at end, so later frames are
+    never decoded.
+    """
+    start_ms = int(round((start or 0) * 1000))
+    end_ms = None if end is None else int(round(end * 1000))
+    elapsed = 0
+    for frame in frames:
+        frame_start, frame_end = elapsed, elapsed + frame.duration
+        elapsed = frame_end
+        if end_ms is not None and frame_start >= end_ms:
+            return
+        if frame_end <= start_ms:
+            continue
+        visible = min(frame_end, end_ms if end_ms is not None else frame_end) - max(frame_start, start_ms)
+        if visible > 0:
+            yield frame if visible == frame.duration else frame._replace(duration=visible)
+
+
+def time_range(start=None, end=None, max_duration=None):
+    """Normalise start/end/max_duration options to a (start, end) pair in seconds.
+
+    Either side may be None, meaning the start or the end of the input.
+    """
+    start = start or None
+    if max_duration:
+        limit = (start or 0) + max_duration
+        end = limit if end is None else min(end, limit)
+    if start is not None and end is not None and end <= start:
+        raise ValueError("The end time has to be after the start time")
+    return start, end
+
+
+def gif_durations(input_gif):
+    """Return the duration of every frame of a GIF, in milliseconds"""
+    with Image.open(input_gif) as im:
+        durations = []
+        for frame in ImageSequence.Iterator(im):
+            durations.append(frame.info.get('duration') or DEFAULT_DURATION)
+        return durations
+
+
+def frames_in_range(durations, start=None, end=None):
+    """Return the indices of the frames with the given durations that show within start..end"""
+    frames = (SourceFrame(index, duration) for index, duration in enumerate(durations))
+    return [frame.image for frame in trim_frames(frames, start, end)]
+
+
+def sample_gif_frames(input_gif, count, start=None, end=None):
+    """Return up to count RGB frames of a GIF spread evenly over it, or over start..end"""
+    samples = []
+    with Image.open(input_gif) as im:
+        if start is not None or end is not None:
+            indices = frames_in_range(gif_durations(input_gif), start, end)
+        else:
+            indices = range(im.n_frames)
+        total_frames = len(indices)
+        for index in sorted(set(indices[int(i * total_frames / count)] for i in range(count) if total_frames)):
+            im.seek(index)
+            samples.append(im.convert("RGB"))
+    return samples
@@ -0,0 +1,111 @@
+import tempfile
+import numpy as np
+
+from processors.frame_source import DEFAULT_DURATION, SourceFrame
+from utils.file_utils import get_cache_dir
+
+# Memory a job may use for frames it has to hold on to before spilling to disk
+DEFAULT_FRAME_BUDGET = 512 * 1024 ** 2
+
+
+def frames_footprint(count, size, channels=4):
+    """Bytes taken by count uint8 frames of the given (width, height) and channel count"""
+    width, height = size
+    return count * width * height * channels
+
+
+class FrameStore:
+    """A job's frames, in RAM up to a memory budget and memory-mapped from a scratch file beyond it.
+
+    Every frame has the same shape. Reading never copies: frames in RAM
+    come back as they were stored and spilled frames as read-only views of
+    the mapping, so the page cache decides how much of a long recording is
+    resident. The scratch file lives in the cache directory rather than
+    the temp directory, which is often RAM-backed, and disappears on close.
+    """
+
+    def __init__(self, shape, budget=DEFAULT_FRAME_BUDGET, scratch_dir=None):
+        """
+        Args:
+            shape: (height, width, channels) of every frame
+            budget: Bytes of frames to keep in RAM
+            scratch_dir: Directory for the spill file, the cache directory by default
+        """
+        self.shape = tuple(shape)
+        self.frame_bytes = int(np.prod(self.shape))
+        self.ram_capacity = max(0, budget // self.frame_bytes)
+        self.scratch_dir = scratch_dir
+        self._ram = []
+        self._durations = []
+        self._counts = []
+        self._file = None
+        self._map = None
+        self.spilled = 0
+
+    @classmethod
+    def for_frames(cls, count, size, channels=4, budget=DEFAULT_FRAME_BUDGET, **kwargs):
+        """Create a store for count frames of the given (width, height), and say whether it will spill"""
+        store = cls((size[1], size[0], channels), budget=budget, **kwargs)
+        return store, frames_footprint(count, size, channels) > budget
+
+    def __len__(self):
+        return len(self._durations)
+
+    def __getitem__(self, index):
+        """Return frame index as a SourceFrame holding a uint8 array"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("frame index out of range")
+        if index < len(self._ram):
+            pixels = self._ram[index]
+        else:
+            pixels = self._mapped()[index - len(self._ram)]
+        return SourceFrame(pixels, self._durations[index], self._counts[index])
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    @property
+    def durations(self):
+        return list(self._durations)
+
+    def append(self, frame):
+        """Store a SourceFrame whose image is an image or array; the pixels are copied"""
+        pixels = np.asarray(frame.image, dtype=np.uint8)
+        if pixels.shape != self.shape:
+            raise ValueError(f"Frame of shape {pixels.shape} does not fit a store of {self.shape} frames")
+        if len(self._ram) < self.ram_capacity and not self.spilled:
+            self._ram.append(np.array(pixels))
+        else:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile(dir=self.scratch_dir or get_cache_dir('scratch'))
+            self._file.write(memoryview(np.ascontiguousarray(pixels)).cast('B'))
+            self.spilled += 1
+        self._durations.append(frame.duration or DEFAULT_DURATION)
+        self._counts.append(frame.count)
+
+    def _mapped(self):
+        # Frames appended since the last read need a bigger mapping; views
+        # of the old one stay valid for as long as they are referenced
+        if self._map is None or len(self._map) < self.spilled:
+            self._file.flush()
+            self._map = np.memmap(self._file, dtype=np.uint8, mode='r', shape=(self.spilled,) + self.shape)
+        return self._map
+
+    def close(self):
+        """Drop every frame and delete the scratch file"""
+        self._ram = []
+        self._durations = []
+        self._counts = []
+        self._map = None
+        self.spilled = 0
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
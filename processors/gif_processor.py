@@ -1,95 +1,798 @@
+import os
 import threading
 import time
-from PIL import Image, ImageDraw, ImageSequence
+import numpy as np
+from PIL import Image
+
+from processors.budget import BudgetPlanner, Estimate, budget_ladder, format_bytes
+from processors.compositor import Compositor, corner_mask
+from processors.encoders import FORMAT_EXTENSIONS, FanOutWriter, FfmpegEncoder, frame_rate_for, output_format
+from processors.ffmpeg_engine import ENGINES, FilterGraphRenderer
+from processors.frame_asset import FrameAsset
+from processors.frame_store import DEFAULT_FRAME_BUDGET, FrameStore, frames_footprint
+from processors.frame_source import (DEFAULT_DURATION, collapse_duplicates, frames_in_range, gif_durations,
+                                     iter_gif_frames, sample_gif_frames, time_range, trim_frames)
+from processors.gif_writer import StreamingGifWriter
+from processors.palette import DEFAULT_SAMPLE_PIXELS, GlobalPalette
+from processors.parallel import ParallelFramer
+from processors.pipeline import StreamingPipeline, batched
+from processors.preview import preview_image
+from processors.render_cache import RenderCache
+from processors.video_converter import VideoConverter
+from processors.video_reader import probe_video
+from utils.file_utils import is_video_file
+from utils.metrics import PerfRecorder
+
+# Seconds between progressive previews of a running render
+PREVIEW_INTERVAL = 0.5
 
 class GifProcessor(threading.Thread):
-    def __init__(self, gif_path, frame_path, output_path, signals):
+    def __init__(self, gif_path, frame_path, output_path, signals, streaming=True, queue_size=2,
+                 batch_size=2, workers=1, frame_budget=DEFAULT_FRAME_BUDGET, fps=10, palette="global",
+                 palette_colors=256, palette_sample_frames=8, palette_sample_pixels=DEFAULT_SAMPLE_PIXELS,
+                 dither=False, collapse_duplicates=True, cache=True, scale=1.0, max_width=None, start=None,
+                 end=None, max_duration=None, trace_path=None, profile_path=None, trace_memory=False,
+                 preview_width=None, session_cache=None, extra_outputs=(), engine="pillow", templates=(),
+                 decode_segments=1, max_bytes=None, max_seconds=None, cache_frames=False):
         super().__init__()
+        # gif_path may also be a video, which is decoded straight into the pipeline
         self.gif_path = gif_path
         self.frame_path = frame_path
         self.output_path = output_path
+        # More files written from the same pass. Every output's format
+        # follows its extension: .gif, .webp, .png/.apng or .mp4
+        self.extra_outputs = list(extra_outputs)
+        self.formats = [output_format(path) for path in self.outputs]
+        # More device frames rendered from the same decode, as (frame_path,
+        # output paths) pairs. Each source frame is resized once per distinct
+        # screen size and composited into every one of them.
+        self.templates = [(path, list(outputs)) for path, outputs in templates]
+        for path, outputs in self.templates:
+            if not outputs:
+                raise ValueError(f"No outputs given for the device frame {path}")
+            for output in outputs:
+                output_format(output)
+        # "pillow" decodes, composites and encodes in Python; "ffmpeg" runs
+        # the whole render as one ffmpeg filter graph, and falls back to
+        # Pillow when ffmpeg is missing or fails
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', use one of {', '.join(ENGINES)}")
+        self.engine = engine
         self.signals = signals
+        # Streaming keeps only a handful of frames in memory at any time
+        self.streaming = streaming
+        self.queue_size = queue_size
+        # Number of frames composited together as one NumPy batch
+        self.batch_size = batch_size
+        # More than one worker resizes and composites on a process pool
+        self.workers = workers
+        # Videos are cut into this many time segments, each decoded by its
+        # own ffmpeg process at the same time; 0 for one per CPU
+        self.decode_segments = decode_segments
+        # Bytes of frames the non-streaming path keeps in RAM before
+        # spilling the rest to a memory-mapped scratch file
+        self.frame_budget = frame_budget
+        # Sampling rate for video inputs
+        self.fps = fps
+        # "global" shares one palette built from sampled frames, "adaptive"
+        # quantizes every frame on its own. More sampled frames/pixels give a
+        # better palette at the cost of a slower start.
+        self.palette = palette
+        self.palette_colors = palette_colors
+        self.palette_sample_frames = palette_sample_frames
+        self.palette_sample_pixels = palette_sample_pixels
+        self.dither = dither
+        # Merge identical consecutive input frames before any resizing
+        self.collapse_duplicates = collapse_duplicates
+        # True uses the on-disk render cache, False renders from scratch; a
+        # RenderCache instance can also be passed in
+        self.cache = RenderCache() if cache is True else (cache or None)
+        # Also keep the resized source frames in the render cache. They are
+        # raw pixels, far larger than the outputs and palettes that are
+        # always cached, so this is only worth it for inputs re-rendered
+        # with other device frames across runs.
+        self.cache_frames = cache_frames
+        # An optional in-memory FrameSessionCache, shared between renders so
+        # that a re-render with another device frame skips decoding, and
+        # skips resizing too when the new screen has the same size
+        self.session_cache = session_cache
+        # Output size relative to the frame image, and an optional cap on the
+        # output width. The device frame, screen and corners shrink together
+        # and the content is resized straight to the smaller screen.
+        self.scale = scale
+        self.max_width = max_width
+        # Part of the input to use, in seconds; nothing outside it is decoded
+        # (videos seek to the keyframe before start) or processed
+        self.start, self.end = time_range(start, end, max_duration)
+        # Per-stage timings, frame latencies and peak memory are written to
+        # trace_path as JSON, and cProfile stats of every stage to profile_path
+        self.trace_path = trace_path
+        self.profile_path = profile_path
+        self.metrics = PerfRecorder(enabled=bool(trace_path or profile_path), trace_memory=trace_memory,
+                                    profile=bool(profile_path))
+        # With a width, a shrunken copy of the output is emitted on
+        # signals.preview every PREVIEW_INTERVAL seconds while rendering
+        self.preview_width = preview_width
+        self._last_preview = None
+        # Palette sample frames, taken once and shared by every device frame
+        self._samples = {}
+        # A budget the largest output's size and the whole run's time have to
+        # fit in. fps, scale and palette_colors are then the most the budget
+        # may use: they are lowered until a sample render predicts a fit.
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        # The settings chosen for the budget with their predicted and actual cost
+        self.budget_report = None
         
     def run(self):
+        self.metrics.start()
+        trace = {'input': self.gif_path, 'output': self.output_path,
+                 'outputs': [path for _, outputs in self.targets for path in outputs],
+                 'settings': self.render_settings()}
         try:
             start_time = time.time()
+            if self.max_bytes or self.max_seconds:
+                trace['budget'] = self.fit_budget(start_time)
+                trace['settings'] = self.render_settings()
             
-            # Resize GIF frames
-            self.signals.status.emit("Resizing GIF frames...")
-            gif_frames = self.resize_gif_frames(self.gif_path)
+            # Device frames whose outputs are all cached are only copied out
+            pending, output_keys = [], []
+            for frame_path, outputs in self.targets:
+                keys = []
+                if self.cache is not None:
+                    keys = [
+                        self.cache.key('output', self.gif_path, frame_path, format=output_format(path),
+                                       **self.render_settings())
+                        for path in outputs
+                    ]
+                    if all(self.cache.fetch_file(key, FORMAT_EXTENSIONS[output_format(path)], path)
+                           for key, path in zip(keys, outputs)):
+                        continue
+                pending.append((frame_path, outputs))
+                output_keys.extend(zip(keys, outputs))
+            if not pending:
+                self.signals.status.emit("Using cached render...")
+                self.signals.progress.emit(100)
+                self.report_budget(start_time)
+                self.write_trace(trace, mode='cache', status='ok')
+                self.signals.finished.emit(self.output_path, time.time() - start_time)
+                return
             
-            # Overlay on frame
-            self.signals.status.emit("Overlaying frames on background...")
-            self.overlay_gif_on_frame(self.frame_path, gif_frames, self.output_path)
+            if pending != self.targets[:1]:
+                trace['mode'] = self.process_templates(pending)
+            elif self.engine == 'ffmpeg' and self.process_ffmpeg(self.gif_path, self.frame_path):
+                trace['mode'] = 'ffmpeg'
+            else:
+                trace['mode'] = self.process_pillow()
+            
+            for key, path in output_keys:
+                self.cache.store_file(key, FORMAT_EXTENSIONS[output_format(path)], path)
             
+            self.report_budget(start_time)
+            self.write_trace(trace, status='ok')
             elapsed_time = time.time() - start_time
             self.signals.finished.emit(self.output_path, elapsed_time)
             
         except Exception as e:
+            self.write_trace(trace, status='error', error=str(e))
             self.signals.error.emit(str(e))
     
-    def resize_gif_frames(self, input_gif):
-        target_size = (2257, 4854)
-        with Image.open(input_gif) as im:
-            frames = []
-            total_frames = im.n_frames
+    @property
+    def outputs(self):
+        return [self.output_path] + self.extra_outputs
+    
+    @property
+    def targets(self):
+        """(frame_path, output paths) of the main device frame and every template"""
+        return [(self.frame_path, self.outputs)] + self.templates
+    
+    def write_trace(self, trace, **info):
+        """Write the performance trace and profile, if either was asked for"""
+        if not self.metrics.enabled:
+            return
+        try:
+            self.metrics.write(self.trace_path, self.profile_path, **dict(trace, **info))
+        except OSError as e:
+            self.signals.status.emit(f"Could not write performance trace: {e}")
+    
+    def render_settings(self):
+        """Every setting that changes the output, for the render cache key"""
+        return {
+            'legacy': not (self.streaming or (self.workers or 1) > 1),
+            'engine': self.engine,
+            'fps': self.fps,
+            'palette': self.palette,
+            'palette_colors': self.palette_colors,
+            'palette_sample_frames': self.palette_sample_frames,
+            'palette_sample_pixels': self.palette_sample_pixels,
+            'dither': self.dither,
+            'collapse_duplicates': self.collapse_duplicates,
+            'scale': self.scale,
+            'max_width': self.max_width,
+            'start': self.start,
+            'end': self.end,
+        }
+    
+    def process_pillow(self):
+        """Render every output in Python, the way the settings ask for, and return the mode used"""
+        if is_video_file(self.gif_path) and not (self.streaming or self.workers > 1):
+            # The list-based path only reads GIFs, already cut to the time range
+            self.gif_path = VideoConverter(self.signals, self.metrics, self.decode_segments).convert_to_gif(
+                self.gif_path, fps=self.fps, start=self.start, end=self.end
+            )
+            self.start = self.end = None
+        
+        kind = "video" if is_video_file(self.gif_path) else "GIF"
+        if self.workers and self.workers > 1:
+            self.signals.status.emit(f"Framing {kind} frames on {self.workers} workers...")
+            self.process_parallel(self.gif_path, self.frame_path, self.output_path)
+            return 'parallel'
+        if self.streaming:
+            self.signals.status.emit(f"Framing {kind} frames...")
+            self.process_streaming(self.gif_path, self.targets[:1])
+            return 'streaming'
+        
+        # Resize GIF frames
+        self.signals.status.emit("Resizing GIF frames...")
+        with self.resize_gif_frames(self.gif_path) as gif_frames:
+            if not gif_frames:
+                raise ValueError("The input has no frames in the selected time range")
             
-            for i, frame in enumerate(ImageSequence.Iterator(im), start=1):
-                frame = frame.convert("RGBA")
-                frame = frame.resize(target_size, Image.Resampling.LANCZOS)
-                frames.append(frame)
+            # Overlay on frame
+            self.signals.status.emit("Overlaying frames on background...")
+            self.overlay_gif_on_frame(self.frame_path, gif_frames, self.output_path)
+        return 'legacy'
+    
+    def process_templates(self, targets):
+        """Render several device frames from one decode of the input and return the mode used.
+        
+        This always runs the streaming pipeline, whatever the engine, worker
+        and streaming settings ask for, as those paths frame one device at a time.
+        """
+        if self.engine == 'ffmpeg':
+            self.signals.status.emit("The ffmpeg engine renders one device frame per run, using Pillow instead")
+        kind = "video" if is_video_file(self.gif_path) else "GIF"
+        if len(targets) > 1:
+            self.signals.status.emit(f"Framing {kind} frames into {len(targets)} device frames...")
+        else:
+            self.signals.status.emit(f"Framing {kind} frames...")
+        self.process_streaming(self.gif_path, targets)
+        return 'fan-out'
+    
+    def process_ffmpeg(self, input_path, frame_path):
+        """Render every output with a single ffmpeg filter graph.
+        
+        Returns:
+            False if ffmpeg is missing or failed, and the Pillow path has to render instead
+        """
+        asset = self.load_asset(frame_path)
+        video = is_video_file(input_path)
+        palette = self.build_palette(input_path, asset) if 'gif' in self.formats else None
+        if video:
+            frame_rate = None
+            total_frames = VideoConverter(self.signals, self.metrics).estimate_frame_count(
+                input_path, self.fps, self.start, self.end
+            )
+        else:
+            frame_rate = self.output_frame_rate(input_path)
+            durations = gif_durations(input_path)
+            shown = [durations[index] for index in frames_in_range(durations, self.start, self.end)]
+            if set(self.formats) - {'gif'}:
+                # Rendered at a constant rate, so frames are counted in ticks
+                total_frames = int(round(sum(shown) * frame_rate / 1000))
+            else:
+                total_frames = len(shown)
+        
+        self.signals.status.emit("Rendering with ffmpeg...")
+        try:
+            renderer = FilterGraphRenderer(asset, fps=self.fps, start=self.start, end=self.end, palette=palette,
+                                           colors=self.palette_colors, dither=self.dither,
+                                           frame_rate=frame_rate, metrics=self.metrics)
+            renderer.render(input_path, zip(self.outputs, self.formats), video_input=video,
+                            progress=lambda written: self._emit_frame_progress(written, total_frames))
+        except RuntimeError as e:
+            self.signals.status.emit(f"{str(e).splitlines()[0]}, rendering with Pillow instead")
+            return False
+        return True
+    
+    def load_asset(self, frame_path):
+        """Load the device frame, scaled to the output size"""
+        with self.metrics.stage('asset'):
+            asset = FrameAsset.load(frame_path)
+            return asset.scaled(asset.scale_for(self.scale, self.max_width))
+    
+    def fit_budget(self, start_time):
+        """Lower fps, scale and palette size until a sample render predicts the output fits the budget.
+        
+        The chosen settings replace the configured ones, which are left as
+        they are when they fit already. Only the main device frame is
+        sampled; templates are rendered with the same settings. The choice
+        is kept in the render cache, so running the same job again skips
+        the sampling.
+        
+        Returns:
+            budget_report, without the actual cost yet
+        """
+        if self.engine == 'ffmpeg':
+            # The sample render is a Pillow one, so only Pillow keeps to its prediction
+            self.signals.status.emit("Budgets are sampled with the Pillow renderer, using it instead of ffmpeg")
+            self.engine = 'pillow'
+        video = is_video_file(self.gif_path)
+        fps = self.fps
+        if video and not fps:
+            fps = probe_video(self.gif_path).get('fps') or 30
+        frame = FrameAsset.load(self.frame_path)
+        scale = frame.scale_for(self.scale, self.max_width)
+        ladder = budget_ladder(fps, scale, self.palette_colors, tune_fps=video,
+                               tune_colors=self.palette == "global" and 'gif' in self.formats)
+        
+        key = None
+        if self.cache is not None:
+            key = self.cache.key('budget', self.gif_path, self.frame_path, formats=sorted(set(self.formats)),
+                                 max_bytes=self.max_bytes, max_seconds=self.max_seconds,
+                                 **self.render_settings())
+            cached = self.cache.load_arrays(key)
+        if key is not None and cached is not None:
+            rung = int(cached['rung'])
+            candidate = ladder[rung]
+            estimate = Estimate(*(value.item() for value in cached['estimate']))
+            fits, sampled = bool(cached['fits']), 0
+        else:
+            self.signals.status.emit("Sampling the input to fit the budget...")
+            planner = BudgetPlanner(self.gif_path, frame, self.formats, max_bytes=self.max_bytes,
+                                    max_seconds=self.max_seconds, start=self.start, end=self.end,
+                                    palette=self.palette, palette_sample_frames=self.palette_sample_frames,
+                                    palette_sample_pixels=self.palette_sample_pixels, dither=self.dither)
+            with self.metrics.stage('budget'):
+                candidate, estimate, fits = planner.choose(ladder, lambda: time.time() - start_time)
+            rung, sampled = ladder.index(candidate), len(planner.estimates)
+            if key is not None:
+                self.cache.store_arrays(key, rung=np.array(rung), estimate=np.array(estimate, dtype=np.float64),
+                                        fits=np.array(fits))
+        
+        if rung:
+            if video:
+                self.fps = candidate.fps
+            self.scale = candidate.scale
+            self.palette_colors = candidate.colors
+        planned = time.time() - start_time
+        self.budget_report = {
+            'max_bytes': self.max_bytes,
+            'max_seconds': self.max_seconds,
+            'fps': candidate.fps if video else None,
+            'scale': round(candidate.scale, 4),
+            'colors': candidate.colors,
+            'fits': fits,
+            'candidates_sampled': sampled,
+            'planning_seconds': round(planned, 3),
+            'predicted_bytes': int(estimate.bytes),
+            'predicted_seconds': round(planned + estimate.seconds, 3),
+            'bytes': None,
+            'seconds': None,
+        }
+        settings = (f"{candidate.fps:g} fps, " if video else "") + f"scale {candidate.scale:.3g}"
+        if 'gif' in self.formats:
+            settings += f", {candidate.colors} colors"
+        prediction = f"predicted {format_bytes(estimate.bytes)} in {planned + estimate.seconds:.1f}s"
+        if fits:
+            self.signals.status.emit(f"Budget: {settings}, {prediction}")
+        else:
+            self.signals.status.emit(f"Nothing tried fits the budget, using the smallest: "
+                                     f"{settings}, {prediction}")
+        return self.budget_report
+    
+    def report_budget(self, start_time):
+        """Add the actual size and time of a budgeted render to budget_report and report both"""
+        if self.budget_report is None:
+            return
+        report = self.budget_report
+        report['bytes'] = max(os.path.getsize(path) for path in self.outputs)
+        report['seconds'] = round(time.time() - start_time, 3)
+        self.signals.status.emit(f"Budget: {format_bytes(report['bytes'])} in {report['seconds']:.1f}s "
+                                 f"(predicted {format_bytes(report['predicted_bytes'])} "
+                                 f"in {report['predicted_seconds']:.1f}s)")
+    
+    def process_streaming(self, input_gif, targets):
+        """Decode, resize, composite and encode with every stage on its own thread.
+        
+        targets are (frame_path, output paths) pairs. The input is decoded
+        once for all of them and every frame is resized once per distinct
+        screen size; each device frame has a compositor and writers of its own.
+        """
+        assets = [self.load_asset(frame_path) for frame_path, _ in targets]
+        sizes = list(dict.fromkeys(asset.screen_size for asset in assets))
+        if len(sizes) == 1:
+            source_frames, total_frames, recorders = self.open_resized_source(input_gif, sizes[0])
+            recorders_by_size = {sizes[0]: recorders}
+        else:
+            # No one screen size suits every device, so videos are decoded at their own size
+            source_frames, total_frames = self.open_source(input_gif)
+            recorders_by_size = {size: self.resized_recorders(input_gif, size) for size in sizes}
+            recorders = [recorder for size in sizes for recorder in recorders_by_size[size]]
+        
+        # Enough output buffers that none is reused while still queued for encoding
+        compositors = [
+            Compositor.from_asset(asset, batch_size=self.batch_size, ring_size=self.queue_size + 2,
+                                  metrics=self.metrics)
+            for asset in assets
+        ]
+        written = [0]
+        
+        # Pixels travel as stacked arrays per screen size, timing as the frames without their image
+        def resize_batch(frames):
+            with self.metrics.stage('resize', len(frames)):
+                resized = {size: np.stack([self.resized_array(frame.image, size) for frame in frames])
+                           for size in sizes}
+            for size, size_recorders in recorders_by_size.items():
+                for recorder in size_recorders:
+                    for pixels, frame in zip(resized[size], frames):
+                        recorder.add(pixels, frame)
+            return resized, [frame._replace(image=None) for frame in frames]
+        
+        def composite_batch(batch):
+            screens, frames = batch
+            framed = [compositor.composite_batch(screens[asset.screen_size])
+                      for compositor, asset in zip(compositors, assets)]
+            return framed, frames
+        
+        def write_batch(batch):
+            framed, frames = batch
+            for index, frame in enumerate(frames):
+                for device_writer, combined in zip(writer.writers, framed):
+                    device_writer.add_frame(combined[index], frame.duration)
+                self.metrics.frame_finished()
+                written[0] += frame.count
+                self._emit_frame_progress(written[0], total_frames)
+                self._emit_preview(framed[0][index])
+        
+        profiled = self.metrics.profiled
+        # One writer per device frame, closed together so each gets to finish its files
+        writer = FanOutWriter(self.open_writers(input_gif, asset, outputs, frame_path)
+                              for asset, (frame_path, outputs) in zip(assets, targets))
+        with writer:
+            pipeline = StreamingPipeline(
+                batched(self._track_frames(source_frames), self.batch_size),
+                [profiled(resize_batch), profiled(composite_batch)],
+                profiled(write_batch),
+                queue_size=self.queue_size
+            )
+            try:
+                pipeline.run()
+            except BaseException:
+                for recorder in recorders:
+                    recorder.discard()
+                raise
+            for recorder in recorders:
+                recorder.commit()
+            self.signals.status.emit("Finishing output...")
+    
+    def process_parallel(self, input_gif, frame_path, output_path):
+        """Resize and composite on worker processes while this thread encodes"""
+        framer = ParallelFramer(frame_path, asset=self.load_asset(frame_path), workers=self.workers)
+        screen_size = tuple(framer.asset.screen_size)
+        # Workers leave frames that already have the screen's size as they are
+        source_frames, total_frames, recorders = self.open_resized_source(input_gif, screen_size)
+        written = [0]
+        
+        def record_frames(frames):
+            # Resizing happens in the workers, but videos are decoded at the
+            # screen's size already: those frames are recorded here, on their
+            # way into shared memory, as the next render's resized frames
+            for frame in frames:
+                if recorders:
+                    size = frame.image.size if isinstance(frame.image, Image.Image) else frame.image.shape[1::-1]
+                    if tuple(size) == screen_size:
+                        # A copy, the decoder reuses its buffers
+                        pixels = np.array(frame.image)
+                        for recorder in recorders:
+                            recorder.add(pixels, frame)
+                    else:
+                        for recorder in recorders:
+                            recorder.discard()
+                        recorders[:] = []
+                yield frame
+        
+        def write_frame(combined, frame):
+            writer.add_frame(combined, frame.duration)
+            self.metrics.frame_finished()
+            written[0] += frame.count
+            self._emit_frame_progress(written[0], total_frames)
+            self._emit_preview(combined)
+        
+        with self.open_writers(input_gif, framer.asset) as writer:
+            try:
+                self.metrics.profiled(framer.run)(self._track_frames(record_frames(source_frames)), write_frame,
+                                                  self.metrics)
+            except BaseException:
+                for recorder in recorders:
+                    recorder.discard()
+                raise
+            for recorder in recorders:
+                recorder.commit()
+            self.signals.status.emit("Finishing output...")
+    
+    def open_writers(self, input_path, asset, outputs=None, frame_path=None):
+        """Open an encoder for every output of a device frame (the main one by default), as one writer"""
+        outputs = [(path, output_format(path)) for path in (outputs or self.outputs)]
+        formats = {kind for _, kind in outputs}
+        # One palette for every GIF, and none at all without a GIF output
+        palette = self.build_palette(input_path, asset, frame_path) if 'gif' in formats else None
+        frame_rate = self.output_frame_rate(input_path) if formats - {'gif'} else None
+        
+        writers = []
+        for path, kind in outputs:
+            if kind == 'gif':
+                writers.append(StreamingGifWriter(path, duration=DEFAULT_DURATION, loop=0, palette=palette,
+                                                  static_region=asset.screen_rect, metrics=self.metrics))
+            else:
+                writers.append(FfmpegEncoder(path, asset.size, frame_rate, duration=DEFAULT_DURATION,
+                                             format=kind, metrics=self.metrics))
+        return FanOutWriter(writers)
+    
+    def output_frame_rate(self, input_path):
+        """Constant frame rate that the input's frame durations are whole multiples of"""
+        if is_video_file(input_path):
+            return self.fps or probe_video(input_path).get('fps') or 30
+        return frame_rate_for(gif_durations(input_path))
+    
+    def open_source(self, input_path, target_size=None):
+        """Return an iterator over the input's SourceFrames and the expected frame count.
+        
+        Videos are decoded straight to RGB arrays, so their frames are only
+        quantized once, when the output GIF is encoded. With a target_size
+        ffmpeg scales them while decoding, so the resize stage has nothing
+        left to do.
+        """
+        session_key = None
+        if self.session_cache is not None and not is_video_file(input_path):
+            # GIF frames are decoded at full size, so they can be resized to any other screen
+            session_key = self.session_cache.key('decoded', input_path, **self.source_settings())
+            decoded = self.session_cache.get(session_key)
+            if decoded is not None:
+                return iter(decoded), sum(frame.count for frame in decoded)
+        
+        if is_video_file(input_path):
+            converter = VideoConverter(self.signals, self.metrics, self.decode_segments)
+            # Every frame that can be in flight between the decoder and the
+            # resize stage, which copies them into its batch
+            buffers = 2 + self.batch_size * (self.queue_size + 2)
+            frames = converter.iter_frames(input_path, self.fps, size=target_size, buffers=buffers,
+                                           start=self.start, end=self.end)
+            total_frames = converter.estimate_frame_count(input_path, self.fps, self.start, self.end)
+        elif self.start is not None or self.end is not None:
+            total_frames = len(frames_in_range(gif_durations(input_path), self.start, self.end))
+            frames = trim_frames(self.metrics.timed_iter('decode', self.iter_gif_frames(input_path)),
+                                 self.start, self.end)
+        else:
+            with Image.open(input_path) as im:
+                total_frames = im.n_frames
+            frames = self.metrics.timed_iter('decode', self.iter_gif_frames(input_path))
+        
+        if self.collapse_duplicates:
+            frames = collapse_duplicates(frames)
+        if session_key is not None:
+            frames = self.session_cache.record(session_key, frames)
+        return frames, total_frames
+    
+    def _track_frames(self, frames):
+        """Pass frames through, marking when each one leaves the source for latency tracking"""
+        for frame in frames:
+            self.metrics.frame_started()
+            yield frame
+    
+    def open_resized_source(self, input_path, target_size):
+        """Like open_source, but reuses frames already resized to target_size by an earlier render.
+        
+        Returns:
+            (frames, total_frames, recorders) where every recorder should be
+            given the resized frames and committed once they are all
+            through, so the next render can skip decoding and resizing
+        """
+        session_key, key = self.resized_keys(input_path, target_size)
+        if session_key is not None:
+            resized = self.session_cache.get(session_key)
+            if resized is not None:
+                return iter(resized), sum(frame.count for frame in resized), []
+        
+        if key is not None:
+            cached = self.cache.load_frames(key)
+            if cached is not None:
+                return cached + ([],)
+        
+        frames, total_frames = self.open_source(input_path, target_size)
+        return frames, total_frames, self.resized_recorders(input_path, target_size)
+    
+    def resized_keys(self, input_path, target_size):
+        """Return the (session cache, render cache) keys of the input's frames resized to target_size"""
+        settings = dict(self.source_settings(), size=list(target_size))
+        session_key = key = None
+        if self.session_cache is not None:
+            session_key = self.session_cache.key('resized', input_path, **settings)
+        if self.cache is not None and self.cache_frames:
+            key = self.cache.key('resized', input_path, **settings)
+        return session_key, key
+    
+    def resized_recorders(self, input_path, target_size):
+        """Return recorders that keep frames resized to target_size for the next render, see open_resized_source"""
+        session_key, key = self.resized_keys(input_path, target_size)
+        recorders = []
+        if key is not None:
+            recorders.append(self.cache.frame_recorder(key))
+        if session_key is not None:
+            recorders.append(self.session_cache.recorder(session_key))
+        return recorders
+    
+    def source_settings(self):
+        """Every setting that changes which source frames a render reads"""
+        return {
+            'fps': self.fps,
+            'collapse_duplicates': self.collapse_duplicates,
+            'start': self.start,
+            'end': self.end,
+        }
+    
+    def build_palette(self, input_path, asset, frame_path=None):
+        """Build the shared output palette of a device frame, or return None for per-frame palettes"""
+        if self.palette != "global":
+            return None
+        
+        key = None
+        if self.cache is not None:
+            key = self.cache.key('palette', input_path, frame_path or self.frame_path, size=list(asset.size),
+                                 colors=self.palette_colors,
+                                 sample_frames=self.palette_sample_frames,
+                                 sample_pixels=self.palette_sample_pixels, dither=self.dither,
+                                 start=self.start, end=self.end)
+            cached = self.cache.load_arrays(key)
+            if cached is not None:
+                # The palette and the bezel mapped to it, so neither is computed again
+                return GlobalPalette(cached['colors'], int(cached['transparent_index']),
+                                     screen_rect=asset.screen_rect, dither=self.dither,
+                                     static_indices=cached['static_indices'])
+        
+        self.signals.status.emit("Building color palette...")
+        with self.metrics.stage('palette'):
+            palette = GlobalPalette.build(
+                self.sample_source_frames(input_path, self.palette_sample_frames, asset.screen_size),
+                static_image=asset.image,
+                screen_rect=asset.screen_rect,
+                colors=self.palette_colors,
+                sample_pixels=self.palette_sample_pixels,
+                dither=self.dither
+            )
+        if key is not None:
+            self.cache.store_arrays(key, colors=palette.colors,
+                                    transparent_index=np.array(palette.transparent_index),
+                                    static_indices=palette.static_indices)
+        return palette
+    
+    def sample_source_frames(self, input_path, count, target_size=None):
+        """Return up to count input frames spread evenly over the input, decoding them only once per render.
+        
+        Frames an earlier render left in the session cache are sampled
+        instead, so re-rendering with another device frame decodes nothing.
+        """
+        key = (input_path, count)
+        if key not in self._samples:
+            cached = self.session_frames(input_path, target_size)
+            if cached:
+                indices = sorted({int(i * len(cached) / count) for i in range(count)})
+                samples = [cached[index].image for index in indices]
+            elif is_video_file(input_path):
+                samples = VideoConverter(self.signals).sample_frames(input_path, count, self.start, self.end)
+            else:
+                samples = sample_gif_frames(input_path, count, self.start, self.end)
+            self._samples[key] = samples
+        return self._samples[key]
+    
+    def session_frames(self, input_path, target_size=None):
+        """Return the input's frames from the session cache, resized to target_size or as decoded, or None"""
+        if self.session_cache is None:
+            return None
+        keys = []
+        if target_size is not None:
+            keys.append(self.resized_keys(input_path, target_size)[0])
+        if not is_video_file(input_path):
+            keys.append(self.session_cache.key('decoded', input_path, **self.source_settings()))
+        for key in keys:
+            frames = self.session_cache.get(key)
+            if frames:
+                return frames
+        return None
+    
+    def _emit_frame_progress(self, written, total_frames):
+        # Decoding happens alongside encoding, so start at 10% and never claim 100% early
+        if total_frames:
+            progress = 10 + int((min(written, total_frames) / total_frames) * 89)
+        else:
+            progress = 10 + min(89, written)
+        self.signals.progress.emit(progress)
+    
+    def _emit_preview(self, combined):
+        """Emit a preview of an output frame, at most once every PREVIEW_INTERVAL seconds"""
+        if not self.preview_width:
+            return
+        now = time.monotonic()
+        if self._last_preview is not None and now - self._last_preview < PREVIEW_INTERVAL:
+            return
+        self._last_preview = now
+        self.signals.preview.emit([preview_image(combined, self.preview_width)])
+    
+    @staticmethod
+    def iter_gif_frames(input_gif):
+        """Yield the frames of a GIF one by one as RGBA SourceFrames"""
+        return iter_gif_frames(input_gif)
+    
+    @classmethod
+    def resized_array(cls, frame, target_size):
+        """Return a frame resized to target_size as an array, without copying frames already that size"""
+        if not isinstance(frame, Image.Image):
+            pixels = np.asarray(frame)
+            if pixels.shape[1::-1] == tuple(target_size):
+                return pixels
+        return np.asarray(cls.resize_frame(frame, target_size))
+    
+    @staticmethod
+    def resize_frame(frame, target_size=(2257, 4854)):
+        """Resize an image or uint8 array, keeping RGB frames as RGB"""
+        if not isinstance(frame, Image.Image):
+            frame = Image.fromarray(np.asarray(frame))
+        if frame.mode not in ("RGB", "RGBA"):
+            frame = frame.convert("RGBA")
+        return frame.resize(target_size, Image.Resampling.LANCZOS)
+    
+    def resize_gif_frames(self, input_gif, target_size=None):
+        """Resize the input's frames into a FrameStore, which the caller has to close"""
+        if target_size is None:
+            target_size = self.load_asset(self.frame_path).screen_size
+        
+        if self.start is not None or self.end is not None:
+            total_frames = len(frames_in_range(gif_durations(input_gif), self.start, self.end))
+        else:
+            with Image.open(input_gif) as im:
+                total_frames = im.n_frames
+        
+        # Frames are RGBA, so the footprint is known before anything is decoded
+        frames, spills = FrameStore.for_frames(total_frames, target_size, budget=self.frame_budget)
+        if spills:
+            footprint = frames_footprint(total_frames, target_size) // 1024 ** 2
+            self.signals.status.emit(f"Resizing GIF frames ({footprint} MB, partly kept on disk)...")
+        
+        try:
+            source_frames = trim_frames(self.iter_gif_frames(input_gif), self.start, self.end)
+            for i, frame in enumerate(self.metrics.timed_iter('decode', source_frames), start=1):
+                with self.metrics.stage('resize', 1):
+                    resized = self.resize_frame(frame.image, target_size)
+                frames.append(frame._replace(image=resized))
                 
                 # Update progress (first half of the process)
                 progress = 10 + int((i / total_frames) * 40)  # Start at 10% (after video conversion)
                 self.signals.progress.emit(progress)
+        except BaseException:
+            frames.close()
+            raise
         
         return frames
     
     def overlay_gif_on_frame(self, frame_path, gif_frames, output_path):
-        radius = 275
-        frame = Image.open(frame_path).convert("RGBA")
-        frame_w, frame_h = frame.size
-
-        processed_frames = []
+        """Composite the frames of a FrameStore onto the device frame and write every output"""
+        asset = self.load_asset(frame_path)
+        compositor = Compositor.from_asset(asset, batch_size=1, metrics=self.metrics)
         total_frames = len(gif_frames)
         
-        for i, gif_frame in enumerate(gif_frames, start=1):
-            gif_frame = self.add_rounded_corners(gif_frame, radius)
-
-            canvas = Image.new("RGBA", (frame_w, frame_h), (0, 0, 0, 0))
-            gif_w, gif_h = gif_frame.size
-            pos_x = (frame_w - gif_w) // 2
-            pos_y = (frame_h - gif_h) // 2
-            canvas.paste(gif_frame, (pos_x, pos_y), gif_frame)
-
-            combined = Image.alpha_composite(frame, canvas)
-            processed_frames.append(combined)
-            
-            # Update progress (second half of the process)
-            progress = 50 + int((i / total_frames) * 50)
-            self.signals.progress.emit(progress)
-        
-        self.signals.status.emit("Saving output GIF...")
-        
-        processed_frames[0].save(
-            output_path,
-            save_all=True,
-            append_images=processed_frames[1:],
-            optimize=False,
-            duration=100,
-            loop=0
-        )
+        # Every frame is encoded as soon as it is composited, the same way
+        # the streaming path does it, so only the FrameStore grows with the input
+        with self.open_writers(self.gif_path, asset, [output_path] + self.extra_outputs, frame_path) as writer:
+            for i, gif_frame in enumerate(gif_frames, start=1):
+                framed = compositor.composite_batch(np.asarray(gif_frame.image)[np.newaxis])[0]
+                writer.add_frame(framed, gif_frame.duration)
+                self._emit_preview(framed)
+                
+                # Update progress (second half of the process)
+                progress = 50 + int((i / total_frames) * 50)
+                self.signals.progress.emit(progress)
     
     @staticmethod
     def add_rounded_corners(im, radius):
-        circle = Image.new('L', (radius * 2, radius * 2), 0)
-        draw = ImageDraw.Draw(circle)
-        draw.ellipse((0, 0, radius * 2, radius * 2), fill=255)
-        alpha = Image.new('L', im.size, 255)
-        w, h = im.size
-        alpha.paste(circle.crop((0, 0, radius, radius)), (0, 0))
-        alpha.paste(circle.crop((0, radius, radius, radius * 2)), (0, h - radius))
-        alpha.paste(circle.crop((radius, 0, radius * 2, radius)), (w - radius, 0))
-        alpha.paste(circle.crop((radius, radius, radius * 2, radius * 2)), (w - radius, h - radius))
-        im.putalpha(alpha)
-        return im
\ No newline at end of file
+        im.putalpha(Image.fromarray(corner_mask(im.size, radius)))
+        return im
@@ -0,0 +1,205 @@
+import numpy as np
+from PIL import Image, GifImagePlugin
+
+from utils.metrics import DISABLED
+
+
+class StreamingGifWriter:
+    """Writes an animated GIF one frame at a time.
+
+    Only the previous frame is kept around: it is needed to crop the next
+    frame to the area that changed and to fold identical frames into one
+    longer frame, the same way Pillow's ``save_all`` does.
+
+    With a GlobalPalette every frame is mapped to that one palette, which
+    is written once as the global color table. Without it each frame gets
+    its own adaptive palette.
+
+    The first frame is written in full. With ``delta`` on, every later
+    frame is drawn over the previous one (disposal 1) and pixels that did
+    not change inside its bounding box are left transparent, so a static
+    device bezel is stored once and repeated pixels compress to nothing.
+    Drawing over the previous frame can't make an opaque pixel transparent
+    again, so before a frame that does, the previous frame is written in
+    full and cleared (disposal 2), and that frame is drawn in full.
+    ``static_region`` (x, y, width, height) limits change detection to the
+    only area that can differ between frames, e.g. the device screen.
+    """
+
+    def __init__(self, output_path, duration=100, loop=0, palette=None, delta=True, static_region=None,
+                 metrics=None):
+        self.output_path = output_path
+        self.duration = duration
+        self.loop = loop
+        self.palette = palette
+        self.delta = delta
+        self.static_region = static_region
+        # Time spent mapping frames to palettes counts as "quantize", the rest as "encode"
+        self.metrics = metrics or DISABLED
+        self.frame_count = 0
+        # GIF delays are whole centiseconds; rounding against the running
+        # total keeps long animations from drifting
+        self._elapsed_ms = 0
+        self._elapsed_cs = 0
+        self._fp = None
+        self._previous = None
+        self._pending = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._fp:
+            self._fp.close()
+
+    def add_frame(self, frame, duration=None):
+        """Queue an RGB or RGBA frame (image or uint8 array) for writing."""
+        duration = self.duration if duration is None else duration
+
+        with self.metrics.stage("quantize", 1):
+            if self.palette is not None:
+                # Frames are compared as palette indices, one byte per pixel
+                data = self.palette.map_frame(np.asarray(frame))
+            else:
+                # Arrays may be reused by the caller, so take a copy
+                data = np.array(frame, dtype=np.uint8)
+
+        bbox = None
+        unchanged = None
+        if self._previous is not None:
+            with self.metrics.stage("encode"):
+                bbox = self._changed_bbox(self._previous, data, self.static_region)
+                if bbox is not None and self._turns_transparent(self._previous, data, bbox):
+                    # Only a cleared canvas shows through: write the previous
+                    # frame in full so disposing of it clears everything,
+                    # then draw this one in full over it
+                    full = (0, 0, data.shape[1], data.shape[0])
+                    self._pending[1], self._pending[3], self._pending[4] = full, None, 2
+                    bbox = full
+                elif bbox is not None and self.delta:
+                    area = (slice(bbox[1], bbox[3]), slice(bbox[0], bbox[2]))
+                    unchanged = self._previous[area] == data[area]
+                    if unchanged.ndim == 3:
+                        unchanged = unchanged.all(axis=2)
+            if bbox is None:
+                # Identical to the previous frame, just show that one longer
+                self._pending[2] += duration
+                return
+
+        self._flush()
+        self._previous = data
+        self._pending = [data, bbox, duration, unchanged, None]
+
+    def close(self):
+        """Write the last frame and the GIF trailer."""
+        self._flush()
+        if not self._fp:
+            raise ValueError("No frames were written to the GIF")
+        self._fp.write(b";")
+        self._fp.close()
+        self._fp = None
+
+    def _flush(self):
+        if self._pending is None:
+            return
+        data, bbox, duration, unchanged, disposal = self._pending
+        self._pending = None
+
+        self._elapsed_ms += duration
+        end_cs = int(round(self._elapsed_ms / 10.0))
+        params = {"duration": (end_cs - self._elapsed_cs) * 10}
+        self._elapsed_cs = end_cs
+        if self._fp is None:
+            palette_image, transparency = self._timed_palette(data)
+            self._fp = open(self.output_path, "wb")
+            header, _ = GifImagePlugin.getheader(palette_image, info={"loop": self.loop})
+            for block in header:
+                self._fp.write(block)
+            offset = (0, 0)
+        else:
+            # Later frames only carry the changed area, and their own
+            # palette unless one global palette is shared
+            area = (slice(bbox[1], bbox[3]), slice(bbox[0], bbox[2]))
+            palette_image, transparency = self._timed_palette(data[area])
+            if self.palette is None:
+                params["include_color_table"] = True
+            if unchanged is not None and transparency is not None:
+                # Let the previous frame show through wherever nothing changed
+                indices = np.array(palette_image)
+                indices[unchanged] = transparency
+                palette_image = self._with_palette(indices, palette_image.getpalette())
+                params["disposal"] = 1
+            offset = bbox[:2]
+
+        if disposal is not None:
+            params["disposal"] = disposal
+        if transparency is not None:
+            params["transparency"] = transparency
+        with self.metrics.stage("encode", 1):
+            for block in GifImagePlugin.getdata(palette_image, offset, **params):
+                self._fp.write(block)
+        self.frame_count += 1
+
+    def _timed_palette(self, data):
+        with self.metrics.stage("quantize"):
+            return self._to_palette(data)
+
+    def _to_palette(self, data):
+        """Return a "P" image of the frame data and its transparent index"""
+        if self.palette is not None:
+            return self.palette.to_image(data), self.palette.transparent_index
+        return self._quantize(Image.fromarray(data))
+
+    @staticmethod
+    def _with_palette(indices, palette):
+        image = Image.fromarray(np.ascontiguousarray(indices, dtype=np.uint8))
+        image.putpalette(palette)
+        return image
+
+    def _transparent(self, data):
+        """Return where frame data is transparent, or None if it can't be"""
+        if self.palette is not None:
+            if self.palette.transparent_index is None:
+                return None
+            return data == self.palette.transparent_index
+        if data.ndim == 3 and data.shape[2] == 4:
+            return data[..., 3] < 128
+        return None
+
+    def _turns_transparent(self, previous, current, bbox):
+        """Whether any pixel in bbox is transparent in current but not in previous"""
+        area = (slice(bbox[1], bbox[3]), slice(bbox[0], bbox[2]))
+        now = self._transparent(current[area])
+        if now is None or not now.any():
+            return False
+        return bool((now & ~self._transparent(previous[area])).any())
+
+    @staticmethod
+    def _changed_bbox(previous, current, region=None):
+        x, y = 0, 0
+        if region is not None:
+            x, y, w, h = region
+            previous = previous[y:y + h, x:x + w]
+            current = current[y:y + h, x:x + w]
+        changed = previous != current
+        if changed.ndim == 3:
+            changed = changed.any(axis=2)
+        rows = np.flatnonzero(changed.any(axis=1))
+        if not len(rows):
+            return None
+        columns = np.flatnonzero(changed.any(axis=0))
+        return (x + int(columns[0]), y + int(rows[0]), x + int(columns[-1]) + 1, y + int(rows[-1]) + 1)
+
+    @staticmethod
+    def _quantize(image):
+        """Quantize a frame, keeping the last palette entry for transparent pixels."""
+        palette_image = image.convert("RGB").quantize(colors=255, method=Image.Quantize.FASTOCTREE)
+        # Pad the palette so index 255 always exists in the color table
+        palette = palette_image.getpalette()[:255 * 3]
+        palette_image.putpalette(palette + [0] * (768 - len(palette)))
+        if image.mode == "RGBA" and image.getchannel("A").getextrema()[0] < 128:
+            transparent = image.getchannel("A").point(lambda a: 255 if a < 128 else 0)
+            palette_image.paste(255, mask=transparent)
+        return palette_image, 255
@@ -0,0 +1,200 @@
+import sys
+import numpy as np
+from PIL import Image
+
+# Bits per channel of the nearest-color lookup table (64 levels, 262144 cells)
+LUT_BITS = 6
+
+# Pixels taken from each sample frame when building the palette
+DEFAULT_SAMPLE_PIXELS = 128 * 1024
+
+
+def _thumbnail_pixels(image, max_pixels):
+    """Return up to max_pixels RGB pixels of an image as an (n, 3) array"""
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(np.asarray(image))
+    w, h = image.size
+    scale = min(1.0, (max_pixels / float(w * h)) ** 0.5)
+    if scale < 1.0:
+        image = image.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.Resampling.BOX)
+    pixels = np.asarray(image.convert("RGBA")).reshape(-1, 4)
+    return pixels[pixels[:, 3] >= 128][:, :3]
+
+
+class GlobalPalette:
+    """One palette shared by every frame of an output GIF.
+
+    The palette is built once from the static device frame and a sample of
+    the content frames, then each frame is mapped to it with a vectorized
+    nearest-color lookup table. Pixels of the static image are mapped once
+    and reused, so a frame only costs a lookup over its screen area.
+    """
+
+    def __init__(self, colors, transparent_index=None, static_image=None, screen_rect=None, dither=False,
+                 static_indices=None):
+        """
+        Args:
+            colors: (n, 3) uint8 array of palette colors, n <= 256
+            transparent_index: Palette index used for transparent pixels, if any
+            static_image: RGBA image or array that matches every frame outside screen_rect
+            screen_rect: (x, y, width, height) of the only area that changes between frames
+            dither: Use Floyd-Steinberg dithering instead of plain nearest colors
+            static_indices: static_image already mapped to this palette, e.g. from a cache
+        """
+        self.colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+        self.transparent_index = transparent_index
+        self.dither = dither
+
+        palette = self.colors.flatten().tolist()
+        self.palette = palette + [0] * (768 - len(palette))
+        self._palette_image = Image.new("P", (1, 1))
+        self._palette_image.putpalette(self.palette)
+        self._lut = self._build_lut()
+
+        self.screen_rect = screen_rect
+        self._static_indices = None
+        if static_indices is not None:
+            self._static_indices = np.array(static_indices, dtype=np.uint8)
+        elif static_image is not None:
+            self._static_indices = self.map_array(np.asarray(static_image))
+        if self._static_indices is not None:
+            self._static_indices.flags.writeable = False
+
+    @property
+    def static_indices(self):
+        """The static image mapped to this palette, or None"""
+        return self._static_indices
+
+    @classmethod
+    def build(cls, sample_frames, static_image=None, screen_rect=None, colors=256,
+              sample_pixels=DEFAULT_SAMPLE_PIXELS, dither=False):
+        """Build a palette from sample frames and the static device frame.
+
+        Args:
+            sample_frames: Iterable of content frames (images or arrays)
+            static_image: The device frame, whose colors are always included
+            screen_rect: Area of the static image covered by the content
+            colors: Palette size, including the last entry, which is kept for transparency
+            sample_pixels: Pixels taken from each frame; fewer is faster but less exact
+            dither: Dither frames when mapping them to the palette
+        """
+        samples = [_thumbnail_pixels(frame, sample_pixels) for frame in sample_frames]
+
+        # Reserved for transparent pixels and for unchanged pixels in delta frames
+        transparent_index = colors - 1
+        colors -= 1
+        if static_image is not None:
+            static = np.asarray(static_image.convert("RGBA") if isinstance(static_image, Image.Image)
+                                else static_image)
+            if screen_rect is not None:
+                # The placeholder screen is always covered, its color doesn't matter
+                x, y, w, h = screen_rect
+                bezel = static.copy()
+                bezel[y:y + h, x:x + w, 3] = 0
+            else:
+                bezel = static
+            samples.append(_thumbnail_pixels(bezel, sample_pixels))
+
+        pixels = np.concatenate(samples) if samples else np.zeros((1, 3), dtype=np.uint8)
+        if len(pixels) == 0:
+            pixels = np.zeros((1, 3), dtype=np.uint8)
+
+        # Let Pillow's median cut pick the colors from the pooled sample
+        pool = Image.fromarray(pixels.reshape(1, -1, 3))
+        quantized = pool.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+        palette = np.array(quantized.getpalette()[:colors * 3], dtype=np.uint8).reshape(-1, 3)
+
+        # Keep the transparent entry at a fixed slot at the end of the table
+        if len(palette) <= transparent_index:
+            padding = np.zeros((transparent_index - len(palette) + 1, 3), dtype=np.uint8)
+            palette = np.concatenate([palette, padding])
+        return cls(palette, transparent_index, static_image=static_image, screen_rect=screen_rect,
+                   dither=dither)
+
+    def _build_lut(self):
+        levels = 1 << LUT_BITS
+        shift = 8 - LUT_BITS
+        # Center of each lookup cell in 8-bit color space
+        axis = (np.arange(levels, dtype=np.float32) * (1 << shift)) + ((1 << shift) - 1) / 2.0
+        # Cells are ordered r + g * levels + b * levels**2
+        b, g, r = np.meshgrid(axis, axis, axis, indexing='ij')
+        cells = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+
+        candidates = self.colors.astype(np.float32)
+        if self.transparent_index is not None and self.transparent_index < len(candidates):
+            candidates[self.transparent_index] = np.inf
+        candidate_norms = (candidates ** 2).sum(axis=1)
+        candidates[~np.isfinite(candidates)] = 0
+
+        lut = np.empty(len(cells), dtype=np.uint8)
+        for start in range(0, len(cells), 16384):
+            chunk = cells[start:start + 16384]
+            distances = candidate_norms[np.newaxis] - 2 * chunk @ candidates.T
+            lut[start:start + 16384] = np.argmin(distances, axis=1)
+        return lut
+
+    def map_array(self, pixels):
+        """Map an RGB or RGBA uint8 array to a 2-D array of palette indices"""
+        pixels = np.asarray(pixels)
+        if self.dither:
+            rgb = Image.fromarray(np.ascontiguousarray(pixels[..., :3]))
+            indices = np.array(rgb.quantize(palette=self._palette_image, dither=Image.Dither.FLOYDSTEINBERG))
+            if self.transparent_index is not None:
+                # Never let dithering pick the transparent slot for an opaque pixel
+                stray = indices == self.transparent_index
+                indices[stray] = self._lookup(pixels[stray])
+        else:
+            indices = self._lookup(pixels)
+
+        if self.transparent_index is not None and pixels.shape[-1] == 4:
+            indices[pixels[..., 3] < 128] = self.transparent_index
+        return indices
+
+    def _lookup(self, pixels):
+        bits = LUT_BITS
+        levels_mask = (1 << bits) - 1
+        if pixels.shape[-1] == 4 and pixels.dtype == np.uint8 and sys.byteorder == 'little':
+            # Read each RGBA pixel as one uint32 (r | g << 8 | b << 16) and
+            # pull the top bits of every channel out with in-place shifts.
+            # map_frame passes the screen as a slice, which NumPy before 1.23
+            # can't view as uint32; only then is it copied first.
+            try:
+                packed = pixels.view(np.uint32)[..., 0]
+            except ValueError:
+                packed = np.ascontiguousarray(pixels).view(np.uint32)[..., 0]
+            key = packed >> (8 - bits)
+            key &= levels_mask
+            part = packed >> (16 - 2 * bits)
+            part &= levels_mask << bits
+            key |= part
+            np.right_shift(packed, 24 - 3 * bits, out=part)
+            part &= levels_mask << (2 * bits)
+            key |= part
+        else:
+            shift = 8 - bits
+            key = (pixels[..., 0] >> shift).astype(np.uint32)
+            key |= (pixels[..., 1] >> shift).astype(np.uint32) << bits
+            key |= (pixels[..., 2] >> shift).astype(np.uint32) << (2 * bits)
+        return np.take(self._lut, key)
+
+    def map_frame(self, frame):
+        """Map a full output frame to palette indices.
+
+        With a static image only the screen area is looked up; everything
+        else comes from the indices computed for the static image.
+        """
+        frame = np.asarray(frame)
+        if self._static_indices is None or self.screen_rect is None \
+                or frame.shape[:2] != self._static_indices.shape:
+            return self.map_array(frame)
+
+        x, y, w, h = self.screen_rect
+        indices = self._static_indices.copy()
+        indices[y:y + h, x:x + w] = self.map_array(frame[y:y + h, x:x + w])
+        return indices
+
+    def to_image(self, indices):
+        """Wrap an index array as a "P" image using this palette"""
+        image = Image.fromarray(np.ascontiguousarray(indices, dtype=np.uint8))
+        image.putpalette(self.palette)
+        return image
@@ -0,0 +1,160 @@
+import itertools
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from PIL import Image
+
+from processors.compositor import Compositor
+from processors.frame_asset import FrameAsset, scale_frame_image
+from utils.metrics import DISABLED
+
+
+def default_workers():
+    """Number of worker processes to use when none is configured"""
+    return max(1, os.cpu_count() or 1)
+
+
+def _frame_array(frame):
+    """Return a frame as an RGB or RGBA uint8 array"""
+    if isinstance(frame, Image.Image):
+        if frame.mode not in ("RGB", "RGBA"):
+            frame = frame.convert("RGBA")
+    return np.asarray(frame, dtype=np.uint8)
+
+
+class SharedFrames:
+    """A fixed number of frame slots in shared memory, seen as one NumPy array.
+
+    The creating process owns the block and unlinks it on close; worker
+    processes attach to it by name.
+    """
+
+    def __init__(self, slots, shape, name=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.owner = name is None
+        if self.owner:
+            size = max(1, slots * int(np.prod(self.shape)))
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        # The NumPy view has to go before the buffer can be released
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# Per-process state of a pool worker, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(frame_path, frame_size, screen_rect, radius, inputs, outputs):
+    # Re-scaled here rather than pickled over, for scaled-down outputs
+    asset = FrameAsset(scale_frame_image(Image.open(frame_path), frame_size), screen_rect, radius)
+    _worker['compositor'] = Compositor.from_asset(asset, batch_size=1, ring_size=0)
+    _worker['inputs'] = SharedFrames(*inputs)
+    _worker['outputs'] = SharedFrames(*outputs)
+
+
+def _frame_task(slot):
+    """Resize and composite the frame in an input slot into the matching output slot.
+
+    Returns:
+        (slot, timings) where timings holds the (wall, cpu) seconds of the
+        resize and composite steps, for the parent's metrics
+    """
+    compositor = _worker['compositor']
+    wall, cpu = time.perf_counter(), time.process_time()
+    source = Image.fromarray(_worker['inputs'].array[slot])
+    resized = source.resize(compositor.screen_size, Image.Resampling.LANCZOS)
+    resized_wall, resized_cpu = time.perf_counter(), time.process_time()
+    compositor.composite_batch(np.asarray(resized)[np.newaxis], out=_worker['outputs'].array[slot:slot + 1])
+    timings = {
+        'resize': (resized_wall - wall, resized_cpu - cpu),
+        'composite': (time.perf_counter() - resized_wall, time.process_time() - resized_cpu),
+    }
+    return slot, timings
+
+
+class ParallelFramer:
+    """Resizes and composites frames on a pool of worker processes.
+
+    Frames travel to and from the workers through shared-memory slots
+    rather than as pickled images; only slot numbers are sent over the
+    pool's pipes. Results are handed to the sink in input order.
+    """
+
+    def __init__(self, frame_path, asset=None, workers=None, slots_per_worker=2):
+        self.frame_path = frame_path
+        self.asset = asset or FrameAsset.load(frame_path)
+        self.workers = workers or default_workers()
+        self.slots_per_worker = slots_per_worker
+
+    def run(self, frames, sink, metrics=None):
+        """Frame every SourceFrame from ``frames``, calling ``sink(rgba_array, source_frame)``.
+
+        The array given to ``sink`` is reused afterwards, so the sink has to
+        copy anything it wants to keep. Time the workers spend resizing and
+        compositing is added to ``metrics``.
+        """
+        metrics = metrics or DISABLED
+        frames = iter(frames)
+        first = next(frames, None)
+        if first is None:
+            return
+
+        source_shape = _frame_array(first.image).shape
+        frame_w, frame_h = self.asset.size
+        slots = self.workers * self.slots_per_worker
+
+        inputs = SharedFrames(slots, source_shape)
+        outputs = SharedFrames(slots, (frame_h, frame_w, 4))
+        try:
+            # Every output slot holds the bezel, workers only rewrite the screen
+            outputs.array[:] = np.asarray(self.asset.image)
+            initargs = (
+                self.frame_path, self.asset.size, self.asset.screen_rect, self.asset.radius,
+                (inputs.slots, inputs.shape, inputs.name),
+                (outputs.slots, outputs.shape, outputs.name),
+            )
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                     initargs=initargs) as pool:
+                free = deque(range(slots))
+                pending = deque()
+
+                for frame in itertools.chain([first], frames):
+                    if not free:
+                        free.append(self._finish(pending.popleft(), outputs, sink, metrics))
+                    slot = free.popleft()
+                    source = _frame_array(frame.image)
+                    if source.shape != source_shape:
+                        raise ValueError("All input frames must have the same size")
+                    inputs.array[slot] = source
+                    # Only the timing travels along, the pixels are in the slot
+                    pending.append((pool.submit(_frame_task, slot), frame._replace(image=None)))
+
+                while pending:
+                    self._finish(pending.popleft(), outputs, sink, metrics)
+        finally:
+            inputs.close()
+            outputs.close()
+
+    @staticmethod
+    def _finish(task, outputs, sink, metrics):
+        future, frame = task
+        slot, timings = future.result()
+        for stage, (wall, cpu) in timings.items():
+            metrics.add(stage, wall, cpu, 1)
+        sink(outputs.array[slot], frame)
+        return slot
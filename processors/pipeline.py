@@ -0,0 +1,140 @@
+import queue
+import threading
+
+# Marks the end of the stream on a stage queue
+_END_OF_STREAM = object()
+
+
+class PipelineCancelled(Exception):
+    """Raised by StreamingPipeline.run() when the pipeline was cancelled.
+
+    The sink has then seen only part of the stream, so whatever it wrote
+    must not be treated as a finished output.
+    """
+
+
+class StreamingPipeline:
+    """Runs frames through a chain of stages, each stage on its own thread.
+
+    Stages are connected by bounded queues, so no more than ``queue_size``
+    frames wait between any two stages and peak memory stays the same no
+    matter how long the input is.
+    """
+
+    def __init__(self, source, stages, sink, queue_size=2):
+        """
+        Args:
+            source: Iterable producing the input frames
+            stages: List of callables, each taking a frame and returning the next one
+            sink: Callable receiving every frame that leaves the last stage
+            queue_size: Maximum number of frames buffered between two stages
+        """
+        self.source = source
+        self.stages = list(stages)
+        self.sink = sink
+        self.queue_size = max(1, queue_size)
+        self._stop = threading.Event()
+        self._cancelled = False
+        self._complete = False
+        self._errors = []
+
+    def run(self):
+        """Run the pipeline to completion, re-raising the first stage error.
+
+        Raises:
+            PipelineCancelled: When cancel() stopped the pipeline early
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+
+        threads = [threading.Thread(target=self._produce, args=(queues[0],), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            threads.append(threading.Thread(
+                target=self._transform, args=(stage, queues[i], queues[i + 1]), daemon=True
+            ))
+
+        for thread in threads:
+            thread.start()
+
+        # The sink (usually the encoder) runs on the calling thread
+        try:
+            self._consume(queues[-1])
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+        if self._cancelled and not self._complete:
+            raise PipelineCancelled("The pipeline was cancelled before the end of the stream")
+
+    def cancel(self):
+        """Ask every stage to stop as soon as possible; run() then raises PipelineCancelled."""
+        self._cancelled = True
+        self._stop.set()
+
+    def _fail(self, error):
+        self._errors.append(error)
+        self._stop.set()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END_OF_STREAM
+
+    def _produce(self, out_q):
+        try:
+            for item in self.source:
+                if not self._put(out_q, item):
+                    return
+            self._put(out_q, _END_OF_STREAM)
+        except Exception as e:
+            self._fail(e)
+
+    def _transform(self, stage, in_q, out_q):
+        try:
+            while True:
+                item = self._get(in_q)
+                if item is _END_OF_STREAM:
+                    self._put(out_q, _END_OF_STREAM)
+                    return
+                if not self._put(out_q, stage(item)):
+                    return
+        except Exception as e:
+            self._fail(e)
+
+    def _consume(self, in_q):
+        try:
+            while True:
+                item = self._get(in_q)
+                if item is _END_OF_STREAM:
+                    # _get also ends the stream when the pipeline was stopped
+                    self._complete = not self._stop.is_set()
+                    return
+                self.sink(item)
+        except Exception as e:
+            self._fail(e)
+
+
+def batched(iterable, size):
+    """Group an iterable into lists of up to ``size`` items."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
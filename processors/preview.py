@@ -0,0 +1,67 @@
+import functools
+import os
+import numpy as np
+from PIL import Image
+
+from processors.compositor import Compositor
+from processors.frame_asset import FrameAsset
+from processors.frame_source import sample_gif_frames
+from processors.video_converter import VideoConverter
+from utils.file_utils import is_video_file
+
+# Width in pixels of preview frames, device frame included
+PREVIEW_WIDTH = 240
+# Frames in a quick preview: the first one and the rest spread over the input
+PREVIEW_FRAMES = 5
+
+
+@functools.lru_cache(maxsize=4)
+def _preview_asset(frame_path, mtime_ns, width):
+    asset = FrameAsset.load(frame_path)
+    return asset.scaled(asset.scale_for(max_width=width), draft=True)
+
+
+def preview_asset(frame_path, width=PREVIEW_WIDTH):
+    """Return the device frame scaled down to preview width, kept in memory for the next preview"""
+    return _preview_asset(frame_path, os.stat(frame_path).st_mtime_ns, width)
+
+
+def render_preview(input_path, frame_path, count=PREVIEW_FRAMES, width=PREVIEW_WIDTH, start=None, end=None):
+    """Frame a few input frames at preview size, through the same compositing as a full render.
+
+    Only the sampled frames are decoded, and videos are scaled by ffmpeg
+    while decoding, so this takes a fraction of a second even for long
+    recordings.
+
+    Returns:
+        List of RGBA images, the first frame of the input (or of start..end) first
+    """
+    asset = preview_asset(frame_path, width)
+    size = asset.screen_size
+    if is_video_file(input_path):
+        screens = VideoConverter().sample_frames(input_path, count, start, end, size=size)
+    else:
+        screens = [np.asarray(image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0))
+                   for image in sample_gif_frames(input_path, count, start, end)]
+    if not len(screens):
+        raise ValueError("The input has no frames in the selected time range")
+
+    compositor = Compositor.from_asset(asset, batch_size=1)
+    return [compositor.composite(screen) for screen in screens]
+
+
+def preview_image(frame, width=PREVIEW_WIDTH):
+    """Shrink a full-size output frame (RGBA array) to preview width.
+
+    Every n-th pixel is picked before the final resize, so this costs
+    little more than the small image itself and can run on the encoding
+    thread.
+    """
+    frame = np.asarray(frame)
+    step = max(1, frame.shape[1] // (width * 2))
+    image = Image.fromarray(np.ascontiguousarray(frame[::step, ::step]))
+    height = max(1, int(round(frame.shape[0] * width / frame.shape[1])))
+    if image.width <= width:
+        # Not resized, so it may still share memory with a reused output buffer
+        return image.copy()
+    return image.resize((width, height), Image.Resampling.BILINEAR)
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+
+from processors.frame_asset import file_hash
+from processors.frame_source import SourceFrame
+from utils.file_utils import get_cache_dir
+
+# Total size the cache is trimmed to after every store
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# Largest recording of raw frames kept in the cache; longer recordings are
+# dropped rather than evicting many outputs to make room for them
+DEFAULT_MAX_FRAME_BYTES = 256 * 1024 ** 2
+
+# Part of every key; bump it when the output of a render changes for the same settings
+CACHE_VERSION = 2
+
+
+class RenderCache:
+    """Content-addressed, size-capped store for rendered outputs and intermediate artifacts.
+
+    Every entry is named after a hash of the input files' bytes and the
+    settings that went into it, so an entry never has to be invalidated:
+    changing anything just produces a different key. An entry's last use
+    is its files' modification time, touched on every hit, which lets the
+    least recently used entries be evicted without a shared index.
+    """
+
+    def __init__(self, root=None, max_bytes=DEFAULT_MAX_BYTES, max_frame_bytes=DEFAULT_MAX_FRAME_BYTES):
+        self.root = root or get_cache_dir('renders')
+        os.makedirs(self.root, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_frame_bytes = min(max_frame_bytes, max_bytes // 2)
+        self._file_keys = {}
+
+    def key(self, kind, *paths, **settings):
+        """Return the key of a ``kind`` artifact made from the given files and settings"""
+        digest = hashlib.sha256(f"{CACHE_VERSION}:{kind}".encode())
+        for path in paths:
+            digest.update(self.file_key(path).encode())
+        digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+        return f"{kind}-{digest.hexdigest()[:40]}"
+
+    def file_key(self, path):
+        """Hash of a file's contents, remembered while its size and modification time stay the same"""
+        stat = os.stat(path)
+        memo = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if memo not in self._file_keys:
+            self._file_keys[memo] = file_hash(path)
+        return self._file_keys[memo]
+
+    def path(self, key, extension):
+        return os.path.join(self.root, key + extension)
+
+    # Whole files, e.g. rendered GIFs
+
+    def fetch_file(self, key, extension, destination):
+        """Copy a cached file to destination. Returns False on a miss."""
+        cached = self.path(key, extension)
+        try:
+            self._touch(cached)
+            shutil.copyfile(cached, destination)
+            return True
+        except OSError:
+            return False
+
+    def store_file(self, key, extension, source):
+        """Copy a finished file into the cache"""
+        self._store(self.path(key, extension), lambda tmp_path: shutil.copyfile(source, tmp_path))
+
+    # NumPy arrays, e.g. a palette and the bezel mapped to it
+
+    def load_arrays(self, key):
+        """Return a dict of the arrays stored under key, or None on a miss"""
+        cached = self.path(key, '.npz')
+        try:
+            self._touch(cached)
+            with np.load(cached) as data:
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return None
+
+    def store_arrays(self, key, **arrays):
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+        self._store(self.path(key, '.npz'), write)
+
+    # Streams of equally sized frames, e.g. resized source frames
+
+    def load_frames(self, key):
+        """Return an iterator over cached SourceFrames and their count, or None on a miss.
+
+        The frames are read-only views of a memory-mapped file, so nothing
+        is loaded until a frame is used.
+        """
+        try:
+            self._touch(self.path(key, '.json'), self.path(key, '.frames'))
+            with open(self.path(key, '.json'), 'r') as f:
+                meta = json.load(f)
+            count = len(meta['durations'])
+            pixels = np.memmap(self.path(key, '.frames'), dtype=np.uint8, mode='r',
+                               shape=(count,) + tuple(meta['shape']))
+        except (OSError, ValueError, KeyError):
+            return None
+
+        frames = (SourceFrame(pixels[i], duration, repeat)
+                  for i, (duration, repeat) in enumerate(zip(meta['durations'], meta['counts'])))
+        return frames, sum(meta['counts'])
+
+    def frame_recorder(self, key):
+        return FrameRecorder(self, key)
+
+    # Maintenance
+
+    def entries(self):
+        """Return a list of {'key', 'size', 'last_used'} dicts, least recently used first"""
+        entries = {}
+        for name in os.listdir(self.root):
+            if name.startswith('.'):
+                continue
+            key = os.path.splitext(name)[0]
+            try:
+                stat = os.stat(os.path.join(self.root, name))
+            except OSError:
+                continue
+            entry = entries.setdefault(key, {'key': key, 'size': 0, 'last_used': 0.0})
+            entry['size'] += stat.st_size
+            entry['last_used'] = max(entry['last_used'], stat.st_mtime)
+        return sorted(entries.values(), key=lambda entry: entry['last_used'])
+
+    def total_size(self):
+        return sum(entry['size'] for entry in self.entries())
+
+    def evict(self, max_bytes=None):
+        """Remove least recently used entries until the cache fits in max_bytes.
+
+        Returns:
+            The keys that were removed
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(entry['size'] for entry in entries)
+        removed = []
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            self._remove(entry['key'])
+            total -= entry['size']
+            removed.append(entry['key'])
+        return removed
+
+    def purge(self):
+        """Remove every entry, including temporary files left by interrupted writes"""
+        removed = 0
+        for name in os.listdir(self.root):
+            try:
+                os.remove(os.path.join(self.root, name))
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def _remove(self, key):
+        for name in os.listdir(self.root):
+            if os.path.splitext(name)[0] == key:
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    pass
+
+    def _store(self, path, write):
+        # Readers only ever see complete files
+        tmp_path = os.path.join(self.root, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            # The cache is only an optimisation
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    @staticmethod
+    def _touch(*paths):
+        now = time.time()
+        for path in paths:
+            os.utime(path, (now, now))
+
+
+class FrameRecorder:
+    """Appends frames to a cache entry as they are produced.
+
+    Nothing becomes visible in the cache until ``commit()``; a recording
+    that is discarded, or that would not fit in the cache, is dropped.
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.shape = None
+        self.durations = []
+        self.counts = []
+        self.size = 0
+        self._tmp_path = os.path.join(cache.root, f".{key}.frames.{os.getpid()}.tmp")
+        self._file = None
+        self.active = True
+
+    def add(self, pixels, frame):
+        """Record one frame's pixels along with the timing of its SourceFrame"""
+        if not self.active:
+            return
+        pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+        if self.shape is None:
+            self.shape = pixels.shape
+        if pixels.shape != self.shape or self.size + pixels.nbytes > self.cache.max_frame_bytes:
+            # Mixed sizes can't be memory-mapped, and a huge recording would evict everything else
+            self.discard()
+            return
+        try:
+            if self._file is None:
+                self._file = open(self._tmp_path, 'wb')
+            self._file.write(memoryview(pixels).cast('B'))
+        except OSError:
+            self.discard()
+            return
+        self.size += pixels.nbytes
+        self.durations.append(frame.duration)
+        self.counts.append(frame.count)
+
+    def commit(self):
+        if not self.active or self._file is None:
+            self.discard()
+            return
+        self._file.close()
+        self._file = None
+        self.active = False
+        try:
+            os.replace(self._tmp_path, self.cache.path(self.key, '.frames'))
+        except OSError:
+            self.discard()
+            return
+        meta = {'shape': list(self.shape), 'durations': self.durations, 'counts': self.counts}
+        self.cache._store(self.cache.path(self.key, '.json'),
+                          lambda tmp_path: _write_json(tmp_path, meta))
+
+    def discard(self):
+        self.active = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+def _write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
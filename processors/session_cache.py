@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+
+# Memory the frames of all entries may take together
+DEFAULT_SESSION_BYTES = 1024 ** 3
+
+
+class FrameSessionCache:
+    """Decoded and resized source frames of recent renders, kept in memory.
+
+    Unlike the on-disk RenderCache this holds the frames themselves, so a
+    re-render with another device frame or output path starts compositing
+    straight away. Entries are keyed by the input's path, size and
+    modification time rather than a content hash, which is enough within
+    one session, and the least recently used ones are dropped to stay
+    under ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_SESSION_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, kind, path, **settings):
+        """Return the key of a ``kind`` frame list made from the file at path with the given settings"""
+        stat = os.stat(path)
+        return (kind, os.path.abspath(path), stat.st_size, stat.st_mtime_ns,
+                json.dumps(settings, sort_keys=True, default=str))
+
+    def get(self, key):
+        """Return the list of SourceFrames stored under key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, frames, size):
+        """Store a list of SourceFrames taking size bytes, evicting older entries to make room"""
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (frames, size)
+            while self.total_size > self.max_bytes:
+                self._entries.popitem(last=False)
+
+    @property
+    def total_size(self):
+        return sum(size for _, size in self._entries.values())
+
+    def recorder(self, key):
+        """Return a recorder that stores frames under key once committed"""
+        return SessionRecorder(self, key)
+
+    def record(self, key, frames):
+        """Pass frames through, storing them under key if the stream is read to its end"""
+        recorder = self.recorder(key)
+        completed = False
+        try:
+            for frame in frames:
+                recorder.add(frame.image, frame)
+                yield frame
+            completed = True
+        finally:
+            if completed:
+                recorder.commit()
+            else:
+                recorder.discard()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SessionRecorder:
+    """Collects frames for a FrameSessionCache entry, with the same interface as FrameRecorder.
+
+    Frames are kept by reference, so whatever is added must not be
+    modified afterwards. A recording that outgrows half the cache is
+    dropped, so one long input can't push out everything else.
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.frames = []
+        self.size = 0
+        self.active = True
+
+    def add(self, pixels, frame):
+        """Record one frame's pixels (an array or image) along with the timing of its SourceFrame"""
+        if not self.active:
+            return
+        self.size += _frame_bytes(pixels)
+        if self.size > self.cache.max_bytes // 2:
+            self.discard()
+            return
+        self.frames.append(frame._replace(image=pixels))
+
+    def commit(self):
+        if self.active and self.frames:
+            self.cache.put(self.key, self.frames, self.size)
+        self.discard()
+
+    def discard(self):
+        self.active = False
+        self.frames = []
+
+
+def _frame_bytes(pixels):
+    if isinstance(pixels, Image.Image):
+        return pixels.width * pixels.height * len(pixels.getbands())
+    return np.asarray(pixels).nbytes
+
+
+# Shared by everything rendering in this process, e.g. all renders started from the app
+SESSION_CACHE = FrameSessionCache()
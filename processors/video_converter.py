@@ -1,32 +1,36 @@
+import importlib.util
 import os
 import subprocess
 import tempfile
 import sys
+import numpy as np
 from PIL import Image
 
-# Try to import imageio and its ffmpeg plugin
-try:
-    import imageio
-    IMAGEIO_AVAILABLE = True
-    
-    # Try to import the ffmpeg plugin
-    try:
-        import imageio_ffmpeg
-        FFMPEG_AVAILABLE = True
-    except ImportError:
-        FFMPEG_AVAILABLE = False
-except ImportError:
-    IMAGEIO_AVAILABLE = False
-    FFMPEG_AVAILABLE = False
+from processors.frame_source import SourceFrame, iter_gif_frames
+from processors.video_reader import SegmentedVideoReader, VideoFrameReader, probe_video
+from utils.metrics import DISABLED
+
+# imageio and its ffmpeg plugin are looked up here but only imported once
+# a video is converted, as importing imageio alone takes a good 100 ms
+IMAGEIO_AVAILABLE = importlib.util.find_spec('imageio') is not None
+FFMPEG_AVAILABLE = IMAGEIO_AVAILABLE and importlib.util.find_spec('imageio_ffmpeg') is not None
+
+# Ranges longer than this many seconds are sampled by seeking
+SEEK_SAMPLING_SECONDS = 10
 
 class VideoConverter:
     """Handles conversion of video files (MP4, MOV) to GIF format."""
     
-    def __init__(self, signals=None):
+    def __init__(self, signals=None, metrics=None, segments=1):
         self.signals = signals
         self.ffmpeg_available = FFMPEG_AVAILABLE
+        # Time spent waiting for decoded frames counts as "decode"
+        self.metrics = metrics or DISABLED
+        # Time segments decoded at once by separate ffmpeg processes; 0 or
+        # None for one per CPU, 1 to decode in one pass
+        self.segments = segments
     
-    def convert_to_gif(self, video_path, output_gif_path=None, fps=10, quality=90):
+    def convert_to_gif(self, video_path, output_gif_path=None, fps=10, quality=90, start=None, end=None):
         """
         Convert a video file to GIF format.
         
@@ -35,6 +39,8 @@ class VideoConverter:
             output_gif_path: Path for the output GIF (if None, creates a temporary file)
             fps: Frames per second to capture
             quality: Quality of the output GIF (0-100)
+            start: Time in seconds to start at (None for the beginning)
+            end: Time in seconds to stop at (None for the end)
             
         Returns:
             Path to the created GIF file
@@ -71,15 +77,15 @@ class VideoConverter:
                 except Exception as e:
                     self.signals.status.emit(f"Could not install FFMPEG plugin: {str(e)}")
                     # Try alternative method
-                    return self._convert_with_alternative_method(video_path, output_gif_path, fps)
+                    return self._convert_with_alternative_method(video_path, output_gif_path, fps, start, end)
             
             # Try to convert with imageio
             try:
-                self._convert_with_imageio(video_path, output_gif_path, fps)
+                self._convert_with_imageio(video_path, output_gif_path, fps, start, end)
             except Exception as e:
                 self.signals.status.emit(f"Error with imageio: {str(e)}")
                 # Try alternative method
-                return self._convert_with_alternative_method(video_path, output_gif_path, fps)
+                return self._convert_with_alternative_method(video_path, output_gif_path, fps, start, end)
             
             if self.signals:
                 self.signals.status.emit(f"Video successfully converted to GIF")
@@ -92,46 +98,133 @@ class VideoConverter:
                 self.signals.error.emit(f"Error converting video: {str(e)}")
             raise
     
-    def _convert_with_imageio(self, video_path, output_gif_path, fps):
-        """Convert video to GIF using imageio library"""
-        self.signals.status.emit(f"Reading video with imageio...")
-        reader = imageio.get_reader(video_path)
-        fps_source = reader.get_meta_data().get('fps', 30)  # Default to 30 if not found
+    def iter_frames(self, video_path, fps=10, size=None, buffers=0, start=None, end=None):
+        """
+        Yield the frames of a video as SourceFrames of RGB uint8 arrays, sampled at fps.
+        
+        Frames go straight from the decoder to the caller, so nothing is
+        quantized or written to disk on the way to the framing pipeline.
+        With a size, ffmpeg scales the frames while decoding. With buffers,
+        frames are read into that many reused arrays (see VideoFrameReader).
+        Only the part between start and end (in seconds) is decoded.
+        """
+        if not (IMAGEIO_AVAILABLE and self.ffmpeg_available):
+            # Without the imageio plugin, read back a GIF made by the ffmpeg tool
+            gif_path = self.convert_to_gif(video_path, fps=fps, start=start, end=end)
+            for frame in iter_gif_frames(gif_path):
+                yield frame._replace(image=np.asarray(frame.image.convert("RGB")))
+            return
         
-        # Calculate frame step to achieve target fps
-        step = max(1, int(fps_source / fps))
+        frames = self._read_frames(video_path, fps, size, buffers, start, end)
+        for _, frame, duration in self.metrics.timed_iter("decode", frames):
+            yield SourceFrame(frame, duration)
+    
+    def estimate_frame_count(self, video_path, fps=10, start=None, end=None):
+        """Estimate how many frames iter_frames will yield (all frames if fps is None), or 0 if unknown"""
+        if not (IMAGEIO_AVAILABLE and self.ffmpeg_available):
+            return 0
+        try:
+            meta = probe_video(video_path)
+        except Exception:
+            return 0
+        return VideoFrameReader(video_path, fps, meta=meta, start=start, end=end).estimate_frame_count()
+    
+    def sample_frames(self, video_path, count, start=None, end=None, size=None):
+        """Return up to count RGB arrays spread evenly over the video, or over start..end.
         
-        frames = []
-        total_frames = 0
+        With a (width, height) size ffmpeg scales the frames while decoding.
+        """
+        if not (IMAGEIO_AVAILABLE and self.ffmpeg_available) or count <= 0:
+            return []
+        
+        meta = probe_video(video_path)
+        duration = meta.get('duration') or 0
+        if end is not None:
+            duration = min(duration, end) if duration else end
+        duration -= start or 0
+        if duration > SEEK_SAMPLING_SECONDS:
+            # The fps filter would still decode every frame of a long range,
+            # so jump to each sample with its own keyframe seek instead
+            times = [(start or 0) + i * duration / count for i in range(count)]
+            return [frame for frame in (self._frame_at(video_path, t, size, meta) for t in times)
+                    if frame is not None]
         
-        # Try to get total frames count
+        # Without a known length, use the first frames
+        fps = count / duration if duration > 0 else None
+        reader = VideoFrameReader(video_path, fps, size, meta=meta, start=start, end=end)
+        return [frame for (_, frame, _), _ in zip(reader, range(count))]
+    
+    def _frame_at(self, video_path, seconds, size=None, meta=None):
+        """Return the frame shown at a time in seconds, or None past the end of the video"""
+        frames = iter(VideoFrameReader(video_path, None, size, meta=meta, start=seconds))
         try:
-            total_frames = reader.count_frames()
-        except:
-            # If count_frames() is not available, we'll just update progress differently
-            pass
+            item = next(frames, None)
+        finally:
+            frames.close()
+        return None if item is None else item[1]
+    
+    def _read_frames(self, video_path, fps, size=None, buffers=0, start=None, end=None):
+        """
+        Yield (index, frame, duration in ms) for the frames kept at the target fps.
         
-        self.signals.status.emit(f"Extracting frames...")
-        frame_count = 0
+        ffmpeg's fps filter picks frames by timestamp rather than by a
+        whole-number step, so 29.97 fps sampled at 10 fps gives 10 frames
+        per second of video, and only the kept frames reach Python.
+        """
+        return iter(self._open_reader(video_path, fps, size, buffers, start, end))
+    
+    def _open_reader(self, video_path, fps, size=None, buffers=0, start=None, end=None):
+        """Return the reader for a whole conversion, split into segments if so configured"""
+        if self.segments == 1:
+            return VideoFrameReader(video_path, fps, size, buffers, start=start, end=end)
+        return SegmentedVideoReader(video_path, fps, size, buffers, segments=self.segments, start=start, end=end)
+    
+    def _convert_with_imageio(self, video_path, output_gif_path, fps, start=None, end=None):
+        """Convert video to GIF using imageio library"""
+        import imageio
+        self.signals.status.emit(f"Reading video with imageio...")
+        reader = self._open_reader(video_path, fps, start=start, end=end)
+        
+        # Estimated from the container duration, never by decoding the video twice
+        total_frames = reader.estimate_frame_count()
         
-        for i, frame in enumerate(reader):
-            if i % step == 0:
-                frames.append(frame)
-                frame_count += 1
+        self.signals.status.emit(f"Extracting frames...")
+        # Frames go to the writer as they are decoded instead of being
+        # collected first; mimsave would also stack such a list into one
+        # more copy of every frame
+        count = 0
+        # The writer takes one frame rate for the whole GIF: with every frame
+        # kept (fps 0 or None) that is the container's
+        with imageio.get_writer(output_gif_path, mode='I', fps=fps or reader.frame_rate) as writer:
+            for i, frame, _ in self.metrics.timed_iter("decode", reader):
+                with self.metrics.stage("encode", 1):
+                    writer.append_data(frame)
+                count += 1
                 
                 if self.signals and total_frames > 0:
                     progress = 5 + int((i / total_frames) * 5)
                     self.signals.progress.emit(min(10, progress))
                 elif self.signals and i % 10 == 0:  # Update every 10 frames if total unknown
-                    self.signals.progress.emit(min(10, 5 + (frame_count % 5)))
-        
-        self.signals.status.emit(f"Saving GIF with {len(frames)} frames...")
-        imageio.mimsave(output_gif_path, frames, fps=fps)
+                    self.signals.progress.emit(min(10, 5 + (count % 5)))
+            
+            self.signals.status.emit(f"Saving GIF with {count} frames...")
+            # Pillow writes the whole GIF when the writer closes
+            with self.metrics.stage("encode"):
+                writer.close()
     
-    def _convert_with_alternative_method(self, video_path, output_gif_path, fps):
+    def _convert_with_alternative_method(self, video_path, output_gif_path, fps, start=None, end=None):
         """Try to convert using ffmpeg directly if available"""
         self.signals.status.emit("Trying alternative conversion method with ffmpeg...")
         
+        # Seek on the input so only the requested part is decoded
+        trim = []
+        if start:
+            trim += ['-ss', f"{start:.3f}"]
+        if end is not None:
+            trim += ['-t', f"{end - (start or 0):.3f}"]
+        # Without an fps every frame is kept
+        sampling = f'fps={fps},' if fps else ''
+        
         try:
             # Check if ffmpeg is available
             subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
@@ -141,16 +234,16 @@ class VideoConverter:
             
             # Generate palette
             subprocess.run([
-                'ffmpeg', '-i', video_path, 
-                '-vf', f'fps={fps},scale=320:-1:flags=lanczos,palettegen', 
+                'ffmpeg', *trim, '-i', video_path, 
+                '-vf', f'{sampling}scale=320:-1:flags=lanczos,palettegen', 
                 palette_path
             ], check=True)
             
             # Convert to GIF using the palette
             subprocess.run([
-                'ffmpeg', '-i', video_path, 
+                'ffmpeg', *trim, '-i', video_path, 
                 '-i', palette_path,
-                '-filter_complex', f'fps={fps},scale=320:-1:flags=lanczos[x];[x][1:v]paletteuse', 
+                '-filter_complex', f'{sampling}scale=320:-1:flags=lanczos[x];[x][1:v]paletteuse', 
                 output_gif_path
             ], check=True)
             
@@ -163,4 +256,5 @@ class VideoConverter:
             
         except FileNotFoundError:
             self.signals.status.emit("FFMPEG not found")
-            raise RuntimeError("FFMPEG not found. Please install imageio[ffmpeg] with: pip install 'imageio[ffmpeg]'")
\ No newline at end of file
+            raise RuntimeError("FFMPEG not found. Please install imageio[ffmpeg] with: pip install 'imageio[ffmpeg]'")
+
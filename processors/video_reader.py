@@ -0,0 +1,556 @@
+import importlib.util
+import math
+import os
+import re
+import subprocess
+import threading
+from fractions import Fraction
+import numpy as np
+
+from processors.frame_source import SourceFrame
+from processors.frame_store import DEFAULT_FRAME_BUDGET, FrameStore
+
+# imageio-ffmpeg is imported the first time ffmpeg is needed, not with this module
+FFMPEG_AVAILABLE = importlib.util.find_spec('imageio_ffmpeg') is not None
+
+# Shortest stretch of video worth a decoding process of its own
+MIN_SEGMENT_SECONDS = 2
+
+
+def ffmpeg_exe():
+    """Return the path of the ffmpeg binary bundled with imageio-ffmpeg"""
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def probe_video(video_path):
+    """Return a video's container metadata (size, fps, duration, ...) without decoding it.
+
+    Only ffmpeg's stream header is read; the frame count is estimated from
+    the duration instead of being counted.
+    """
+    import imageio_ffmpeg
+    frames = imageio_ffmpeg.read_frames(video_path)
+    try:
+        return next(frames)
+    finally:
+        frames.close()
+
+
+def keyframe_times(video_path):
+    """Return the times in seconds of a video's keyframes, or [] if they can't be listed.
+
+    Only the container is read: packets that aren't keyframes are discarded
+    by the demuxer and the rest are copied, not decoded. Times count from
+    the first keyframe, as seeking does.
+    """
+    return _keyframe_times(*_packets(video_path))
+
+
+def _packets(video_path, keyframes_only=True):
+    # (stream time base as a Fraction or None, [(pts, is keyframe)] in
+    # presentation order) of the video stream's packets
+    command = [ffmpeg_exe(), '-nostdin', '-v', 'error']
+    if keyframes_only:
+        command += ['-discard', 'nokey']
+    command += ['-i', video_path, '-map', '0:v:0', '-c', 'copy', '-f', 'framecrc', '-']
+    try:
+        output = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, check=True).stdout.decode('ascii', 'replace')
+    except (OSError, subprocess.CalledProcessError):
+        return None, []
+
+    timebase = None
+    packets = []
+    for line in output.splitlines():
+        if line.startswith('#tb 0:'):
+            numerator, _, denominator = line.partition(':')[2].strip().partition('/')
+            timebase = Fraction(int(numerator), int(denominator))
+        elif not line.startswith('#') and timebase:
+            # stream, dts, pts, duration, size, checksum, then the flags
+            # unless the packet is just a keyframe
+            fields = [field.strip() for field in line.split(',')]
+            if len(fields) >= 3 and fields[2].lstrip('-').isdigit():
+                flags = int(fields[6][2:], 16) if len(fields) > 6 and fields[6].startswith('F=') else 1
+                # Packets flagged to be discarded are decoded but never shown
+                if not flags & 4:
+                    packets.append((int(fields[2]), bool(flags & 1)))
+    packets.sort()
+    return timebase, packets
+
+
+def _keyframe_times(timebase, packets):
+    # Seconds from the first keyframe to every keyframe
+    ticks = [pts for pts, keyframe in packets if keyframe]
+    if not ticks:
+        return []
+    return [float((pts - ticks[0]) * timebase) for pts in ticks]
+
+
+def _variable_frame_rate(packets):
+    # Whether the gaps between frames differ by more than half the shortest one
+    gaps = [following - pts for (pts, _), (following, _) in zip(packets, packets[1:])]
+    return bool(gaps) and max(gaps) - min(gaps) > min(gaps) / 2
+
+
+class VideoFrameReader:
+    """Reads decoded frames from one long-running ffmpeg process over a raw pipe.
+
+    Frame selection (the ``fps`` filter) and scaling happen inside ffmpeg,
+    so Python only ever sees the frames it keeps, already at their final
+    size. Frames are read straight into a ring of preallocated buffers: a
+    yielded array is overwritten ``buffers`` frames later, so consumers
+    that hold on to frames longer than that have to copy them, or pass
+    ``buffers=0`` to get a new array for every frame.
+
+    Sampled frames last exactly 1 / fps. When every frame is kept, ffmpeg's
+    showinfo filter logs each frame's timestamp and a frame lasts until the
+    next one's, so variable frame rate videos such as screen recordings
+    keep their timing.
+    """
+
+    def __init__(self, video_path, fps=None, size=None, buffers=0, meta=None, start=None, end=None, limit=None,
+                 threads=None):
+        """
+        Args:
+            video_path: Path to the input video
+            fps: Output frame rate, or None to keep every source frame
+            size: (width, height) to scale frames to, or None for the source size
+            buffers: Number of reusable frame buffers, 0 to allocate per frame
+            meta: Result of probe_video, if already known
+            start: Time in seconds of the first frame to read, None for the beginning
+            end: Time in seconds to stop reading at, None for the end of the video
+            limit: Most frames to read, None for all of them
+            threads: Decoder threads, None to let ffmpeg decide
+        """
+        self.video_path = video_path
+        self.meta = meta or probe_video(video_path)
+        self.fps = fps
+        self.frame_rate = fps or self.meta.get('fps') or 30
+        self.size = tuple(size) if size else tuple(self.meta['size'])
+        self.start = start or 0
+        self.end = end
+        self.limit = limit
+        self.threads = threads
+        width, height = self.size
+        self._shape = (height, width, 3)
+        # Without an fps a frame is only yielded once the one after it is
+        # read, so one more buffer keeps it for buffers frames after that
+        extra = 1 if buffers and not fps else 0
+        self._ring = [np.empty(self._shape, dtype=np.uint8) for _ in range(buffers + extra)]
+        self._process = None
+        self._log = None
+        self._count = 0
+
+    def estimate_frame_count(self):
+        """Frames this reader is expected to yield, from the container duration, or 0 if unknown"""
+        duration = self.meta.get('duration') or 0
+        if self.end is not None:
+            duration = min(duration, self.end) if duration else self.end
+        return max(0, int(round((duration - self.start) * self.frame_rate)))
+
+    def command(self):
+        filters = []
+        if self.fps:
+            # Picks the source frame nearest to every output timestamp, on a
+            # grid that starts at start rather than at the first frame decoded
+            filters.append(f"fps={self.fps}:start_time=0")
+        else:
+            # Logs the timestamp of every frame for _FrameLog to read back
+            filters.append("showinfo=checksum=0")
+        if self.size != tuple(self.meta['size']):
+            filters.append(f"scale={self.size[0]}:{self.size[1]}:flags=lanczos")
+        # Every line is tagged with its level, as showinfo logs at info level
+        command = [ffmpeg_exe(), '-nostdin', '-hide_banner', '-v', 'level+error' if self.fps else 'level+info']
+        if self.threads:
+            command += ['-threads', str(self.threads)]
+        if self.start:
+            # As an input option ffmpeg seeks to the keyframe before start and
+            # drops the frames up to start inside the decoder
+            command += ['-ss', f"{self.start:.6f}"]
+        limit = self.limit
+        if self.end is not None and self.fps:
+            # The frames on the grid before end are counted here, as the last
+            # one ffmpeg's fps filter keeps depends on where its input starts.
+            # It reads a frame further so it has them all.
+            count = max(0, math.ceil((self.end - self.start) * self.fps - 1e-6))
+            limit = count if limit is None else min(limit, count)
+            command += ['-t', f"{self.end - self.start + 1 / self.fps:.6f}"]
+        elif self.end is not None:
+            # Stop reading the input at end
+            command += ['-t', f"{self.end - self.start:.6f}"]
+        command += ['-i', self.video_path, '-an', '-sn']
+        if filters:
+            command += ['-vf', ','.join(filters)]
+        if limit is not None:
+            command += ['-frames:v', str(limit)]
+        if not self.fps:
+            # rawvideo output would otherwise repeat frames to make up a
+            # constant frame rate, where every frame logged should be output
+            command += ['-fps_mode', 'passthrough']
+        return command + ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+
+    def __iter__(self):
+        """Yield (index, frame, duration in ms) for every output frame"""
+        self._process = subprocess.Popen(self.command(), stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Read as ffmpeg writes it, so a chatty ffmpeg can never block on it
+        self._log = _FrameLog(self._process.stderr)
+        self._count = 0
+        try:
+            if self.fps:
+                for index, frame in enumerate(self._frames()):
+                    yield index, frame, _frame_duration(index, self.frame_rate)
+            else:
+                yield from self._timed(self._frames())
+
+            if self._process.wait() != 0 and self._count == 0:
+                raise RuntimeError(f"ffmpeg could not decode {self.video_path}: {self._log.message()}")
+        finally:
+            self.close()
+
+    def _frames(self):
+        while True:
+            frame = self._ring[self._count % len(self._ring)] if self._ring else np.empty(self._shape, np.uint8)
+            if not self._read_into(frame):
+                return
+            self._count += 1
+            yield frame
+
+    def _timed(self, frames):
+        # Every frame waits for the next one to be read, by when ffmpeg has
+        # logged the timestamp it lasts until
+        previous = None
+        for index, frame in enumerate(frames):
+            if previous is not None:
+                yield index - 1, previous, self._duration(index - 1)
+            previous = frame
+        if previous is not None:
+            yield self._count - 1, previous, self._duration(self._count - 1)
+
+    def _duration(self, index):
+        duration = self._log.duration(index)
+        # A frame without logged timestamps gets its share of the container's frame rate
+        return _frame_duration(index, self.frame_rate) if duration is None else duration
+
+    def _read_into(self, frame):
+        view = memoryview(frame).cast('B')
+        filled = 0
+        while filled < len(view):
+            count = self._process.stdout.readinto(view[filled:])
+            if not count:
+                # A partial frame at the end of the stream is dropped
+                return False
+            filled += count
+        return True
+
+    def terminate(self):
+        """Stop ffmpeg from another thread; the reading thread then sees the end of the stream"""
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def close(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        self._log.close()
+
+
+class _FrameLog:
+    """Reads an ffmpeg log as it is written, for the errors and the frame timestamps showinfo logs"""
+
+    _TIMEBASE = re.compile(r'config in time_base: (\d+)/([1-9]\d*)')
+    _FRAME = re.compile(r' n: *\d+ pts: *(\S+) .*? duration: *(-?\d+)')
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.timebase = None
+        # (pts or None, duration) of every frame, in time base ticks
+        self.frames = []
+        self.errors = []
+        self.done = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        for line in self.stream:
+            line = line.decode('utf-8', 'replace').rstrip()
+            if '[error] ' in line or '[fatal] ' in line:
+                self.errors.append(line.replace('[error] ', '').replace('[fatal] ', ''))
+            elif 'Parsed_showinfo' in line:
+                frame = self._FRAME.search(line)
+                timebase = self._TIMEBASE.search(line)
+                with self._condition:
+                    if frame:
+                        pts = int(frame[1]) if frame[1].lstrip('-').isdigit() else None
+                        self.frames.append((pts, int(frame[2])))
+                    elif timebase and self.timebase is None:
+                        self.timebase = Fraction(int(timebase[1]), int(timebase[2]))
+                    self._condition.notify_all()
+        with self._condition:
+            self.done = True
+            self._condition.notify_all()
+
+    def duration(self, index):
+        """Milliseconds from frame index's timestamp to the next frame's, or None if they weren't logged
+
+        The last frame lasts as long as its packet does. Rounded against the
+        first frame's timestamp, so durations add up to the running time.
+        """
+        with self._condition:
+            while len(self.frames) <= index + 1 and not self.done:
+                self._condition.wait()
+            if index >= len(self.frames) or self.timebase is None:
+                return None
+            first = self.frames[0][0]
+            pts, duration = self.frames[index]
+            if index + 1 < len(self.frames):
+                following = self.frames[index + 1][0]
+            else:
+                following = pts + duration if pts is not None and duration > 0 else None
+        if first is None or pts is None or following is None:
+            return None
+        return _to_ms((following - first) * self.timebase) - _to_ms((pts - first) * self.timebase)
+
+    def message(self):
+        """The errors ffmpeg logged, once it has exited"""
+        self._thread.join()
+        return '\n'.join(self.errors)
+
+    def close(self):
+        self._thread.join()
+        self.stream.close()
+
+
+class SegmentedVideoReader:
+    """Decodes a video as several time segments at once, each by an ffmpeg process of its own.
+
+    Yields the same (index, frame, duration) as VideoFrameReader. The range
+    is cut into equal runs of output frames, and each cut is moved back to
+    just after a keyframe where there is one in reach, so no process decodes
+    frames it doesn't keep to get to its start. A segment starts on a frame
+    of the sampling grid and reads exactly its number of frames, so frames
+    at a cut are neither repeated nor skipped.
+
+    The first segment streams to the caller like VideoFrameReader. The
+    others decode ahead into FrameStores, which keep ``budget`` bytes of
+    frames in RAM between them and spill the rest to the cache directory.
+    When every frame is kept, cuts and the end are placed on the container's
+    frame rate, so a variable frame rate video is read by one process.
+    When sampling, cuts are placed where the seek lands on a whole number of
+    the stream's time base ticks, see _exact_step.
+    """
+
+    def __init__(self, video_path, fps=None, size=None, buffers=0, segments=None, meta=None, start=None, end=None,
+                 budget=DEFAULT_FRAME_BUDGET):
+        """
+        Args:
+            segments: Number of segments decoded at once, None for one per CPU
+            budget: Bytes of decoded-ahead frames to keep in RAM
+
+        The other arguments are those of VideoFrameReader.
+        """
+        self.video_path = video_path
+        self.meta = meta or probe_video(video_path)
+        self.fps = fps
+        self.frame_rate = fps or self.meta.get('fps') or 30
+        self.size = tuple(size) if size else tuple(self.meta['size'])
+        self.buffers = buffers
+        self.segments = segments or os.cpu_count() or 1
+        self.start = start or 0
+        self.end = end
+        self.budget = budget
+        self._timebase = None
+        self._readers = []
+
+    def estimate_frame_count(self):
+        return self._reader(self.start, None).estimate_frame_count()
+
+    def plan(self):
+        """Return (first frame index, frame count or None for the rest) of every segment"""
+        total = self.estimate_frame_count()
+        count = min(self.segments, int(total / self.frame_rate / MIN_SEGMENT_SECONDS))
+        if count <= 1:
+            return [(0, None)]
+
+        cuts = [round(index * total / count) for index in range(1, count)]
+        self._timebase, packets = _packets(self.video_path, keyframes_only=bool(self.fps))
+        if not self.fps and _variable_frame_rate(packets):
+            # Its frames don't keep to the frame rate the cuts are counted on
+            return [(0, None)]
+        keyframes = _keyframe_times(self._timebase, packets)
+        if keyframes:
+            cuts = self._after_keyframes(cuts, keyframes, total)
+        firsts = [0] + cuts
+        last = None
+        if self.end is not None:
+            # Counted rather than cut by ffmpeg, which rounds the end against
+            # wherever the segment happened to seek to. Without an fps, as
+            # ffmpeg's duration in one reader, it runs from the first frame kept.
+            last = max(0, math.ceil((self.end - self.start) * self.frame_rate - 1e-6) - firsts[-1])
+        return [(first, following - first) for first, following in zip(firsts, cuts)] + [(firsts[-1], last)]
+
+    def _after_keyframes(self, cuts, keyframes, total):
+        # Move every cut back to the first grid frame after the keyframe
+        # before it, as long as it stays between its neighbours, then on to
+        # the next frame a seek can reach exactly
+        step = self._exact_step()
+        moved = []
+        for number, cut in enumerate(cuts):
+            previous = moved[-1] if moved else 0
+            following = cuts[number + 1] if number + 1 < len(cuts) else total
+            earlier = [time for time in keyframes if time <= self._seek_time(cut)]
+            if earlier:
+                first = math.ceil((earlier[-1] + self._lead() - self._origin()) * self.frame_rate - 1e-6)
+                if previous < first < following:
+                    cut = first
+            cut = -(-cut // step) * step
+            if previous < cut < total:
+                moved.append(cut)
+        return moved
+
+    def _exact_step(self):
+        # ffmpeg rounds a seek to the stream's time base, and the fps filter
+        # breaks ties between two source frames by the rounded timestamps.
+        # A segment only picks the frames one reader would when it seeks a
+        # whole number of ticks after start, which is every step-th frame.
+        if not self.fps or self._timebase is None:
+            return 1
+        return self._ticks_per_frame().denominator
+
+    def _ticks_per_frame(self):
+        return 1 / (Fraction(self.fps).limit_denominator(1001) * self._timebase)
+
+    def _origin(self):
+        # Sampled frames are counted from start, kept ones lie on the
+        # source's own frame times, the first of them at or after start
+        if self.fps:
+            return self.start
+        return math.ceil(self.start * self.frame_rate - 1e-6) / self.frame_rate
+
+    def _lead(self):
+        # With every frame kept, segments seek half a frame early so that a
+        # timestamp rounded down still falls inside them
+        return 0 if self.fps else 0.5 / self.frame_rate
+
+    def _seek_time(self, first):
+        if self.fps and self._timebase is not None:
+            # Counted in ticks from where ffmpeg rounds start to, as one reader does
+            ticks = round(Fraction(self.start) / self._timebase) + first * self._ticks_per_frame()
+            return float(ticks * self._timebase)
+        return self._origin() + first / self.frame_rate - self._lead()
+
+    def _reader(self, start, limit, buffers=0, threads=None):
+        end = self.end
+        if end is not None and limit is not None:
+            # The count ends the segment, the end only has to not come first
+            end += 1 / self.frame_rate
+        return VideoFrameReader(self.video_path, self.fps, self.size, buffers, meta=self.meta, start=start,
+                                end=end, limit=limit, threads=threads)
+
+    def __iter__(self):
+        """Yield (index, frame, duration in ms) for every output frame, in order"""
+        plan = self.plan()
+        if len(plan) == 1:
+            yield from self._reader(self.start, None, self.buffers)
+            return
+
+        # The processes share the cores instead of each starting a thread per core
+        threads = max(1, (os.cpu_count() or 1) // len(plan))
+        stop = threading.Event()
+        width, height = self.size
+        pending = []
+        # Sampled segments start decoding a step early, so that the fps
+        # filter sees every source frame near their first frame
+        early = self._exact_step() if self.fps and self._timebase is not None else 0
+        for first, limit in plan[1:]:
+            store = FrameStore((height, width, 3), budget=self.budget // (len(plan) - 1))
+            reader = self._reader(self._seek_time(first - early), limit and limit + early, buffers=2,
+                                  threads=threads)
+            pending.append(_SegmentFrames(reader, store, stop, skip=early))
+        first_reader = self._reader(self.start, plan[0][1], self.buffers, threads)
+        self._readers = [first_reader] + [segment.reader for segment in pending]
+        try:
+            for segment in pending:
+                segment.start()
+            index = 0
+            for frames in [(frame for _, frame, _ in first_reader)] + pending:
+                for frame in frames:
+                    yield index, frame, _frame_duration(index, self.frame_rate)
+                    index += 1
+        finally:
+            stop.set()
+            for segment in pending:
+                segment.close()
+            first_reader.close()
+            self._readers = []
+
+
+class _SegmentFrames:
+    """The frames of one segment, stored by a decoding thread while the caller reads them in order"""
+
+    def __init__(self, reader, store, stop, skip=0):
+        self.reader = reader
+        self.store = store
+        self.stop = stop
+        self.skip = skip
+        self.done = False
+        self.error = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._decode, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _decode(self):
+        error = None
+        try:
+            for index, frame, duration in self.reader:
+                if self.stop.is_set():
+                    break
+                if index < self.skip:
+                    continue
+                with self._condition:
+                    self.store.append(SourceFrame(frame, duration))
+                    self._condition.notify_all()
+        except Exception as e:
+            error = e
+        with self._condition:
+            self.done = True
+            self.error = error
+            self._condition.notify_all()
+
+    def __iter__(self):
+        """Yield the segment's frames, waiting for those not decoded yet"""
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.store) and not self.done:
+                    self._condition.wait()
+                if index >= len(self.store):
+                    if self.error is not None and not self.stop.is_set():
+                        raise self.error
+                    return
+                pixels = self.store[index].image
+            yield pixels
+            index += 1
+
+    def close(self):
+        self.reader.terminate()
+        self._thread.join()
+        self.store.close()
+
+
+def _frame_duration(index, frame_rate):
+    # Whole-millisecond durations that add up to the real running time
+    return _to_ms((index + 1) / frame_rate) - _to_ms(index / frame_rate)
+
+
+def _to_ms(seconds):
+    return int(round(seconds * 1000))
@@ -0,0 +1,534 @@
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import socketserver
+import stat
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cli import _run_job, output_path_for
+from utils.file_utils import is_gif_file, is_video_file
+
+# GifProcessor settings a job may set; the number of workers is the server's
+JOB_SETTINGS = ('fps', 'start', 'end', 'max_duration', 'scale', 'max_width', 'palette', 'palette_colors',
+                'palette_sample_frames', 'dither', 'collapse_duplicates', 'cache', 'engine', 'streaming',
+                'batch_size', 'queue_size', 'frame_budget', 'decode_segments', 'max_bytes', 'max_seconds',
+                'cache_frames')
+
+# Finished jobs kept for status requests; older ones are forgotten
+MAX_FINISHED_JOBS = 1000
+
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+
+
+def _worker_main(connection, frame_path):
+    """Run jobs sent over connection until it closes; the main function of each worker process.
+
+    Everything a render needs is imported once, and device frames stay
+    loaded and scaled between jobs, along with their corner masks, so a
+    job starts decoding straight away.
+    """
+    from processors.compositor import corner_mask
+    from processors.frame_asset import FrameAsset
+    from processors.gif_processor import GifProcessor
+
+    assets = {}
+
+    def load_asset(path, scale=1.0, max_width=None):
+        key = (os.path.abspath(path), os.stat(path).st_mtime_ns, scale, max_width)
+        if key not in assets:
+            asset = FrameAsset.load(path)
+            assets[key] = asset = asset.scaled(asset.scale_for(scale, max_width))
+            corner_mask(asset.screen_size, asset.radius)
+        return assets[key]
+
+    class WarmGifProcessor(GifProcessor):
+        def load_asset(self, frame_path):
+            with self.metrics.stage('asset'):
+                return load_asset(frame_path, self.scale, self.max_width)
+
+    load_asset(frame_path)
+
+    class Events:
+        def put(self, event):
+            connection.send(event)
+
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        result = _run_job(job['id'], job['input'], job['frame'], job['outputs'], job['settings'], Events(),
+                          processor_class=WarmGifProcessor,
+                          templates=[(template['frame'], template['outputs']) for template in job['templates']])
+        connection.send((job['id'], 'result', result))
+
+
+def _same_file(path, other):
+    """Whether two paths name the same file, through symlinks and hard links"""
+    if os.path.realpath(path) == os.path.realpath(other):
+        return True
+    try:
+        return os.path.samefile(path, other)
+    except OSError:
+        return False
+
+
+class _Worker:
+    """A worker process and the pipe jobs are sent to it over"""
+
+    def __init__(self, frame_path, context):
+        self.frame_path = frame_path
+        self.context = context
+        self.process = None
+        self.connection = None
+
+    def start(self):
+        self.connection, child = self.context.Pipe()
+        self.process = self.context.Process(target=_worker_main, args=(child, self.frame_path), daemon=True)
+        self.process.start()
+        child.close()
+
+    def ensure_running(self):
+        if self.process is None or not self.process.is_alive():
+            self.stop()
+            self.start()
+
+    def kill(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.kill()
+
+    def stop(self, timeout=5):
+        if self.process is None:
+            return
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout)
+        self.kill()
+        self.process.join()
+        self.connection.close()
+        self.process = self.connection = None
+
+
+class JobServer:
+    """Queues framing jobs by priority and runs them on a pool of warm worker processes.
+
+    Jobs with a higher priority start first, jobs of equal priority in the
+    order they came in. Every worker has a thread here that feeds it jobs
+    and collects their progress. Cancelling a running job restarts its
+    worker, as a render can't be stopped half way otherwise.
+    """
+
+    def __init__(self, frame_path, workers=1):
+        self.frame_path = frame_path
+        self.jobs = {}
+        self._queue = []
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._closed = False
+        # Spawned, because forking a process with server threads running is unsafe
+        context = multiprocessing.get_context('spawn')
+        self._workers = [_Worker(frame_path, context) for _ in range(max(1, workers))]
+        self._threads = []
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+            thread = threading.Thread(target=self._dispatch, args=(worker,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        """Cancel queued jobs, let running ones finish and stop the workers"""
+        with self._condition:
+            self._closed = True
+            for job in list(self.jobs.values()):
+                if job['status'] == 'queued':
+                    self._finish(job, 'cancelled')
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.stop(timeout=None)
+        for thread in self._threads:
+            thread.join(5)
+
+    def submit(self, spec):
+        """Queue a job described by a dict and return its status.
+
+        spec holds "input", and optionally "frame", "outputs" (paths),
+        "formats" (used when outputs are not given), "templates", "settings"
+        and "priority". Templates are more device frames rendered from the
+        same decode, as {"frame", "outputs"} objects; without outputs they
+        get the job's formats, named after the frame. Raises ValueError
+        when any of it is unusable.
+        """
+        from processors.encoders import FORMAT_EXTENSIONS, output_format
+
+        input_path = spec.get('input')
+        if not input_path or not os.path.isfile(input_path):
+            raise ValueError(f"Input not found: {input_path}")
+        if not (is_gif_file(input_path) or is_video_file(input_path)):
+            raise ValueError(f"Not a GIF or video: {input_path}")
+        frame_path = spec.get('frame') or self.frame_path
+        if not os.path.isfile(frame_path):
+            raise ValueError(f"Frame image not found: {frame_path}")
+
+        outputs = spec.get('outputs')
+        if outputs and not (isinstance(outputs, list) and all(isinstance(path, str) for path in outputs)):
+            raise ValueError("outputs has to be a list of paths")
+        if not outputs:
+            formats = spec.get('formats') or ['gif']
+            unknown = [kind for kind in formats if kind not in FORMAT_EXTENSIONS]
+            if unknown:
+                raise ValueError(f"Unknown output formats: {', '.join(map(str, unknown))}")
+            outputs = [output_path_for(input_path, spec.get('output_dir'), extension=FORMAT_EXTENSIONS[kind])
+                       for kind in formats]
+        for path in outputs:
+            output_format(path)
+
+        template_specs = spec.get('templates') or []
+        if not isinstance(template_specs, list) or not all(isinstance(item, dict) for item in template_specs):
+            raise ValueError("templates has to be a list of objects")
+        templates = []
+        for index, template in enumerate(template_specs):
+            template_frame = template.get('frame')
+            if not isinstance(template_frame, str) or not os.path.isfile(template_frame):
+                raise ValueError(f"Frame image of template {index} not found: {template_frame}")
+            template_outputs = template.get('outputs')
+            if template_outputs and not (isinstance(template_outputs, list)
+                                         and all(isinstance(path, str) for path in template_outputs)):
+                raise ValueError(f"outputs of template {index} has to be a list of paths")
+            if not template_outputs:
+                suffix = '_framed_' + os.path.splitext(os.path.basename(template_frame))[0]
+                template_outputs = [
+                    output_path_for(input_path, spec.get('output_dir') or os.path.dirname(path), suffix,
+                                    os.path.splitext(path)[1])
+                    for path in outputs
+                ]
+            for path in template_outputs:
+                output_format(path)
+            templates.append({'frame': os.path.abspath(template_frame),
+                              'outputs': [os.path.abspath(path) for path in template_outputs]})
+
+        # Outputs of a failed job are deleted, so none may be a file the job reads
+        sources = [input_path, frame_path] + [template['frame'] for template in templates]
+        for path in outputs + [path for template in templates for path in template['outputs']]:
+            for source in sources:
+                if _same_file(path, source):
+                    raise ValueError(f"Output {path} is the job's input {source}")
+
+        settings = spec.get('settings') or {}
+        if not isinstance(settings, dict):
+            raise ValueError("settings has to be an object")
+        unknown = sorted(set(settings) - set(JOB_SETTINGS))
+        if unknown:
+            raise ValueError(f"Unknown settings: {', '.join(unknown)}")
+        try:
+            priority = int(spec.get('priority', 0))
+        except (TypeError, ValueError):
+            raise ValueError("priority has to be a whole number")
+
+        with self._condition:
+            if self._closed:
+                raise ValueError("The server is shutting down")
+            job_id = str(next(self._ids))
+            self.jobs[job_id] = {
+                'id': job_id,
+                'status': 'queued',
+                'priority': priority,
+                'input': os.path.abspath(input_path),
+                'frame': os.path.abspath(frame_path),
+                'outputs': [os.path.abspath(path) for path in outputs],
+                'templates': templates,
+                'settings': settings,
+                'progress': 0,
+                'message': None,
+                'error': None,
+                'submitted': time.time(),
+                'started': None,
+                'finished': None,
+                'elapsed': None,
+                'budget': None,
+            }
+            heapq.heappush(self._queue, (-priority, int(job_id), job_id))
+            self._condition.notify()
+            return self.status(job_id)
+
+    def status(self, job_id):
+        """Return a job's status with its timing, or None for an unknown job"""
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            info = {key: value for key, value in job.items() if not key.startswith('_')}
+            info.update(outputs=list(job['outputs']), settings=dict(job['settings']),
+                        templates=[dict(template, outputs=list(template['outputs']))
+                                   for template in job['templates']])
+        now = time.time()
+        info['queued_seconds'] = (info['started'] or info['finished'] or now) - info['submitted']
+        if info['started']:
+            info['run_seconds'] = (info['finished'] or now) - info['started']
+        else:
+            info['run_seconds'] = None
+        if info['status'] == 'queued':
+            with self._condition:
+                info['queue_position'] = sum(1 for entry in self._queue
+                                             if entry < (-job['priority'], int(job_id), job_id)
+                                             and self.jobs.get(entry[2], {}).get('status') == 'queued')
+        return info
+
+    def list(self):
+        with self._condition:
+            job_ids = list(self.jobs)
+        return [self.status(job_id) for job_id in job_ids]
+
+    def health(self):
+        with self._condition:
+            states = [job['status'] for job in self.jobs.values()]
+        return {
+            'workers': len(self._workers),
+            'alive_workers': sum(1 for worker in self._workers
+                                 if worker.process is not None and worker.process.is_alive()),
+            'queued': states.count('queued'),
+            'running': states.count('running'),
+        }
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job and return its status, or None for an unknown job"""
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job['status'] == 'queued':
+                # Skipped when it comes up in the queue
+                self._finish(job, 'cancelled')
+            elif job['status'] == 'running':
+                job['status'] = 'cancelling'
+                worker = job.get('_worker')
+                if worker is not None:
+                    worker.kill()
+        return self.status(job_id)
+
+    def _next_job(self, worker):
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None
+                while self._queue:
+                    _, _, job_id = heapq.heappop(self._queue)
+                    job = self.jobs.get(job_id)
+                    if job is not None and job['status'] == 'queued':
+                        job['status'] = 'running'
+                        job['started'] = time.time()
+                        job['_worker'] = worker
+                        return job
+                self._condition.wait()
+
+    def _dispatch(self, worker):
+        """Feed one worker jobs from the queue until the server closes"""
+        while True:
+            job = self._next_job(worker)
+            if job is None:
+                return
+            message = {key: job[key] for key in ('id', 'input', 'frame', 'outputs', 'templates', 'settings')}
+            try:
+                worker.ensure_running()
+                worker.connection.send(message)
+                while True:
+                    _, kind, value = worker.connection.recv()
+                    if kind == 'result':
+                        break
+                    self._update(job, kind, value)
+            except (EOFError, OSError) as e:
+                # The worker died, or was killed to cancel the job
+                with self._condition:
+                    if job['status'] == 'cancelling':
+                        self._finish(job, 'cancelled')
+                    else:
+                        self._finish(job, 'failed', error=f"Worker process stopped: {e or 'no reply'}")
+                self._remove_partial_outputs(job)
+                if self._closed:
+                    return
+                # Warm up a fresh worker before the next job needs it
+                worker.stop()
+                worker.start()
+                continue
+            with self._condition:
+                if value['error']:
+                    self._finish(job, 'failed', error=value['error'])
+                else:
+                    job['progress'] = 100
+                    self._finish(job, 'done', elapsed=value['elapsed'], budget=value.get('budget'))
+
+    def _update(self, job, kind, value):
+        with self._condition:
+            if kind == 'progress':
+                job['progress'] = value
+            elif kind == 'status':
+                job['message'] = value
+
+    def _finish(self, job, status, **info):
+        # Called with the lock held
+        job.update(info, status=status, finished=time.time())
+        job.pop('_worker', None)
+        finished = [job_id for job_id, other in self.jobs.items() if other['status'] in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    @staticmethod
+    def _remove_partial_outputs(job):
+        for path in job['outputs'] + [path for template in job['templates'] for path in template['outputs']]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """JSON API of a JobServer:
+
+        GET    /health            workers and queue length
+        GET    /jobs              every job's status
+        POST   /jobs              submit a job, see JobServer.submit
+        GET    /jobs/<id>         one job's status, progress and timing
+        POST   /jobs/<id>/cancel  cancel a job (DELETE /jobs/<id> does the same)
+
+    The API is for local tools, not web pages: requests that carry an
+    Origin header are refused, and POST bodies have to be sent as
+    application/json, which a page can't do without asking first. That
+    keeps sites open in a browser on the same machine from submitting
+    jobs, which read and write any path the server can.
+    """
+
+    server_version = 'gifframingtool'
+
+    def do_GET(self):
+        if not self._allowed():
+            return
+        parts = self._path_parts()
+        if parts == ['health']:
+            self._send(200, self.server.jobs.health())
+        elif parts == ['jobs']:
+            self._send(200, {'jobs': self.server.jobs.list()})
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            self._send_job(self.server.jobs.status(parts[1]))
+        else:
+            self._send(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if not self._allowed(json_body=True):
+            return
+        parts = self._path_parts()
+        if parts == ['jobs']:
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+                spec = json.loads(self.rfile.read(length) or b'{}')
+                if not isinstance(spec, dict):
+                    raise ValueError("Expected a JSON object")
+                self._send(202, self.server.jobs.submit(spec))
+            except ValueError as e:
+                self._send(400, {'error': str(e)})
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+            self._send_job(self.server.jobs.cancel(parts[1]))
+        else:
+            self._send(404, {'error': 'Not found'})
+
+    def do_DELETE(self):
+        if not self._allowed():
+            return
+        parts = self._path_parts()
+        if len(parts) == 2 and parts[0] == 'jobs':
+            self._send_job(self.server.jobs.cancel(parts[1]))
+        else:
+            self._send(404, {'error': 'Not found'})
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'local'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _allowed(self, json_body=False):
+        """Send an error and return False for requests from web pages or with a body that isn't JSON"""
+        if self.headers.get('Origin') is not None:
+            self._send(403, {'error': 'Requests from web pages are not accepted'})
+            return False
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if json_body and content_type != 'application/json':
+            self._send(415, {'error': 'Send the request body as application/json'})
+            return False
+        return True
+
+    def _path_parts(self):
+        return [part for part in self.path.split('?')[0].split('/') if part]
+
+    def _send_job(self, job):
+        if job is None:
+            self._send(404, {'error': 'No such job'})
+        else:
+            self._send(200, job)
+
+    def _send(self, status, body):
+        data = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_http_server(jobs, host='127.0.0.1', port=8765, socket_path=None, verbose=False):
+    """Serve a JobServer's API on a TCP port, or on a Unix socket when socket_path is given.
+
+    A socket left behind by an earlier server is replaced, but any other
+    file at socket_path raises ValueError rather than being deleted.
+    """
+    if socket_path:
+        try:
+            mode = os.lstat(socket_path).st_mode
+        except FileNotFoundError:
+            mode = None
+        if mode is not None and not stat.S_ISSOCK(mode):
+            raise ValueError(f"{socket_path} exists and is not a socket, not replacing it")
+        if mode is not None:
+            os.remove(socket_path)
+        httpd = UnixHTTPServer(socket_path, JobRequestHandler)
+    else:
+        httpd = ThreadingHTTPServer((host, port), JobRequestHandler)
+    httpd.jobs = jobs
+    httpd.verbose = verbose
+    return httpd
+
+
+def serve(frame_path, workers=1, host='127.0.0.1', port=8765, socket_path=None, verbose=False, log=print):
+    """Run the job server until interrupted or terminated"""
+    jobs = JobServer(frame_path, workers)
+    httpd = make_http_server(jobs, host, port, socket_path, verbose)
+    # serve_forever has to be stopped from another thread
+    signal.signal(signal.SIGTERM, lambda *args: threading.Thread(target=httpd.shutdown).start())
+    jobs.start()
+    address = socket_path or f"http://{host}:{httpd.server_address[1]}"
+    log(f"Serving framing jobs on {address} with {len(jobs._workers)} workers")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        jobs.close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+    return 0
@@ -11,6 +11,7 @@ DESCRIPTION = "A tool to frame GIFs and videos in device frames"
 INSTALL_REQUIRES = [
     "PyQt5>=5.15.0",
     "Pillow>=8.0.0",
+    "numpy>=1.17.0",
     "imageio>=2.9.0",
     "imageio-ffmpeg>=0.4.0",
 ]
@@ -21,12 +22,15 @@ setup(
     author=AUTHOR,
     description=DESCRIPTION,
     packages=find_packages(),
+    py_modules=["main", "cli", "server"],
     install_requires=INSTALL_REQUIRES,
     python_requires=">=3.6",
     include_package_data=True,
     entry_points={
         "console_scripts": [
             "gifframingtool=main:main",
+            # Headless: batch, cache and serve without importing Qt
+            "gifframingtool-cli=cli:main",
         ],
     },
 )
\ No newline at end of file
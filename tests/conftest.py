@@ -0,0 +1,110 @@
+import os
+import sys
+
+import pytest
+
+# The tool runs from its checkout rather than as an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Give every test its own empty cache directory"""
+    path = tmp_path / 'cache'
+    monkeypatch.setenv('GIFFRAMINGTOOL_CACHE_DIR', str(path))
+    return path
+
+
+def draw_device_frame(path, size=(120, 200), screen=(96, 176), radius=12, hole=True, color=(30, 30, 30)):
+    """Save a device frame PNG with a centered rounded screen.
+
+    The screen is a see-through hole, or a solid white placeholder like the
+    bundled frame.png.
+    """
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGBA', size, color + (255,))
+    x, y = (size[0] - screen[0]) // 2, (size[1] - screen[1]) // 2
+    fill = (0, 0, 0, 0) if hole else (255, 255, 255, 255)
+    ImageDraw.Draw(image).rounded_rectangle((x, y, x + screen[0] - 1, y + screen[1] - 1), radius, fill=fill)
+    image.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def device_frame(tmp_path):
+    """A small device frame with a see-through screen"""
+    return draw_device_frame(tmp_path / 'frame.png')
+
+
+def draw_gif(path, frames=6, size=(48, 80), durations=None, transparent=False):
+    """Save an animated GIF of a square moving over a gradient"""
+    import numpy as np
+    from PIL import Image
+
+    images = []
+    for index in range(frames):
+        pixels = np.zeros(size[::-1] + (4,), dtype=np.uint8)
+        pixels[..., 0] = np.linspace(0, 255, size[0], dtype=np.uint8)
+        pixels[..., 2] = np.linspace(0, 255, size[1], dtype=np.uint8)[:, np.newaxis]
+        pixels[..., 3] = 255
+        if transparent:
+            pixels[: size[1] // 4, ..., 3] = 0
+        x = index * 5 % (size[0] - 10)
+        pixels[30:40, x:x + 10] = (255, 255, 0, 255)
+        images.append(Image.fromarray(pixels, 'RGBA'))
+    durations = durations or [80] * frames
+    images[0].save(path, save_all=True, append_images=images[1:], duration=durations, loop=0, disposal=2)
+    return str(path)
+
+
+@pytest.fixture
+def gif_path(tmp_path):
+    """A six-frame animated GIF"""
+    return draw_gif(tmp_path / 'input.gif')
+
+
+def render(input_path, frame_path, output_path, signals=None, **settings):
+    """Run a GifProcessor on the calling thread and return its output path.
+
+    Renders skip the on-disk cache unless asked for, and errors are raised.
+    """
+    from processors.gif_processor import GifProcessor
+    from utils.signals import CallbackSignals
+
+    signals = signals or CallbackSignals()
+    errors = []
+    signals.error.connect(errors.append)
+    settings.setdefault('cache', False)
+    processor = GifProcessor(input_path, frame_path, output_path, signals, **settings)
+    processor.run()
+    if errors:
+        raise RuntimeError(errors[0])
+    return processor
+
+
+def read_frames(path):
+    """Return the frames of an animation as RGBA arrays with their durations"""
+    import numpy as np
+    from PIL import Image, ImageSequence
+
+    with Image.open(path) as image:
+        return [(np.array(frame.convert('RGBA')), frame.info.get('duration'))
+                for frame in ImageSequence.Iterator(image)]
+
+
+def encode_video(path, seconds=2, rate=24, size=(64, 112), gop=12):
+    """Encode an ffmpeg test pattern video with a keyframe every ``gop`` frames"""
+    import subprocess
+    from processors.video_reader import ffmpeg_exe
+
+    subprocess.run([ffmpeg_exe(), '-nostdin', '-v', 'error', '-y', '-f', 'lavfi',
+                    '-i', f"testsrc=size={size[0]}x{size[1]}:rate={rate}:duration={seconds}",
+                    '-pix_fmt', 'yuv420p', '-g', str(gop), '-bf', '0', str(path)], check=True)
+    return str(path)
+
+
+@pytest.fixture(scope='session')
+def video_path(tmp_path_factory):
+    """A two second 24 fps video"""
+    return encode_video(tmp_path_factory.mktemp('video') / 'input.mp4')
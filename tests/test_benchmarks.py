@@ -0,0 +1,34 @@
+import json
+import os
+
+from benchmarks.run_benchmarks import SUITE_VERSION, compare
+
+BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'baseline.json')
+
+
+def test_compare_flags_slower_bigger_and_hungrier_cases():
+    baseline = {'a': {'fps': 100, 'peak_rss': 1000, 'output_bytes': 500},
+                'b': {'fps': 100, 'peak_rss': 1000, 'output_bytes': None}}
+    results = {'a': {'fps': 80, 'peak_rss': 1300, 'output_bytes': 500},
+               'b': {'fps': 95, 'peak_rss': 1100, 'output_bytes': None},
+               'new': {'fps': 1, 'peak_rss': 1, 'output_bytes': 1}}
+    regressions = compare(results, baseline, max_slowdown=0.15, max_growth=0.15)
+    assert len(regressions) == 2
+    assert regressions[0].startswith('a: 80.0 frames/s')
+    assert regressions[1].startswith('a: peak RSS')
+    assert compare(results, baseline, max_slowdown=0.5, max_growth=0.5) == []
+
+
+def test_committed_baseline_matches_the_suite():
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    assert baseline['suite_version'] == SUITE_VERSION
+    assert baseline['settings'] == {'scale': 0.25, 'workers': 1, 'repeat': 3}
+    assert all(result['fps'] for result in baseline['results'].values())
+
+
+def test_compare_can_leave_out_speed():
+    baseline = {'a': {'fps': 100, 'peak_rss': 1000, 'output_bytes': 500}}
+    results = {'a': {'fps': 10, 'peak_rss': 1000, 'output_bytes': 900}}
+    regressions = compare(results, baseline, max_slowdown=0.15, max_growth=0.15, speed=False)
+    assert regressions == ['a: output size 900 bytes, was 500']
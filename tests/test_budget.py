@@ -0,0 +1,125 @@
+import os
+import time
+
+import pytest
+
+from conftest import draw_device_frame, encode_video, render
+from processors.budget import BudgetPlanner, Candidate, Estimate, budget_ladder, format_bytes
+
+
+def test_ladder_steps_down_from_the_configured_settings():
+    ladder = budget_ladder(30, 0.5, 256)
+    assert ladder[0] == Candidate(30, 0.5, 256)
+    for higher, lower in zip(ladder, ladder[1:]):
+        assert lower != higher
+        assert lower.fps <= higher.fps and lower.scale <= higher.scale and lower.colors <= higher.colors
+    assert ladder[-1] == Candidate(9.0, 0.05, 32)
+
+
+def test_ladder_keeps_settings_that_are_not_tuned():
+    ladder = budget_ladder(None, 1.0, 64, tune_fps=False, tune_colors=False)
+    assert {(candidate.fps, candidate.colors) for candidate in ladder} == {(None, 64)}
+    assert [candidate.scale for candidate in ladder][:3] == [1.0, 0.85, 0.7]
+
+
+class FakePlanner(BudgetPlanner):
+    """Predicts sizes that halve with every rung, without sampling anything; every estimate takes `cost` seconds"""
+
+    def __init__(self, ladder, max_bytes=None, max_seconds=None, cost=0):
+        self.ladder = ladder
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.estimates = {}
+        self.sample_scale = None
+        self._samples = {}
+        self.cost = cost
+        self.clock = 0
+
+    def estimate(self, candidate):
+        if candidate not in self.estimates:
+            self.clock += self.cost
+        rung = self.ladder.index(candidate)
+        self.estimates[candidate] = Estimate(1000 / 2 ** rung, 100 / (rung + 1), 10)
+        return self.estimates[candidate]
+
+
+@pytest.mark.parametrize('max_bytes, rung', [(2000, 0), (1000, 1), (300, 2), (100, 4), (60, 5)])
+def test_choose_takes_the_first_rung_that_fits_with_headroom(max_bytes, rung):
+    ladder = budget_ladder(30, 1.0, 256)
+    planner = FakePlanner(ladder, max_bytes=max_bytes)
+    candidate, estimate, fits = planner.choose(ladder)
+    assert (ladder.index(candidate), fits) == (rung, True)
+    assert estimate.bytes <= max_bytes * 0.9
+    # Bisected rather than tried one by one
+    assert len(planner.estimates) <= 2 + len(ladder).bit_length()
+
+
+def test_choose_counts_time_already_spent_and_falls_back_to_the_last_rung():
+    ladder = budget_ladder(30, 1.0, 256)
+    planner = FakePlanner(ladder, max_seconds=60)
+    candidate, estimate, fits = planner.choose(ladder, elapsed=lambda: 30)
+    assert estimate.seconds + 30 <= 54 and fits
+    candidate, _, fits = FakePlanner(ladder, max_bytes=1e-6).choose(ladder)
+    assert candidate == ladder[-1] and not fits
+
+
+def test_choose_stops_sampling_once_planning_has_taken_its_share():
+    ladder = budget_ladder(30, 1.0, 256)
+    # Every estimate takes an eighth of the budget, and the bisection would
+    # go on to rung 3 after five of them; planning stops after two
+    planner = FakePlanner(ladder, max_seconds=100, cost=12.5)
+    candidate, _, fits = planner.choose(ladder, elapsed=lambda: planner.clock)
+    assert [ladder.index(rung) for rung in planner.estimates] == [0, 9]
+    assert ladder.index(candidate) == 9 and fits
+
+
+def test_render_fits_the_size_budget(tmp_path, video_path, device_frame):
+    unbounded = render(video_path, device_frame, str(tmp_path / 'full.gif'))
+    assert unbounded.budget_report is None
+    budget = os.path.getsize(tmp_path / 'full.gif') // 2
+
+    processor = render(video_path, device_frame, str(tmp_path / 'out.gif'), max_bytes=budget)
+    report = processor.budget_report
+    assert os.path.getsize(tmp_path / 'out.gif') <= budget
+    assert report['fits'] and report['bytes'] == os.path.getsize(tmp_path / 'out.gif')
+    assert report['predicted_bytes'] <= budget * 0.9
+    assert report['seconds'] >= report['planning_seconds'] > 0
+    assert report['candidates_sampled'] > 1
+    assert (report['fps'], report['scale'], report['colors']) < (10, 1.0, 256)
+    assert processor.scale == report['scale']
+
+
+def test_render_fits_the_time_budget(tmp_path):
+    # Framing takes most of the time at this size, which planning only samples
+    frame = draw_device_frame(tmp_path / 'frame.png', size=(1000, 1800), screen=(900, 1700), radius=60)
+    video = encode_video(tmp_path / 'input.mp4', seconds=3, size=(180, 320))
+    started = time.perf_counter()
+    render(video, frame, str(tmp_path / 'full.gif'))
+    max_seconds = (time.perf_counter() - started) * 0.75
+
+    started = time.perf_counter()
+    processor = render(video, frame, str(tmp_path / 'out.gif'), max_seconds=max_seconds)
+    assert time.perf_counter() - started <= max_seconds
+    report = processor.budget_report
+    assert report['seconds'] <= max_seconds
+    assert report['scale'] < 1.0
+
+
+def test_settings_that_fit_are_kept(tmp_path, gif_path, device_frame):
+    processor = render(gif_path, device_frame, str(tmp_path / 'out.gif'), max_bytes=10 ** 8, max_seconds=600)
+    report = processor.budget_report
+    assert report['fits'] and report['candidates_sampled'] == 1
+    assert (report['fps'], report['scale'], report['colors']) == (None, 1.0, 256)
+    assert report['bytes'] == os.path.getsize(tmp_path / 'out.gif')
+
+
+def test_budget_choice_is_cached(tmp_path, video_path, device_frame):
+    budget = 20000
+    first = render(video_path, device_frame, str(tmp_path / 'first.gif'), max_bytes=budget, cache=True)
+    second = render(video_path, device_frame, str(tmp_path / 'second.gif'), max_bytes=budget, cache=True)
+    assert second.budget_report['candidates_sampled'] == 0
+    assert second.budget_report['scale'] == first.budget_report['scale']
+
+
+def test_format_bytes():
+    assert [format_bytes(size) for size in (512, 9830, 10 * 1024 ** 2)] == ['512 B', '9.6 KB', '10.0 MB']
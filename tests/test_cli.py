@@ -0,0 +1,55 @@
+import argparse
+import json
+import os
+
+import pytest
+
+from cli import collect_inputs, main, parse_time
+from conftest import draw_gif, read_frames
+
+
+def run(capsys, *argv):
+    code = main(list(argv))
+    return code, capsys.readouterr().out
+
+
+def test_collect_inputs_expands_folders_and_patterns(tmp_path):
+    (tmp_path / 'clips').mkdir()
+    first = draw_gif(tmp_path / 'clips' / 'a.gif')
+    second = draw_gif(tmp_path / 'b.gif')
+    (tmp_path / 'clips' / 'notes.txt').write_text('not media')
+    found = collect_inputs([str(tmp_path / 'clips'), str(tmp_path / '*.gif'), second])
+    assert found == sorted([os.path.abspath(first), os.path.abspath(second)])
+
+
+def test_parse_time_accepts_seconds_and_clock_times():
+    assert parse_time('12.5') == 12.5
+    assert parse_time('1:05') == 65
+    assert parse_time('0:01:05.5') == 65.5
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_time('soon')
+
+
+def test_batch_frames_every_input_on_a_worker_pool(tmp_path, device_frame, capsys):
+    draw_gif(tmp_path / 'one.gif', frames=3)
+    draw_gif(tmp_path / 'two.gif', frames=4)
+    out_dir = tmp_path / 'out'
+    code, output = run(capsys, 'batch', str(tmp_path / '*.gif'), '--frame', device_frame, '--output-dir',
+                       str(out_dir), '-j', '2', '--no-cache', '--json')
+
+    assert code == 0
+    events = [json.loads(line) for line in output.splitlines()]
+    assert events[-1]['event'] == 'summary'
+    assert (events[-1]['succeeded'], events[-1]['failed']) == (2, 0)
+    assert len(read_frames(out_dir / 'one_framed.gif')) == 3
+    assert len(read_frames(out_dir / 'two_framed.gif')) == 4
+
+
+def test_batch_reports_failures_in_its_exit_code(tmp_path, device_frame, capsys):
+    draw_gif(tmp_path / 'good.gif', frames=2)
+    (tmp_path / 'bad.gif').write_bytes(b'GIF89a broken')
+    code, output = run(capsys, 'batch', str(tmp_path), '--frame', device_frame, '-j', '1', '--no-cache')
+    assert code == 1
+    assert 'bad.gif: FAILED' in output
+    assert '1 succeeded, 1 failed' in output
+    assert os.path.exists(tmp_path / 'good_framed.gif')
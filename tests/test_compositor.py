@@ -0,0 +1,115 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from processors.compositor import Compositor, corner_mask
+
+FRAME_SIZE = (120, 200)
+SCREEN_SIZE = (100, 180)
+RADIUS = 12
+
+
+def over(compositor, screens):
+    """Reference "over" operator in floating point"""
+    out = np.repeat(compositor.background[np.newaxis], len(screens), axis=0).astype(np.float64)
+    source_alpha = screens[..., 3] if screens.shape[3] == 4 else np.full(screens.shape[:3], 255)
+    src_a = (np.round(compositor.mask * source_alpha.astype(np.float64) / 255) / 255)[..., np.newaxis]
+    bg = compositor.background[compositor._screen] / 255.0
+    bg_a = bg[..., 3:] * (1 - src_a)
+    out_a = src_a + bg_a
+    color = screens[..., :3] / 255.0 * src_a + bg[..., :3] * bg_a
+    color = np.divide(color, out_a, out=np.zeros_like(color), where=out_a > 0)
+    screen = out[(slice(None),) + compositor._screen]
+    screen[..., :3] = np.round(color * 255)
+    screen[..., 3] = np.round(out_a[..., 0] * 255)
+    return out.astype(np.uint8)
+
+
+def device_frame(rng, hole):
+    """A noisy device frame whose screen is opaque or a see-through hole"""
+    pixels = rng.integers(0, 256, FRAME_SIZE[::-1] + (4,), dtype=np.uint8)
+    pixels[..., 3] = 255
+    if hole:
+        x, y = (FRAME_SIZE[0] - SCREEN_SIZE[0]) // 2, (FRAME_SIZE[1] - SCREEN_SIZE[1]) // 2
+        screen = pixels[y:y + SCREEN_SIZE[1], x:x + SCREEN_SIZE[0]]
+        screen[..., 3] = rng.integers(0, 256, screen.shape[:2])
+        screen[40:100, 20:80, 3] = 0
+    return Image.fromarray(pixels, 'RGBA')
+
+
+@pytest.mark.parametrize('hole', [False, True])
+@pytest.mark.parametrize('channels', [3, 4])
+def test_matches_the_over_operator(hole, channels):
+    rng = np.random.default_rng(1)
+    compositor = Compositor(device_frame(rng, hole), SCREEN_SIZE, RADIUS, batch_size=2)
+    screens = rng.integers(0, 256, (2,) + SCREEN_SIZE[::-1] + (channels,), dtype=np.uint8)
+    if channels == 4:
+        screens[:, :20, :, 3] = 0
+        screens[:, 20:40, :, 3] = 255
+
+    out = compositor.composite_batch(screens)
+    expected = over(compositor, screens)
+    difference = np.abs(out.astype(int) - expected)
+    if channels == 4 and hole:
+        # The integer blend rounds the frame's weight, which only shows on
+        # nearly transparent pixels
+        assert difference.max() <= 4
+        assert (difference > 1).mean() < 0.01
+    else:
+        assert difference.max() <= 1
+
+
+def test_opaque_source_over_a_see_through_screen_is_copied():
+    rng = np.random.default_rng(2)
+    compositor = Compositor(device_frame(rng, hole=True), SCREEN_SIZE, RADIUS, batch_size=1)
+    screens = rng.integers(0, 256, (1,) + SCREEN_SIZE[::-1] + (3,), dtype=np.uint8)
+
+    screen = compositor.composite_batch(screens)[0][compositor._screen]
+    inside = corner_mask(SCREEN_SIZE, RADIUS) == 255
+    assert np.array_equal(screen[..., :3][inside], screens[0][inside])
+    assert (screen[..., 3][inside] == 255).all()
+
+
+def test_see_through_screens_blend_without_per_batch_allocations():
+    rng = np.random.default_rng(3)
+    compositor = Compositor(device_frame(rng, hole=True), SCREEN_SIZE, RADIUS, batch_size=2, ring_size=2)
+    batches = [rng.integers(0, 256, (2,) + SCREEN_SIZE[::-1] + (channels,), dtype=np.uint8)
+               for channels in (3, 4)]
+    for screens in batches:
+        compositor.composite_batch(screens)
+
+    outputs = []
+    tracemalloc.start()
+    try:
+        for screens in batches:
+            outputs.append(compositor.composite_batch(screens))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # Nothing larger than one channel of the batch is allocated
+    assert peak <= 2 * SCREEN_SIZE[0] * SCREEN_SIZE[1] * 2 + 4096
+    # Consecutive batches land in different ring buffers
+    assert not np.shares_memory(outputs[0], outputs[1])
+
+
+def test_rejects_mismatched_batches():
+    compositor = Compositor(device_frame(np.random.default_rng(4), False), SCREEN_SIZE, RADIUS, batch_size=1)
+    with pytest.raises(ValueError):
+        compositor.composite_batch(np.zeros((2,) + SCREEN_SIZE[::-1] + (3,), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        compositor.composite_batch(np.zeros((1, 10, 10, 3), dtype=np.uint8))
+
+
+def test_only_the_screen_area_is_rewritten(device_frame):
+    from processors.frame_asset import FrameAsset
+
+    asset = FrameAsset.load(device_frame, use_index=False)
+    compositor = Compositor.from_asset(asset, batch_size=1)
+    out = compositor.composite_batch(np.full((1,) + asset.screen_size[::-1] + (3,), 200, dtype=np.uint8))[0]
+    outside = np.ones(out.shape[:2], dtype=bool)
+    outside[compositor._screen] = False
+    assert np.array_equal(out[outside], compositor.background[outside])
+    x, y, width, height = asset.screen_rect
+    assert tuple(out[y + height // 2, x + width // 2]) == (200, 200, 200, 255)
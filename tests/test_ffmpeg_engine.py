@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from conftest import read_frames, render
+from processors import ffmpeg_engine
+from processors.frame_asset import FrameAsset
+from processors.gif_processor import GifProcessor
+from processors.pipeline import StreamingPipeline
+
+
+def over(top, bottom):
+    """Straight-alpha "over" of two float RGBA images in 0..1"""
+    alpha = top[..., 3:] + bottom[..., 3:] * (1 - top[..., 3:])
+    rgb = top[..., :3] * top[..., 3:] + bottom[..., :3] * bottom[..., 3:] * (1 - top[..., 3:])
+    return np.concatenate([np.divide(rgb, alpha, out=np.zeros_like(rgb), where=alpha > 0), alpha], axis=-1)
+
+
+@pytest.fixture
+def pillow_only(monkeypatch):
+    """Fail the test if the Pillow pipeline renders"""
+    def refuse(self, *args, **kwargs):
+        raise AssertionError("rendered with Pillow")
+    monkeypatch.setattr(StreamingPipeline, 'run', refuse)
+
+
+def test_laying_the_frame_over_the_screen_matches_the_compositor(device_frame):
+    asset = FrameAsset.load(device_frame)
+    frame, screen_alpha = ffmpeg_engine.FilterGraphRenderer(asset).layers()
+    x, y, width, height = asset.screen_rect
+    screen = np.random.default_rng(0).random((height, width, 4))
+    screen[..., 3] = 1
+
+    original = np.array(asset.image, dtype=np.float64)[y:y + height, x:x + width] / 255
+    mask = ffmpeg_engine.corner_mask((width, height), asset.radius)[..., np.newaxis] / 255
+    expected = over(screen * [1, 1, 1, 0] + np.concatenate([np.zeros_like(mask)] * 3 + [mask], axis=-1),
+                    original)
+    placed = screen.copy()
+    placed[..., 3] = screen_alpha / 255
+    actual = over(frame[y:y + height, x:x + width] / 255, placed)
+    assert np.abs(actual - expected).max() < 2 / 255
+
+
+def test_ffmpeg_render_matches_pillow(tmp_path, gif_path, device_frame, pillow_only, monkeypatch):
+    render(gif_path, device_frame, str(tmp_path / 'ffmpeg.webp'), engine='ffmpeg')
+    monkeypatch.undo()
+    render(gif_path, device_frame, str(tmp_path / 'pillow.webp'), engine='pillow')
+
+    ffmpeg_frames = read_frames(tmp_path / 'ffmpeg.webp')
+    pillow_frames = read_frames(tmp_path / 'pillow.webp')
+    assert sum(duration for _, duration in ffmpeg_frames) == sum(duration for _, duration in pillow_frames)
+    difference = np.abs(ffmpeg_frames[0][0].astype(int) - pillow_frames[0][0].astype(int))
+    assert difference.mean() < 8
+
+
+def test_ffmpeg_gif_keeps_frame_count_and_timing(tmp_path, gif_path, device_frame, pillow_only):
+    render(gif_path, device_frame, str(tmp_path / 'out.gif'), engine='ffmpeg')
+    frames = read_frames(tmp_path / 'out.gif')
+    assert [duration for _, duration in frames] == [duration for _, duration in read_frames(gif_path)]
+    assert frames[0][0].shape == (200, 120, 4)
+
+
+def test_ffmpeg_failure_falls_back_to_pillow(tmp_path, gif_path, device_frame, monkeypatch):
+    def fail(self, *args, **kwargs):
+        raise RuntimeError("ffmpeg could not render the output: broken\nmore")
+    monkeypatch.setattr(ffmpeg_engine.FilterGraphRenderer, 'render', fail)
+    processor = render(gif_path, device_frame, str(tmp_path / 'out.gif'), engine='ffmpeg')
+    assert processor.engine == 'ffmpeg'
+    assert len(read_frames(tmp_path / 'out.gif')) == len(read_frames(gif_path))
+
+
+def test_budgets_switch_to_pillow(tmp_path, gif_path, device_frame):
+    processor = render(gif_path, device_frame, str(tmp_path / 'out.gif'), engine='ffmpeg', max_bytes=10 ** 7)
+    assert processor.engine == 'pillow'
+
+
+def test_unknown_engine_is_rejected(tmp_path, gif_path, device_frame):
+    with pytest.raises(ValueError):
+        GifProcessor(gif_path, device_frame, str(tmp_path / 'out.gif'), None, engine='opencv')
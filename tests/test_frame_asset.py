@@ -0,0 +1,51 @@
+import json
+import os
+
+import pytest
+from PIL import Image
+
+from conftest import draw_device_frame
+from processors.frame_asset import DEFAULT_SCREEN_SIZE, FrameAsset
+
+
+@pytest.mark.parametrize('hole', [True, False])
+def test_detects_the_screen_and_its_corner_radius(tmp_path, hole):
+    path = draw_device_frame(tmp_path / 'frame.png', size=(160, 300), screen=(130, 260), radius=20, hole=hole)
+    asset = FrameAsset.load(path, use_index=False)
+    assert asset.screen_rect == (15, 20, 130, 260)
+    assert abs(asset.radius - 20) <= 2
+
+
+def test_falls_back_to_the_bundled_layout_without_a_screen(tmp_path):
+    path = str(tmp_path / 'plain.png')
+    image = Image.new('RGBA', (3000, 6000), (10, 10, 10, 255))
+    image.paste((200, 0, 0, 255), (1400, 2900, 1600, 3100))
+    image.save(path)
+    asset = FrameAsset.load(path, use_index=False)
+    assert asset.screen_size == DEFAULT_SCREEN_SIZE
+    assert asset.screen_position == ((3000 - DEFAULT_SCREEN_SIZE[0]) // 2, (6000 - DEFAULT_SCREEN_SIZE[1]) // 2)
+
+
+def test_detection_is_stored_in_the_index(tmp_path, cache_dir, monkeypatch):
+    path = draw_device_frame(tmp_path / 'frame.png')
+    first = FrameAsset.load(path)
+    assert os.path.exists(cache_dir / FrameAsset.INDEX_FILE)
+
+    def detect(image):
+        raise AssertionError("the indexed frame was analysed again")
+
+    monkeypatch.setattr(FrameAsset, 'detect_screen', staticmethod(detect))
+    second = FrameAsset.load(path)
+    assert (second.screen_rect, second.radius) == (first.screen_rect, first.radius)
+    with open(cache_dir / FrameAsset.INDEX_FILE) as f:
+        assert len(json.load(f)) == 1
+
+
+def test_scaled_screen_stays_inside_the_scaled_hole(device_frame):
+    asset = FrameAsset.load(device_frame, use_index=False).scaled(0.5)
+    x, y, width, height = asset.screen_rect
+    alpha = asset.image.getchannel('A')
+    assert asset.size == (60, 100)
+    # The middle and the edges of the scaled screen are still see-through
+    for point in ((x + width // 2, y + height // 2), (x + 1, y + height // 2), (x + width - 2, y + height // 2)):
+        assert alpha.getpixel(point) < 128
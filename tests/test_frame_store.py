@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import draw_device_frame, draw_gif, read_frames, render
+from processors.frame_source import SourceFrame
+from processors.frame_store import FrameStore
+
+
+def test_frames_beyond_the_budget_spill_to_a_mapped_file(tmp_path):
+    store = FrameStore((4, 4, 3), budget=2 * 48, scratch_dir=str(tmp_path))
+    for index in range(5):
+        store.append(SourceFrame(np.full((4, 4, 3), index, np.uint8), 10 + index))
+    assert len(store) == 5
+    assert store.spilled == 3
+    assert [int(frame.image[0, 0, 0]) for frame in store] == [0, 1, 2, 3, 4]
+    assert store.durations == [10, 11, 12, 13, 14]
+    assert not store[-1].image.flags.writeable
+    with pytest.raises(ValueError):
+        store.append(SourceFrame(np.zeros((2, 2, 3), np.uint8), 10))
+    store.close()
+    assert os.listdir(tmp_path) == []
+
+
+def anonymous_memory():
+    """Resident anonymous memory of this process in bytes, leaving out mapped files"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/status'), reason="needs Linux /proc")
+def test_list_based_render_encodes_frames_as_they_are_composited(tmp_path):
+    count, screen = 60, (360, 760)
+    gif = draw_gif(tmp_path / 'long.gif', frames=count, size=screen)
+    frame = draw_device_frame(tmp_path / 'frame.png', size=(400, 800), screen=screen, radius=30)
+
+    # Sampled on every progress update of the compositing half of the render
+    samples = []
+
+    def sample(progress):
+        if progress > 50:
+            samples.append(anonymous_memory())
+
+    from processors.gif_processor import GifProcessor
+    from utils.signals import CallbackSignals
+    signals = CallbackSignals()
+    signals.progress.connect(sample)
+    errors = []
+    signals.error.connect(errors.append)
+    GifProcessor(gif, frame, str(tmp_path / 'out.gif'), signals, streaming=False, cache=False,
+                 frame_budget=4 * 1024 ** 2).run()
+    assert not errors
+
+    assert len(read_frames(tmp_path / 'out.gif')) == count
+    # Nothing that grows with the number of frames is kept while encoding
+    frame_bytes = 400 * 800 * 4
+    assert max(samples) - samples[0] < 10 * frame_bytes
+
+
+def test_list_based_render_writes_every_format(tmp_path, gif_path, device_frame):
+    processor = render(gif_path, device_frame, str(tmp_path / 'out.gif'), streaming=False,
+                       extra_outputs=[str(tmp_path / 'copy.gif'), str(tmp_path / 'out.webp')])
+    assert len(read_frames(processor.output_path)) == 6
+    assert len(read_frames(tmp_path / 'copy.gif')) == 6
+    assert len(read_frames(tmp_path / 'out.webp')) == 6
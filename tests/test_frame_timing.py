@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import draw_gif, read_frames, render
+from processors.frame_source import SourceFrame, collapse_duplicates, gif_durations
+from processors.gif_writer import StreamingGifWriter
+
+
+def solid(value):
+    return Image.new('RGB', (4, 4), (value, value, value))
+
+
+def test_collapse_duplicates_adds_up_durations_and_counts():
+    frames = [SourceFrame(solid(v), d) for v, d in [(1, 50), (1, 30), (2, 40), (3, 10), (3, 10), (3, 20)]]
+    collapsed = list(collapse_duplicates(iter(frames)))
+    assert [(f.duration, f.count) for f in collapsed] == [(80, 2), (40, 1), (40, 3)]
+    assert [f.image.getpixel((0, 0))[0] for f in collapsed] == [1, 2, 3]
+
+
+def test_collapse_duplicates_compares_arrays_by_content():
+    frames = [SourceFrame(np.zeros((2, 2, 3), np.uint8), 10), SourceFrame(np.zeros((2, 2, 3), np.uint8), 10),
+              SourceFrame(np.zeros((2, 3, 3), np.uint8), 10)]
+    assert [f.count for f in collapse_duplicates(frames)] == [2, 1]
+
+
+def test_gif_writer_rounds_against_the_running_total(tmp_path):
+    path = str(tmp_path / 'out.gif')
+    with StreamingGifWriter(path, delta=False) as writer:
+        for value in range(30):
+            writer.add_frame(np.full((4, 4, 3), value * 8, np.uint8), 1000 / 30)
+    durations = [duration for _, duration in read_frames(path)]
+    assert set(durations) <= {30, 40}
+    assert sum(durations) == 1000
+
+
+@pytest.mark.parametrize('streaming', [True, False])
+def test_renders_keep_the_source_frame_timing(tmp_path, device_frame, streaming):
+    gif = draw_gif(tmp_path / 'in.gif', frames=4, durations=[30, 150, 70, 250])
+    assert gif_durations(gif) == [30, 150, 70, 250]
+
+    output = render(gif, device_frame, str(tmp_path / 'out.gif'), streaming=streaming).output_path
+    assert [duration for _, duration in read_frames(output)] == [30, 150, 70, 250]
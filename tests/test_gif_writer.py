@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import read_frames
+from processors.gif_writer import StreamingGifWriter
+from processors.palette import GlobalPalette
+
+SIZE = (60, 40)
+RED = (255, 0, 0, 255)
+
+
+def moving_square(count=6):
+    """A red square sliding over a transparent screen inside an opaque bezel"""
+    frames = []
+    for index in range(count):
+        pixels = np.zeros(SIZE[::-1] + (4,), dtype=np.uint8)
+        pixels[...] = (40, 40, 40, 255)
+        pixels[5:35, 5:55] = 0
+        pixels[10:20, 6 + 8 * index:16 + 8 * index] = RED
+        frames.append(pixels)
+    return frames
+
+
+def write(path, frames, **settings):
+    with StreamingGifWriter(str(path), **settings) as writer:
+        for frame in frames:
+            writer.add_frame(frame, 100)
+    return writer
+
+
+def palette_for(frames):
+    return GlobalPalette.build(frames[:1], colors=16)
+
+
+@pytest.mark.parametrize('delta', [True, False])
+@pytest.mark.parametrize('global_palette', [True, False])
+def test_transparent_pixels_round_trip(tmp_path, delta, global_palette):
+    frames = moving_square()
+    palette = palette_for(frames) if global_palette else None
+    write(tmp_path / 'out.gif', frames, delta=delta, palette=palette)
+
+    decoded = read_frames(tmp_path / 'out.gif')
+    assert len(decoded) == len(frames)
+    for (pixels, _), frame in zip(decoded, frames):
+        # The square leaves no trail where the screen is see-through again
+        assert np.array_equal(pixels[..., 3] >= 128, frame[..., 3] >= 128)
+        red = (pixels[..., 0] > 200) & (pixels[..., 1] < 50) & (pixels[..., 3] >= 128)
+        assert red.sum() == 100
+
+
+def test_opaque_frames_stay_deltas(tmp_path):
+    frames = moving_square()
+    for frame in frames:
+        frame[5:35, 5:55, 3] = 255
+    opaque = write(tmp_path / 'opaque.gif', frames, palette=palette_for(frames))
+    with Image.open(tmp_path / 'opaque.gif') as image:
+        image.seek(1)
+        # Later frames only carry the changed box, drawn over the previous frame
+        assert image.tile[0][1][2] - image.tile[0][1][0] < SIZE[0]
+        assert image.disposal_method == 1
+    assert opaque.frame_count == len(frames)
+
+    decoded = read_frames(tmp_path / 'opaque.gif')
+    for (pixels, _), frame in zip(decoded, frames):
+        assert (pixels[..., 3] == 255).all()
+        assert np.array_equal(pixels[10:20, ..., 0] > 200, frame[10:20, ..., 0] > 200)
+
+
+def test_identical_frames_are_merged(tmp_path):
+    frames = moving_square(3)
+    writer = write(tmp_path / 'out.gif', [frames[0], frames[0], frames[1], frames[2], frames[2]])
+    assert writer.frame_count == 3
+    assert [duration for _, duration in read_frames(tmp_path / 'out.gif')] == [200, 100, 200]
@@ -0,0 +1,22 @@
+import pytest
+
+from benchmarks.import_time import CASES, measure, parse_importtime
+
+
+@pytest.mark.parametrize('module', sorted(CASES))
+def test_entry_points_leave_heavy_dependencies_unloaded(module):
+    if module.startswith('ui.'):
+        pytest.importorskip('PyQt5.QtWidgets')
+    _, _, _, loaded = measure(module)
+    assert sorted(set(CASES[module]) & set(loaded)) == []
+
+
+def test_parse_importtime_reads_the_module_and_its_direct_imports():
+    output = '\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:       120 |        120 |     _json',
+        'import time:       300 |        420 |   json',
+        'import time:        50 |         50 |   os',
+        'import time:        30 |        500 | server',
+    ])
+    assert parse_importtime(output, 'server') == (500, [('json', 420), ('os', 50)])
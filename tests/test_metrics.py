@@ -0,0 +1,59 @@
+import json
+import pstats
+import time
+
+from conftest import render
+from utils.metrics import DISABLED, PerfRecorder
+
+
+def test_stages_add_up_wall_and_cpu_time():
+    metrics = PerfRecorder()
+    metrics.start()
+    for _ in range(3):
+        with metrics.stage('encode', 2):
+            time.sleep(0.01)
+    metrics.add('resize', 0.5, 0.25, 4)
+    report = metrics.report(job='test')
+
+    assert report['job'] == 'test'
+    assert report['stages']['encode']['calls'] == 3
+    assert report['stages']['encode']['frames'] == 6
+    assert report['stages']['encode']['wall'] >= 0.03
+    assert report['stages']['resize']['wall_per_frame_ms'] == 125
+    assert report['elapsed'] >= 0.03
+
+
+def test_latency_pairs_started_and_finished_frames():
+    metrics = PerfRecorder()
+    for _ in range(4):
+        metrics.frame_started()
+    for _ in range(4):
+        metrics.frame_finished()
+    metrics.frame_finished()
+    latency = metrics.report()['frame_latency_ms']
+    assert latency['count'] == 4
+    assert latency['max'] >= latency['p50'] >= 0
+
+
+def test_disabled_recorder_records_nothing():
+    with DISABLED.stage('encode', 1):
+        pass
+    assert list(DISABLED.timed_iter('decode', [1, 2])) == [1, 2]
+    DISABLED.frame_started()
+    assert DISABLED.stages == {} and not DISABLED.latencies
+
+
+def test_render_writes_a_trace_and_a_profile(tmp_path, gif_path, device_frame):
+    trace_path, profile_path = tmp_path / 'trace.json', tmp_path / 'run.prof'
+    render(gif_path, device_frame, str(tmp_path / 'out.gif'), trace_path=str(trace_path),
+           profile_path=str(profile_path), trace_memory=True)
+
+    with open(trace_path) as f:
+        trace = json.load(f)
+    assert trace['status'] == 'ok'
+    assert trace['settings']['fps'] == 10
+    for stage in ('decode', 'resize', 'composite', 'quantize', 'encode'):
+        assert trace['stages'][stage]['calls'] > 0, stage
+    assert trace['frame_latency_ms']['count'] == 6
+    assert trace['memory']['traced_peak'] > 0
+    assert pstats.Stats(str(profile_path)).total_calls > 0
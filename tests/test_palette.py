@@ -0,0 +1,70 @@
+import numpy as np
+from PIL import Image
+
+from processors.palette import GlobalPalette
+
+
+def random_frame(seed, size=(64, 48)):
+    pixels = np.random.default_rng(seed).integers(0, 256, size[::-1] + (4,), dtype=np.uint8)
+    pixels[..., 3] = 255
+    return pixels
+
+
+def test_lookup_picks_a_nearby_palette_color():
+    palette = GlobalPalette.build([random_frame(0)], colors=64)
+    frame = random_frame(1)
+    indices = palette.map_array(frame)
+    assert indices.max() < palette.transparent_index
+
+    chosen = palette.colors[indices].astype(int)
+    distances = ((frame[..., np.newaxis, :3].astype(int) - palette.colors[:-1].astype(int)) ** 2).sum(axis=-1)
+    nearest = np.sqrt(distances.min(axis=-1))
+    # The lookup table works on 6-bit cells, so it may miss the nearest color by about a cell
+    error = np.sqrt(((chosen - frame[..., :3]) ** 2).sum(axis=-1))
+    assert (error - nearest).max() <= 4 * np.sqrt(3)
+
+
+def test_rgb_and_rgba_pixels_map_the_same():
+    palette = GlobalPalette.build([random_frame(2)], colors=32)
+    frame = random_frame(3)
+    assert np.array_equal(palette.map_array(frame), palette.map_array(frame[..., :3].copy()))
+
+
+def test_transparent_pixels_get_the_transparent_index():
+    palette = GlobalPalette.build([random_frame(4)], colors=16)
+    frame = random_frame(5)
+    frame[:10, :, 3] = 0
+    indices = palette.map_array(frame)
+    assert (indices[:10] == palette.transparent_index).all()
+    assert (indices[10:] != palette.transparent_index).all()
+
+
+def test_map_frame_looks_up_only_the_screen_of_a_strided_frame():
+    static = random_frame(6, size=(80, 60))
+    screen_rect = (10, 8, 50, 40)
+    palette = GlobalPalette.build([random_frame(7)], static_image=Image.fromarray(static, 'RGBA'),
+                                  screen_rect=screen_rect, colors=64)
+    frame = static.copy()
+    x, y, width, height = screen_rect
+    frame[y:y + height, x:x + width] = random_frame(8, size=(width, height))
+
+    # A view into a wider buffer, so neither the frame nor its screen is contiguous
+    wide = np.zeros((60, 100, 4), dtype=np.uint8)
+    wide[:, :80] = frame
+    strided = wide[:, :80]
+    assert not strided.flags.c_contiguous
+
+    indices = palette.map_frame(strided)
+    assert np.array_equal(indices, palette.map_array(frame))
+    assert np.array_equal(indices[:y], palette.static_indices[:y])
+
+
+def test_lookup_reads_slices_without_copying(monkeypatch):
+    palette = GlobalPalette.build([random_frame(9)], colors=64)
+    wide = random_frame(10, size=(100, 60))
+    expected = palette.map_array(wide[:, 10:70].copy())
+
+    def refuse(*args, **kwargs):
+        raise AssertionError("copied the frame")
+    monkeypatch.setattr(np, 'ascontiguousarray', refuse)
+    assert np.array_equal(palette.map_array(wide[:, 10:70]), expected)
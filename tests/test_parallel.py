@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import read_frames, render
+from processors.compositor import Compositor
+from processors.frame_asset import FrameAsset
+from processors.frame_source import SourceFrame
+from processors.parallel import ParallelFramer, SharedFrames
+
+
+def source_frames(count, size=(48, 80)):
+    rng = np.random.default_rng(5)
+    return [SourceFrame(Image.fromarray(rng.integers(0, 256, size[::-1] + (3,), dtype=np.uint8)), 40 + i, 1)
+            for i in range(count)]
+
+
+def test_matches_the_single_process_compositor_in_input_order(device_frame):
+    asset = FrameAsset.load(device_frame, use_index=False)
+    frames = source_frames(7)
+    received = []
+    ParallelFramer(device_frame, asset=asset, workers=2, slots_per_worker=1).run(
+        frames, lambda pixels, frame: received.append((pixels.copy(), frame))
+    )
+
+    compositor = Compositor.from_asset(asset, batch_size=1)
+    assert [frame.duration for _, frame in received] == [frame.duration for frame in frames]
+    for (pixels, frame), source in zip(received, frames):
+        assert frame.image is None
+        resized = source.image.resize(asset.screen_size, Image.Resampling.LANCZOS)
+        assert np.array_equal(pixels, compositor.composite_batch(np.asarray(resized)[np.newaxis])[0])
+
+
+def test_rejects_frames_of_another_size(device_frame):
+    frames = source_frames(2) + source_frames(1, size=(40, 40))
+    with pytest.raises(ValueError):
+        ParallelFramer(device_frame, workers=1).run(frames, lambda pixels, frame: None)
+
+
+def test_shared_frames_are_released_on_close():
+    frames = SharedFrames(2, (4, 4, 3))
+    name = frames.name
+    attached = SharedFrames(2, (4, 4, 3), name=name)
+    attached.array[1] = 7
+    assert (frames.array[1] == 7).all()
+    attached.close()
+    frames.close()
+    with pytest.raises(FileNotFoundError):
+        SharedFrames(2, (4, 4, 3), name=name)
+
+
+def test_worker_processes_render_the_same_gif(tmp_path, gif_path, device_frame):
+    serial = render(gif_path, device_frame, str(tmp_path / 'serial.gif'), workers=1).output_path
+    parallel = render(gif_path, device_frame, str(tmp_path / 'parallel.gif'), workers=2).output_path
+    serial_frames, parallel_frames = read_frames(serial), read_frames(parallel)
+    assert len(parallel_frames) == len(serial_frames) == 6
+    for (expected, expected_duration), (pixels, duration) in zip(serial_frames, parallel_frames):
+        assert duration == expected_duration
+        assert np.array_equal(pixels, expected)
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from processors.pipeline import PipelineCancelled, StreamingPipeline, batched
+
+
+def test_runs_every_item_through_the_stages_in_order():
+    received = []
+    pipeline = StreamingPipeline(range(50), [lambda x: x + 1, lambda x: x * 2], received.append, queue_size=1)
+    pipeline.run()
+    assert received == [(x + 1) * 2 for x in range(50)]
+
+
+def test_reraises_the_first_stage_error():
+    def stage(item):
+        if item == 3:
+            raise ValueError("bad frame")
+        return item
+
+    received = []
+    with pytest.raises(ValueError, match="bad frame"):
+        StreamingPipeline(range(10), [stage], received.append).run()
+    assert 3 not in received
+
+
+def test_reraises_source_and_sink_errors():
+    def source():
+        yield 1
+        raise OSError("read failed")
+
+    with pytest.raises(OSError, match="read failed"):
+        StreamingPipeline(source(), [], lambda item: None).run()
+
+    def sink(item):
+        raise RuntimeError("disk full")
+
+    with pytest.raises(RuntimeError, match="disk full"):
+        StreamingPipeline(range(5), [], sink).run()
+
+
+def test_cancel_raises_instead_of_returning_a_truncated_stream():
+    received = []
+    pipeline = None
+
+    def sink(item):
+        received.append(item)
+        if item == 2:
+            pipeline.cancel()
+
+    # An endless source: only cancelling can end this run
+    def source():
+        count = 0
+        while True:
+            yield count
+            count += 1
+
+    pipeline = StreamingPipeline(source(), [lambda x: x], sink)
+    with pytest.raises(PipelineCancelled):
+        pipeline.run()
+    assert received[:3] == [0, 1, 2]
+
+
+def test_cancel_from_another_thread():
+    received = []
+
+    def source():
+        count = 0
+        while True:
+            time.sleep(0.01)
+            yield count
+            count += 1
+
+    pipeline = StreamingPipeline(source(), [], received.append)
+    threading.Timer(0.2, pipeline.cancel).start()
+    with pytest.raises(PipelineCancelled):
+        pipeline.run()
+    assert received
+
+
+def test_cancel_after_the_stream_ended_keeps_the_run_successful():
+    pipeline = StreamingPipeline(range(3), [], lambda item: None)
+    pipeline.run()
+    pipeline.cancel()
+
+
+def test_batched_keeps_the_remainder():
+    assert list(batched(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(batched([], 3)) == []
@@ -0,0 +1,36 @@
+import numpy as np
+
+from conftest import render
+from processors.preview import PREVIEW_FRAMES, preview_image, render_preview
+
+
+def test_quick_preview_of_a_gif(gif_path, device_frame):
+    images = render_preview(gif_path, device_frame, width=60)
+    assert len(images) == PREVIEW_FRAMES
+    assert all(image.size == (60, 100) for image in images)
+
+
+def test_quick_preview_of_a_video_range(video_path, device_frame):
+    images = render_preview(video_path, device_frame, count=3, width=60, start=0.5, end=1.5)
+    assert len(images) == 3
+    # Sampled frames of a moving test pattern differ from each other
+    assert not np.array_equal(np.asarray(images[0]), np.asarray(images[-1]))
+
+
+def test_preview_image_is_a_copy_at_preview_width():
+    frame = np.zeros((100, 60, 4), np.uint8)
+    small = preview_image(frame, width=60)
+    frame[:] = 255
+    assert small.size == (60, 100)
+    assert np.asarray(small).max() == 0
+    assert preview_image(np.zeros((2000, 1200, 4), np.uint8), width=240).size == (240, 400)
+
+
+def test_renders_emit_progressive_previews(tmp_path, gif_path, device_frame, monkeypatch):
+    monkeypatch.setattr('processors.gif_processor.PREVIEW_INTERVAL', 0)
+    processor = render(gif_path, device_frame, str(tmp_path / 'out.gif'), preview_width=30, streaming=True)
+    previews = []
+    processor.signals.preview.connect(previews.append)
+    processor.run()
+    assert previews
+    assert all(image.width == 30 for batch in previews for image in batch)
@@ -0,0 +1,84 @@
+import os
+import time
+
+import numpy as np
+
+from conftest import draw_device_frame, render
+from processors.frame_source import SourceFrame
+from processors.gif_processor import GifProcessor
+from processors.render_cache import RenderCache
+
+
+def test_keys_follow_file_contents_and_settings(tmp_path):
+    cache = RenderCache()
+    path = tmp_path / 'input.bin'
+    path.write_bytes(b'one')
+    key = cache.key('output', str(path), fps=10)
+    assert cache.key('output', str(path), fps=10) == key
+    assert cache.key('output', str(path), fps=12) != key
+    assert cache.key('palette', str(path), fps=10) != key
+    path.write_bytes(b'two')
+    os.utime(path, (time.time() + 5, time.time() + 5))
+    assert cache.key('output', str(path), fps=10) != key
+
+
+def test_least_recently_used_entries_are_evicted_first(tmp_path):
+    cache = RenderCache(max_bytes=2500)
+    for index, name in enumerate('abc'):
+        source = tmp_path / name
+        source.write_bytes(b'x' * 1000)
+        cache.store_file(name, '.gif', str(source))
+        os.utime(cache.path(name, '.gif'), (1000 + index, 1000 + index))
+    # Storing c trimmed the cache to two entries; a is the oldest
+    assert [entry['key'] for entry in cache.entries()] == ['b', 'c']
+    assert cache.fetch_file('b', '.gif', str(tmp_path / 'copy'))
+    cache.store_file('d', '.gif', str(tmp_path / 'a'))
+    assert [entry['key'] for entry in cache.entries()] == ['b', 'd']
+
+
+def test_frame_recordings_round_trip_and_are_capped(tmp_path):
+    cache = RenderCache(max_frame_bytes=10 * 48)
+    recorder = cache.frame_recorder('frames')
+    for index in range(3):
+        recorder.add(np.full((4, 4, 3), index, np.uint8), SourceFrame(None, 50 + index, 1 + index))
+    recorder.commit()
+    frames, count = cache.load_frames('frames')
+    frames = list(frames)
+    assert count == 6
+    assert [(int(frame.image[0, 0, 0]), frame.duration) for frame in frames] == [(0, 50), (1, 51), (2, 52)]
+
+    too_long = cache.frame_recorder('long')
+    for index in range(11):
+        too_long.add(np.zeros((4, 4, 3), np.uint8), SourceFrame(None, 50, 1))
+    too_long.commit()
+    assert cache.load_frames('long') is None
+    assert not any(name.startswith('.') for name in os.listdir(cache.root))
+
+
+def test_outputs_are_reused_but_raw_frames_are_not_cached_by_default(tmp_path, gif_path, device_frame,
+                                                                     monkeypatch):
+    cache = RenderCache()
+    first = render(gif_path, device_frame, str(tmp_path / 'first.gif'), cache=cache)
+    assert not any(name.endswith('.frames') for name in os.listdir(cache.root))
+
+    def no_render(self):
+        raise AssertionError("a cached output was rendered again")
+
+    monkeypatch.setattr(GifProcessor, 'process_pillow', no_render)
+    render(gif_path, device_frame, str(tmp_path / 'second.gif'), cache=cache)
+    with open(first.output_path, 'rb') as a, open(tmp_path / 'second.gif', 'rb') as b:
+        assert a.read() == b.read()
+
+
+def test_cached_frames_skip_decoding_for_another_frame_of_the_same_size(tmp_path, gif_path, monkeypatch):
+    cache = RenderCache()
+    first_frame = draw_device_frame(tmp_path / 'dark.png', color=(20, 20, 20))
+    second_frame = draw_device_frame(tmp_path / 'light.png', color=(220, 220, 220))
+    render(gif_path, first_frame, str(tmp_path / 'first.gif'), cache=cache, cache_frames=True)
+    assert any(name.endswith('.frames') for name in os.listdir(cache.root))
+
+    def no_decode(*args, **kwargs):
+        raise AssertionError("the input was decoded again")
+
+    monkeypatch.setattr(GifProcessor, 'iter_gif_frames', staticmethod(no_decode))
+    render(gif_path, second_frame, str(tmp_path / 'second.gif'), cache=cache, cache_frames=True)
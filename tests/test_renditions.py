@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from conftest import draw_gif, read_frames, render
+from processors.encoders import FfmpegEncoder, frame_rate_for, output_format
+from processors.gif_processor import GifProcessor
+from processors.video_reader import VideoFrameReader, probe_video
+
+
+def test_formats_follow_the_extension():
+    assert [output_format(path) for path in ('a.GIF', 'b.webp', 'c.png', 'd.apng', 'e.mp4')] == \
+        ['gif', 'webp', 'apng', 'apng', 'mp4']
+    with pytest.raises(ValueError):
+        output_format('clip.avi')
+
+
+def test_frame_rate_fits_every_duration():
+    assert frame_rate_for([100, 200, 300]) == 10
+    assert frame_rate_for([40, 80]) == 25
+    assert frame_rate_for([33, 34]) == 50
+    assert frame_rate_for([]) == 10
+
+
+def test_ffmpeg_encoder_repeats_frames_for_their_duration(tmp_path):
+    path = str(tmp_path / 'out.mp4')
+    with FfmpegEncoder(path, (32, 24), frame_rate=10) as encoder:
+        for value, duration in ((0, 100), (128, 300), (255, 100)):
+            frame = np.full((24, 32, 4), value, np.uint8)
+            frame[..., 3] = 255
+            encoder.add_frame(frame, duration)
+    frames = [frame.copy() for _, frame, _ in VideoFrameReader(path)]
+    assert len(frames) == 5
+    assert [int(frame.mean() // 32) for frame in frames] == [0, 4, 4, 4, 7]
+
+
+def test_every_format_comes_from_one_decode(tmp_path, device_frame, monkeypatch):
+    gif = draw_gif(tmp_path / 'in.gif', frames=4, durations=[100, 200, 100, 100])
+    decodes = []
+    original = GifProcessor.iter_gif_frames
+
+    def counted(path):
+        decodes.append(path)
+        return original(path)
+
+    monkeypatch.setattr(GifProcessor, 'iter_gif_frames', staticmethod(counted))
+    outputs = [str(tmp_path / name) for name in ('out.webp', 'out.png', 'out.mp4')]
+    render(gif, device_frame, str(tmp_path / 'out.gif'), extra_outputs=outputs)
+    assert len(decodes) == 1
+
+    assert len(read_frames(tmp_path / 'out.gif')) == 4
+    webp = read_frames(tmp_path / 'out.webp')
+    assert [duration for _, duration in webp] == [100, 200, 100, 100]
+    # APNG keeps the repeats of the longer frame at the shared rate
+    assert len(read_frames(tmp_path / 'out.png')) == 5
+    meta = probe_video(str(tmp_path / 'out.mp4'))
+    assert tuple(meta['size']) == (120, 200)
+    assert abs(meta['duration'] - 0.5) < 0.05
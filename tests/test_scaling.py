@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from conftest import draw_device_frame, read_frames, render
+from processors.frame_asset import FrameAsset
+
+
+@pytest.mark.parametrize('streaming', [True, False])
+def test_scale_shrinks_the_frame_and_the_screen_together(tmp_path, gif_path, streaming):
+    frame = draw_device_frame(tmp_path / 'frame.png', size=(160, 300), screen=(130, 260), radius=20)
+    output = render(gif_path, frame, str(tmp_path / 'out.gif'), scale=0.5, streaming=streaming).output_path
+    pixels = read_frames(output)[0][0]
+    assert pixels.shape[:2] == (150, 80)
+
+    asset = FrameAsset.load(frame).scaled(0.5)
+    x, y, width, height = asset.screen_rect
+    screen = pixels[y:y + height, x:x + width]
+    # The content fills the scaled screen: no bezel inside it, and the
+    # bezel is untouched outside it
+    assert (screen[height // 2, 2:-2, 3] == 255).all()
+    assert screen[height // 2, 2:-2, :3].std() > 20
+    assert np.abs(pixels[2, 2, :3].astype(int) - 30).max() <= 8
+
+
+def test_max_width_caps_the_output_width(tmp_path, gif_path):
+    frame = draw_device_frame(tmp_path / 'frame.png', size=(160, 300), screen=(130, 260), radius=20)
+    output = render(gif_path, frame, str(tmp_path / 'out.gif'), max_width=40).output_path
+    assert read_frames(output)[0][0].shape[:2] == (75, 40)
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from conftest import encode_video
+from processors.video_reader import SegmentedVideoReader, VideoFrameReader, keyframe_times
+
+
+@pytest.fixture(scope='module')
+def long_video(tmp_path_factory):
+    """Seven seconds at 24 fps with a keyframe every 40 frames, off the even cuts"""
+    return encode_video(tmp_path_factory.mktemp('segments') / 'long.mp4', seconds=7, gop=40)
+
+
+@pytest.fixture(scope='module')
+def ntsc_video(tmp_path_factory):
+    """Seven seconds at 29.97 fps, whose frame times fall between those of any sampling rate"""
+    return encode_video(tmp_path_factory.mktemp('segments') / 'ntsc.mp4', seconds=7, rate='30000/1001', gop=45)
+
+
+def frames_of(reader):
+    return [(index, frame.copy(), duration) for index, frame, duration in reader]
+
+
+def assert_same_frames(frames, expected):
+    assert [(index, duration) for index, _, duration in frames] == \
+        [(index, duration) for index, _, duration in expected]
+    assert all(np.array_equal(frame, other) for (_, frame, _), (_, other, _) in zip(frames, expected))
+
+
+@pytest.mark.parametrize('settings', [{}, {'fps': 10}, {'fps': 10, 'start': 0.75, 'end': 6.2},
+                                      {'start': 1.3, 'end': 5.5}, {'size': (32, 56)}])
+def test_segments_yield_the_frames_of_one_reader(long_video, settings):
+    segmented = SegmentedVideoReader(long_video, segments=3, **settings)
+    assert len(segmented.plan()) > 1
+    assert_same_frames(frames_of(segmented), frames_of(VideoFrameReader(long_video, **settings)))
+
+
+@pytest.mark.parametrize('settings', [{'fps': 24}, {'fps': 12, 'start': 1.3, 'end': 5.5}, {'fps': 24, 'start': 0.4}])
+def test_sampling_between_source_frames_matches_one_reader(ntsc_video, settings):
+    segmented = SegmentedVideoReader(ntsc_video, segments=3, **settings)
+    assert len(segmented.plan()) > 1
+    assert_same_frames(frames_of(segmented), frames_of(VideoFrameReader(ntsc_video, **settings)))
+
+
+def test_frames_spilled_to_disk_are_the_same(long_video):
+    frames = frames_of(SegmentedVideoReader(long_video, segments=3, budget=0))
+    assert_same_frames(frames, frames_of(VideoFrameReader(long_video)))
+
+
+def test_cuts_start_just_after_keyframes(long_video):
+    reader = SegmentedVideoReader(long_video, segments=3)
+    keyframes = keyframe_times(long_video)
+    assert keyframes[:3] == pytest.approx([0, 40 / 24, 80 / 24])
+    plan = reader.plan()
+    assert [limit for _, limit in plan[:-1]] == [first - previous for (previous, _), (first, _)
+                                                 in zip(plan, plan[1:])]
+    for first, _ in plan[1:]:
+        seek = reader._seek_time(first)
+        assert any(0 <= seek - keyframe < 1 / 24 for keyframe in keyframes)
+
+
+def test_sampled_cuts_seek_to_whole_ticks(long_video):
+    # 10 fps frames are 1228.8 ticks of the 1/12288 time base apart
+    reader = SegmentedVideoReader(long_video, fps=10, segments=3)
+    firsts = [first for first, _ in reader.plan()[1:]]
+    assert firsts and all(first % 5 == 0 for first in firsts)
+
+
+def test_short_videos_are_read_in_one_piece(video_path):
+    reader = SegmentedVideoReader(video_path, segments=4)
+    assert reader.plan() == [(0, None)]
+    assert len(frames_of(reader)) == 48
+
+
+def test_stopping_early_closes_every_segment(long_video):
+    reader = SegmentedVideoReader(long_video, segments=3)
+    frames = iter(reader)
+    next(frames)
+    readers = list(reader._readers)
+    assert len(readers) == 3
+    frames.close()
+    assert reader._readers == []
+    assert all(other._process is None or other._process.poll() is not None for other in readers)
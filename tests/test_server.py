@@ -0,0 +1,129 @@
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from server import JobServer, make_http_server
+
+
+@pytest.fixture
+def jobs(device_frame):
+    server = JobServer(device_frame, workers=1)
+    server.start()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def api(jobs):
+    """Send a request to the API on a free port and return the status and decoded body"""
+    httpd = make_http_server(jobs, port=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    def request(method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection('127.0.0.1', httpd.server_address[1], timeout=30)
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+            headers = {'Content-Type': 'application/json', **(headers or {})}
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        result = response.status, json.loads(response.read())
+        connection.close()
+        return result
+
+    yield request
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def wait_for(jobs, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = jobs.status(job_id)
+        if status['status'] in ('done', 'failed', 'cancelled'):
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish: {jobs.status(job_id)}")
+
+
+def test_submitted_job_runs_and_reports_status(tmp_path, gif_path, api, jobs):
+    output = str(tmp_path / 'out.gif')
+    code, job = api('POST', '/jobs', {'input': gif_path, 'outputs': [output], 'settings': {'cache': False}})
+    assert code == 202 and job['status'] in ('queued', 'running')
+
+    assert wait_for(jobs, job['id'])['status'] == 'done'
+    code, status = api('GET', f"/jobs/{job['id']}")
+    assert code == 200 and status['progress'] == 100 and status['run_seconds'] is not None
+    assert os.path.getsize(output) > 0
+    assert api('GET', '/health')[1]['alive_workers'] == 1
+
+
+def test_queued_jobs_can_be_cancelled(tmp_path, gif_path, video_path, api, jobs):
+    first = jobs.submit({'input': video_path, 'outputs': [str(tmp_path / 'first.gif')],
+                         'settings': {'cache': False}})
+    queued = jobs.submit({'input': gif_path, 'outputs': [str(tmp_path / 'second.gif')]})
+    code, status = api('POST', f"/jobs/{queued['id']}/cancel", {})
+    assert code == 200 and status['status'] == 'cancelled'
+    assert wait_for(jobs, first['id'])['status'] == 'done'
+    assert not os.path.exists(tmp_path / 'second.gif')
+    assert api('DELETE', '/jobs/999')[0] == 404
+
+
+def test_bad_jobs_are_refused(tmp_path, api):
+    code, body = api('POST', '/jobs', {'input': str(tmp_path / 'missing.gif')})
+    assert code == 400 and 'not found' in body['error']
+    code, body = api('POST', '/jobs', {'input': str(tmp_path / 'missing.gif'), 'settings': {'workers': 4}})
+    assert code == 400
+
+
+def test_jobs_that_would_overwrite_their_input_are_refused(tmp_path, gif_path, device_frame, api, jobs):
+    original = open(gif_path, 'rb').read()
+    os.symlink(gif_path, tmp_path / 'link.gif')
+    os.link(gif_path, tmp_path / 'hardlink.gif')
+    for output in (gif_path, os.path.join(os.path.dirname(gif_path), '.', os.path.basename(gif_path)),
+                   str(tmp_path / 'link.gif'), str(tmp_path / 'hardlink.gif')):
+        code, body = api('POST', '/jobs', {'input': gif_path, 'outputs': [output]})
+        assert code == 400 and 'input' in body['error']
+    with pytest.raises(ValueError):
+        jobs.submit({'input': gif_path, 'outputs': [str(tmp_path / 'out.gif')],
+                     'templates': [{'frame': device_frame, 'outputs': [device_frame]}]})
+    assert jobs.list() == []
+    assert open(gif_path, 'rb').read() == original
+
+
+def test_requests_from_web_pages_are_refused(gif_path, api, jobs):
+    headers = {'Origin': 'https://example.com'}
+    assert api('POST', '/jobs', {'input': gif_path}, headers)[0] == 403
+    assert api('GET', '/jobs', headers=headers)[0] == 403
+    assert api('DELETE', '/jobs/1', headers=headers)[0] == 403
+    assert jobs.list() == []
+
+
+def test_post_bodies_have_to_be_json(gif_path, api, jobs):
+    body = json.dumps({'input': gif_path}).encode('utf-8')
+    assert api('POST', '/jobs', body, {'Content-Type': 'text/plain'})[0] == 415
+    assert api('POST', '/jobs', body)[0] == 415
+    assert api('POST', '/jobs/1/cancel', b'', {'Content-Type': 'application/x-www-form-urlencoded'})[0] == 415
+    assert jobs.list() == []
+
+
+def test_stale_socket_is_replaced(tmp_path):
+    path = str(tmp_path / 'jobs.sock')
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(path)
+    stale.close()
+    httpd = make_http_server(None, socket_path=path)
+    httpd.server_close()
+
+
+def test_other_files_at_the_socket_path_are_kept(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_text('keep me')
+    with pytest.raises(ValueError):
+        make_http_server(None, socket_path=str(path))
+    assert path.read_text() == 'keep me'
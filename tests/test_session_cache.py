@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from conftest import draw_device_frame, read_frames, render
+from processors.frame_source import SourceFrame
+from processors.gif_processor import GifProcessor
+from processors.session_cache import FrameSessionCache
+from processors.video_reader import VideoFrameReader
+
+
+def frames(count, value=0, shape=(4, 4, 3)):
+    return [SourceFrame(np.full(shape, value, np.uint8), 100) for _ in range(count)]
+
+
+def test_least_recently_used_entries_are_dropped(tmp_path):
+    cache = FrameSessionCache(max_bytes=100)
+    cache.put('a', frames(1), 40)
+    cache.put('b', frames(1), 40)
+    assert cache.get('a') is not None
+    cache.put('c', frames(1), 40)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    cache.put('huge', frames(1), 101)
+    assert cache.get('huge') is None
+
+
+def test_record_keeps_only_streams_read_to_the_end(tmp_path):
+    cache = FrameSessionCache()
+    list(cache.record('whole', iter(frames(3))))
+    assert len(cache.get('whole')) == 3
+
+    stream = cache.record('partial', iter(frames(3)))
+    next(stream)
+    stream.close()
+    assert cache.get('partial') is None
+
+
+def test_recordings_larger_than_half_the_cache_are_dropped():
+    cache = FrameSessionCache(max_bytes=100)
+    recorder = cache.recorder('big')
+    for frame in frames(2, shape=(6, 6, 1)):
+        recorder.add(frame.image, frame)
+    recorder.commit()
+    assert cache.get('big') is None
+
+
+@pytest.fixture
+def no_decoding(monkeypatch):
+    """Make any further decoding of an input fail the test"""
+    def decode(*args, **kwargs):
+        raise AssertionError("the input was decoded again")
+
+    def apply():
+        monkeypatch.setattr(VideoFrameReader, '__iter__', decode)
+        monkeypatch.setattr(GifProcessor, 'iter_gif_frames', staticmethod(decode))
+        monkeypatch.setattr('processors.gif_processor.sample_gif_frames', decode)
+    return apply
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('kind', ['gif', 'video'])
+def test_rerender_with_another_frame_decodes_nothing(tmp_path, gif_path, video_path, no_decoding, workers, kind):
+    input_path = gif_path if kind == 'gif' else video_path
+    session = FrameSessionCache()
+    dark = draw_device_frame(tmp_path / 'dark.png', color=(20, 20, 20))
+    light = draw_device_frame(tmp_path / 'light.png', color=(220, 220, 220))
+    reference = render(input_path, light, str(tmp_path / 'reference.gif'), workers=workers)
+    render(input_path, dark, str(tmp_path / 'dark.gif'), session_cache=session, workers=workers)
+
+    no_decoding()
+    second = render(input_path, light, str(tmp_path / 'light.gif'), session_cache=session, workers=workers)
+    expected, framed = read_frames(reference.output_path), read_frames(second.output_path)
+    assert len(framed) == len(expected)
+    assert [duration for _, duration in framed] == [duration for _, duration in expected]
+    for (pixels, _), (expected_pixels, _) in zip(framed, expected):
+        # The palette is sampled from the cached frames rather than decoded ones
+        assert np.abs(pixels.astype(int) - expected_pixels).mean() < 6
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from conftest import draw_device_frame, read_frames, render
+from processors.gif_processor import GifProcessor
+from processors.video_reader import VideoFrameReader
+from utils.signals import CallbackSignals
+
+
+@pytest.fixture
+def tablet_frame(tmp_path):
+    return draw_device_frame(tmp_path / 'tablet.png', size=(200, 150), screen=(176, 126), radius=8)
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    """Count how often GIF and video inputs are decoded"""
+    calls = []
+    iter_gif_frames = GifProcessor.iter_gif_frames
+    iter_video = VideoFrameReader.__iter__
+
+    def counted_gif(path):
+        calls.append(path)
+        return iter_gif_frames(path)
+
+    def counted_video(self):
+        calls.append(self)
+        return iter_video(self)
+
+    monkeypatch.setattr(GifProcessor, 'iter_gif_frames', staticmethod(counted_gif))
+    monkeypatch.setattr(VideoFrameReader, '__iter__', counted_video)
+    return calls
+
+
+def assert_same_frames(path, reference, tolerance=1):
+    frames, expected = read_frames(path), read_frames(reference)
+    assert [duration for _, duration in frames] == [duration for _, duration in expected]
+    for (pixels, _), (other, _) in zip(frames, expected):
+        assert pixels.shape == other.shape
+        assert np.abs(pixels.astype(int) - other.astype(int)).mean() < tolerance
+
+
+@pytest.mark.parametrize('source', ['gif_path', 'video_path'])
+def test_templates_share_one_decode(tmp_path, request, source, device_frame, tablet_frame, decodes):
+    input_path = request.getfixturevalue(source)
+    phone, tablet = str(tmp_path / 'phone.gif'), str(tmp_path / 'tablet.gif')
+    processor = render(input_path, device_frame, phone, fps=12, palette='adaptive',
+                       templates=[(tablet_frame, [tablet])])
+    assert len(decodes) == 1
+    assert processor.targets == [(device_frame, [phone]), (tablet_frame, [tablet])]
+
+    render(input_path, device_frame, str(tmp_path / 'phone_alone.gif'), fps=12, palette='adaptive')
+    render(input_path, tablet_frame, str(tmp_path / 'tablet_alone.gif'), fps=12, palette='adaptive')
+    # Devices with different screens get videos decoded at full size and resized
+    # here, rather than scaled by ffmpeg, so their pixels differ slightly
+    tolerance = 4 if source == 'video_path' else 1
+    assert_same_frames(phone, tmp_path / 'phone_alone.gif', tolerance)
+    assert_same_frames(tablet, tmp_path / 'tablet_alone.gif', tolerance)
+    assert read_frames(tablet)[0][0].shape == (150, 200, 4)
+
+
+def test_only_uncached_templates_are_rendered(tmp_path, gif_path, device_frame, tablet_frame, monkeypatch):
+    phone, tablet = str(tmp_path / 'phone.gif'), str(tmp_path / 'tablet.gif')
+    render(gif_path, device_frame, phone, cache=True)
+
+    rendered = []
+    process_streaming = GifProcessor.process_streaming
+
+    def spy(self, input_gif, targets):
+        rendered.extend(targets)
+        return process_streaming(self, input_gif, targets)
+
+    monkeypatch.setattr(GifProcessor, 'process_streaming', spy)
+    render(gif_path, device_frame, phone, cache=True, templates=[(tablet_frame, [tablet])])
+    assert rendered == [(tablet_frame, [tablet])]
+    assert len(read_frames(tablet)) == len(read_frames(gif_path))
+
+
+def test_status_names_video_inputs(tmp_path, video_path, device_frame, tablet_frame):
+    signals = CallbackSignals()
+    statuses = []
+    signals.status.connect(statuses.append)
+    render(video_path, device_frame, str(tmp_path / 'phone.gif'), signals=signals, fps=6,
+           templates=[(tablet_frame, [str(tmp_path / 'tablet.gif')])])
+    assert "Framing video frames into 2 device frames..." in statuses
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from conftest import draw_gif, read_frames, render
+from processors.frame_source import SourceFrame, frames_in_range, time_range, trim_frames
+from processors.video_reader import VideoFrameReader
+
+
+def durations(frames):
+    return [(frame.image, frame.duration) for frame in frames]
+
+
+def test_trim_cuts_straddling_frames_to_the_range():
+    frames = [SourceFrame(index, 100) for index in range(5)]
+    assert durations(trim_frames(frames, 0.15, 0.32)) == [(1, 50), (2, 100), (3, 20)]
+    assert durations(trim_frames(frames, None, 0.2)) == [(0, 100), (1, 100)]
+    assert durations(trim_frames(frames, 0.4)) == [(4, 100)]
+
+
+def test_trim_stops_reading_at_the_end():
+    read = []
+
+    def frames():
+        for index in range(100):
+            read.append(index)
+            yield SourceFrame(index, 100)
+
+    list(trim_frames(frames(), 0.1, 0.3))
+    assert read == [0, 1, 2, 3]
+
+
+def test_frames_in_range_and_time_range():
+    assert frames_in_range([100] * 5, 0.1, 0.3) == [1, 2]
+    assert time_range(2, None, 3) == (2, 5)
+    assert time_range(2, 4, 3) == (2, 4)
+    with pytest.raises(ValueError):
+        time_range(3, 2)
+
+
+def test_gif_renders_only_the_range(tmp_path, device_frame):
+    gif = draw_gif(tmp_path / 'in.gif', frames=6, durations=[100] * 6)
+    output = render(gif, device_frame, str(tmp_path / 'out.gif'), start=0.15, end=0.45).output_path
+    assert [duration for _, duration in read_frames(output)] == [50, 100, 100, 50]
+
+
+def test_video_seeking_matches_a_full_decode(video_path):
+    full = [frame for _, frame, _ in VideoFrameReader(video_path, fps=10)]
+    trimmed = [frame for _, frame, _ in VideoFrameReader(video_path, fps=10, start=1.0, end=1.5)]
+    assert len(trimmed) == 5
+    for frame, expected in zip(trimmed, full[10:15]):
+        assert np.abs(frame.astype(int) - expected).mean() < 2
+
+
+def test_video_renders_only_the_range(tmp_path, video_path, device_frame):
+    output = render(video_path, device_frame, str(tmp_path / 'out.gif'), fps=10, start=0.5,
+                    max_duration=1).output_path
+    assert sum(duration for _, duration in read_frames(output)) == 1000
@@ -0,0 +1,53 @@
+import numpy as np
+
+from conftest import read_frames, render
+from processors.frame_asset import FrameAsset
+from processors.video_converter import VideoConverter
+from utils.signals import CallbackSignals
+
+
+def test_videos_are_framed_without_an_intermediate_gif(tmp_path, video_path, device_frame, monkeypatch):
+    def convert_to_gif(*args, **kwargs):
+        raise AssertionError("the video went through a GIF first")
+
+    monkeypatch.setattr(VideoConverter, 'convert_to_gif', convert_to_gif)
+    output = render(video_path, device_frame, str(tmp_path / 'out.gif'), fps=10).output_path
+
+    frames = read_frames(output)
+    assert len(frames) == 20
+    assert sum(duration for _, duration in frames) == 2000
+    asset = FrameAsset.load(device_frame)
+    x, y, width, height = asset.screen_rect
+    # The screen shows the video, with no transparency left in it
+    screen = frames[0][0][y + height // 4:y + 3 * height // 4, x + width // 4:x + 3 * width // 4]
+    assert (screen[..., 3] == 255).all()
+    assert screen[..., :3].std() > 20
+
+
+def test_gif_conversion_keeps_every_frame_without_an_fps(tmp_path, video_path, device_frame, monkeypatch):
+    def alternative_method(*args, **kwargs):
+        raise AssertionError("imageio failed to convert the video")
+
+    monkeypatch.setattr(VideoConverter, '_convert_with_alternative_method', alternative_method)
+    output = render(video_path, device_frame, str(tmp_path / 'out.gif'), streaming=False, fps=0).output_path
+
+    frames = read_frames(output)
+    assert len(frames) == 48
+    # 1/24 s in the GIF's whole hundredths
+    assert {duration for _, duration in frames} == {40}
+
+
+def test_iter_frames_scales_while_decoding(video_path):
+    frames = list(VideoConverter().iter_frames(video_path, fps=5, size=(32, 56)))
+    assert len(frames) == 10
+    assert all(np.asarray(frame.image).shape == (56, 32, 3) for frame in frames)
+    assert [frame.duration for frame in frames] == [200] * 10
+
+
+def test_status_names_the_kind_of_input(tmp_path, video_path, gif_path, device_frame):
+    for path, kind in ((video_path, 'video'), (gif_path, 'GIF')):
+        signals = CallbackSignals()
+        statuses = []
+        signals.status.connect(statuses.append)
+        render(path, device_frame, str(tmp_path / 'out.gif'), signals=signals, fps=6)
+        assert f"Framing {kind} frames..." in statuses
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from processors.video_reader import SegmentedVideoReader, VideoFrameReader, ffmpeg_exe, probe_video
+
+
+@pytest.fixture(scope='module')
+def variable_rate_video(tmp_path_factory):
+    """Two seconds at 15 fps then four at 30 fps, like a screen recording that sped up"""
+    import subprocess
+
+    path = tmp_path_factory.mktemp('vfr') / 'vfr.mp4'
+    subprocess.run([ffmpeg_exe(), '-nostdin', '-v', 'error', '-y', '-filter_complex',
+                    'testsrc=size=64x48:rate=15:duration=2[slow];testsrc=size=64x48:rate=30:duration=4[fast];'
+                    '[slow][fast]concat', '-fps_mode', 'vfr', '-pix_fmt', 'yuv420p', '-bf', '0', str(path)],
+                   check=True)
+    return str(path)
+
+
+def test_probe_reads_the_header(video_path):
+    meta = probe_video(video_path)
+    assert tuple(meta['size']) == (64, 112)
+    assert meta['fps'] == 24
+    assert abs(meta['duration'] - 2) < 0.1
+
+
+def test_samples_at_the_requested_rate_with_exact_durations(video_path):
+    frames = list(VideoFrameReader(video_path, fps=7))
+    assert len(frames) == 14
+    assert [index for index, _, _ in frames] == list(range(14))
+    # Rounded against the running total, so the timing never drifts
+    assert sum(duration for _, _, duration in frames) == 2000
+    assert {duration for _, _, duration in frames} <= {142, 143}
+
+
+def test_keeps_every_source_frame_without_a_rate(video_path):
+    frames = list(VideoFrameReader(video_path))
+    assert len(frames) == 48
+    assert sum(duration for _, _, duration in frames) == 2000
+
+
+def test_variable_frame_rate_videos_keep_their_timing(variable_rate_video):
+    frames = list(VideoFrameReader(variable_rate_video))
+    assert len(frames) == 150
+    durations = [duration for _, _, duration in frames]
+    assert set(durations[:30]) == {66, 67}
+    assert set(durations[30:]) == {33, 34}
+    assert sum(durations) == 6000
+
+
+def test_variable_frame_rate_videos_are_not_segmented(variable_rate_video):
+    reader = SegmentedVideoReader(variable_rate_video, segments=3)
+    # Long enough for three segments at the 25 fps the container averages
+    assert reader.estimate_frame_count() == 150
+    assert reader.plan() == [(0, None)]
+
+
+def test_keeps_frames_yielded_for_as_many_frames_as_buffers(video_path):
+    reader = VideoFrameReader(video_path, buffers=2)
+    previous = None
+    for _, frame, _ in reader:
+        if previous is not None:
+            assert np.array_equal(previous[0], previous[1])
+        previous = (frame, frame.copy())
+
+
+def test_scales_inside_ffmpeg_into_reused_buffers(video_path):
+    reader = VideoFrameReader(video_path, fps=5, size=(32, 56), buffers=2)
+    arrays = [frame for _, frame, _ in reader]
+    assert len(arrays) == 10
+    assert arrays[0].shape == (56, 32, 3)
+    assert len({id(frame) for frame in arrays}) == 2
+
+
+def test_fresh_arrays_without_buffers(video_path):
+    frames = [frame.copy() for _, frame, _ in VideoFrameReader(video_path, fps=5)]
+    unbuffered = [frame for _, frame, _ in VideoFrameReader(video_path, fps=5)]
+    assert len({id(frame) for frame in unbuffered}) == len(unbuffered)
+    assert all(np.array_equal(a, b) for a, b in zip(frames, unbuffered))
+
+
+def test_limit_stops_decoding(video_path):
+    assert len(list(VideoFrameReader(video_path, fps=10, limit=3))) == 3
+
+
+def test_undecodable_input_raises(tmp_path, video_path):
+    broken = tmp_path / 'broken.mp4'
+    with open(video_path, 'rb') as f:
+        data = f.read()
+    broken.write_bytes(data[:64] + b'\0' * (len(data) - 64))
+    reader = VideoFrameReader(str(broken), meta=probe_video(video_path), fps=10)
+    with pytest.raises(RuntimeError, match="could not decode"):
+        list(reader)
@@ -2,15 +2,18 @@ import os
 import threading  # Add this import
 from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                             QLabel, QLineEdit, QPushButton, QProgressBar, QFileDialog, 
-                            QMessageBox, QGroupBox, QSizePolicy, QComboBox)
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QPixmap, QFont
+                            QMessageBox, QGroupBox, QSizePolicy, QComboBox, QSpinBox,
+                            QDoubleSpinBox)
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QPixmap, QFont, QImage
 
 from utils.styles import AppColors
 from utils.signals import WorkerSignals
 from utils.file_utils import find_resource_path, open_containing_folder, is_video_file, is_gif_file
-from processors.gif_processor import GifProcessor
-from processors.video_converter import VideoConverter
+
+# Size of the preview area and how long each sampled preview frame shows
+PREVIEW_SIZE = (160, 320)
+PREVIEW_FRAME_MS = 600
 
 class FrameGifApp(QMainWindow):
     def __init__(self):
@@ -24,6 +27,13 @@ class FrameGifApp(QMainWindow):
         
         # Initialize signals
         self.signals = WorkerSignals()
+        # Quick previews run on their own threads; only the newest request is shown
+        self.preview_signals = WorkerSignals()
+        self.preview_request = 0
+        self.preview_frames = []
+        self.preview_index = 0
+        self.preview_timer = QTimer(self)
+        self.preview_timer.timeout.connect(self.show_next_preview_frame)
         
         # Initialize UI
         self.init_ui()
@@ -33,10 +43,13 @@ class FrameGifApp(QMainWindow):
         self.signals.status.connect(self.update_status)
         self.signals.finished.connect(self.processing_complete)
         self.signals.error.connect(self.processing_error)
+        self.signals.preview.connect(self.show_preview)
+        self.preview_signals.preview.connect(self.show_preview)
+        self.preview_signals.error.connect(self.preview_error)
         
     def init_ui(self):
         self.setWindowTitle("GIF Framing Tool")
-        self.setMinimumSize(600, 450)
+        self.setMinimumSize(800, 450)
         
         # Main widget and layout
         main_widget = QWidget()
@@ -82,6 +95,11 @@ class FrameGifApp(QMainWindow):
         header_layout.addWidget(tagline_label)
         main_layout.addWidget(header_widget)
         
+        # Settings on the left, preview on the right
+        content_layout = QHBoxLayout()
+        settings_layout = QVBoxLayout()
+        content_layout.addLayout(settings_layout, 1)
+        
         # Input section
         input_group = QGroupBox("Input Settings")
         input_layout = QVBoxLayout(input_group)
@@ -94,6 +112,7 @@ class FrameGifApp(QMainWindow):
         input_layout_row.addWidget(input_label)
         
         self.input_entry = QLineEdit()
+        self.input_entry.editingFinished.connect(self.request_preview)
         input_layout_row.addWidget(self.input_entry)
         
         input_browse_btn = QPushButton("Browse...")
@@ -119,6 +138,7 @@ class FrameGifApp(QMainWindow):
         
         self.frame_entry = QLineEdit()
         self.frame_entry.setText(self.frame_path)
+        self.frame_entry.editingFinished.connect(self.request_preview)
         frame_layout.addWidget(self.frame_entry)
         
         frame_browse_btn = QPushButton("Browse...")
@@ -127,7 +147,36 @@ class FrameGifApp(QMainWindow):
         frame_layout.addWidget(frame_browse_btn)
         
         input_layout.addLayout(frame_layout)
-        main_layout.addWidget(input_group)
+        
+        # Part of the input to frame, in seconds; 0 means from the start / to the end
+        trim_layout = QHBoxLayout()
+        trim_label = QLabel("Trim:")
+        trim_label.setMinimumWidth(80)
+        trim_layout.addWidget(trim_label)
+        
+        self.start_spin = QDoubleSpinBox()
+        self.start_spin.setRange(0, 24 * 60 * 60)
+        self.start_spin.setDecimals(1)
+        self.start_spin.setSuffix(" s")
+        self.start_spin.setSpecialValueText("Start")
+        self.start_spin.setFixedWidth(100)
+        self.start_spin.editingFinished.connect(self.request_preview)
+        trim_layout.addWidget(self.start_spin)
+        
+        trim_layout.addWidget(QLabel("to"))
+        
+        self.end_spin = QDoubleSpinBox()
+        self.end_spin.setRange(0, 24 * 60 * 60)
+        self.end_spin.setDecimals(1)
+        self.end_spin.setSuffix(" s")
+        self.end_spin.setSpecialValueText("End")
+        self.end_spin.setFixedWidth(100)
+        self.end_spin.editingFinished.connect(self.request_preview)
+        trim_layout.addWidget(self.end_spin)
+        trim_layout.addStretch()
+        
+        input_layout.addLayout(trim_layout)
+        settings_layout.addWidget(input_group)
         
         # Output section
         output_group = QGroupBox("Output Settings")
@@ -149,7 +198,52 @@ class FrameGifApp(QMainWindow):
         output_file_layout.addWidget(output_browse_btn)
         
         output_layout.addLayout(output_file_layout)
-        main_layout.addWidget(output_group)
+        
+        # Worker processes for resizing and compositing
+        workers_layout = QHBoxLayout()
+        workers_label = QLabel("Workers:")
+        workers_label.setMinimumWidth(80)
+        workers_layout.addWidget(workers_label)
+        
+        self.workers_spin = QSpinBox()
+        # processors.parallel.default_workers(), without importing the processors yet
+        self.workers_spin.setRange(1, max(1, os.cpu_count() or 1))
+        # Starts at one worker: that render keeps its resized frames for the next
+        # render of the same input, which worker processes resizing frames can't
+        self.workers_spin.setValue(1)
+        self.workers_spin.setFixedWidth(100)
+        workers_layout.addWidget(self.workers_spin)
+        workers_layout.addStretch()
+        
+        # Output size, the device frame and content shrink together
+        scale_label = QLabel("Scale:")
+        workers_layout.addWidget(scale_label)
+        
+        self.scale_combo = QComboBox()
+        for percent in (100, 75, 50, 25):
+            self.scale_combo.addItem(f"{percent}%", percent / 100.0)
+        # Full size by default, like the command line; smaller is opt-in
+        self.scale_combo.setCurrentIndex(self.scale_combo.findData(1.0))
+        self.scale_combo.setFixedWidth(100)
+        workers_layout.addWidget(self.scale_combo)
+        
+        output_layout.addLayout(workers_layout)
+        settings_layout.addWidget(output_group)
+        
+        # Preview section, sampled frames first and the output as it renders
+        preview_group = QGroupBox("Preview")
+        preview_layout = QVBoxLayout(preview_group)
+        
+        self.preview_label = QLabel("Choose an input\nto see a preview")
+        self.preview_label.setAlignment(Qt.AlignCenter)
+        self.preview_label.setWordWrap(True)
+        self.preview_label.setFixedSize(*PREVIEW_SIZE)
+        self.preview_label.setStyleSheet(f"color: {AppColors.SECONDARY}; font-style: italic;")
+        preview_layout.addWidget(self.preview_label)
+        preview_layout.addStretch()
+        
+        content_layout.addWidget(preview_group)
+        main_layout.addLayout(content_layout)
         
         # Progress section
         progress_group = QGroupBox("Progress")
@@ -197,6 +291,7 @@ class FrameGifApp(QMainWindow):
             output_dir = os.path.dirname(self.output_entry.text())
             new_output = os.path.join(output_dir, f"{base_name}_framed.gif")
             self.output_entry.setText(new_output)
+            self.request_preview()
     
     def browse_frame(self):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -205,6 +300,7 @@ class FrameGifApp(QMainWindow):
         if file_path:
             self.frame_path = file_path
             self.frame_entry.setText(file_path)
+            self.request_preview()
     
     def browse_output(self):
         file_path, _ = QFileDialog.getSaveFileName(
@@ -219,6 +315,10 @@ class FrameGifApp(QMainWindow):
         self.input_path = self.input_entry.text()
         self.frame_path = self.frame_entry.text()
         self.output_path = self.output_entry.text()
+        self.workers = self.workers_spin.value()
+        self.scale = self.scale_combo.currentData()
+        self.start = self.start_spin.value() or None
+        self.end = self.end_spin.value() or None
         
         # Validate inputs
         if not self.input_path or not os.path.exists(self.input_path):
@@ -233,6 +333,13 @@ class FrameGifApp(QMainWindow):
             QMessageBox.critical(self, "Error", "Please specify an output path.")
             return
         
+        if self.end is not None and self.end <= (self.start or 0):
+            QMessageBox.critical(self, "Error", "The trim end has to be after the start.")
+            return
+        
+        # The render's own previews replace any quick preview still running
+        self.preview_request += 1
+        
         # Reset progress
         self.progress_bar.setValue(0)
         self.status_label.setText("Starting processing...")
@@ -244,22 +351,85 @@ class FrameGifApp(QMainWindow):
     
     def _process_media_thread(self):
         try:
-            # Check if input is a video file
-            gif_path = self.input_path
+            # The processors are imported on the worker thread, so the window
+            # opens without waiting for NumPy, Pillow and the rest
+            from processors.gif_processor import GifProcessor
+            from processors.preview import PREVIEW_WIDTH
+            from processors.session_cache import SESSION_CACHE
             
-            if is_video_file(self.input_path):
-                # Convert video to GIF first
-                self.signals.status.emit("Converting video to GIF...")
-                converter = VideoConverter(self.signals)
-                gif_path = converter.convert_to_gif(self.input_path)
-            
-            # Now process the GIF
-            processor = GifProcessor(gif_path, self.frame_path, self.output_path, self.signals)
+            # Videos are decoded straight into the framing pipeline, no intermediate GIF
+            processor = GifProcessor(self.input_path, self.frame_path, self.output_path, self.signals,
+                                     workers=self.workers, scale=self.scale, start=self.start, end=self.end,
+                                     preview_width=PREVIEW_WIDTH, session_cache=SESSION_CACHE)
             processor.run()  # Direct call instead of start() to keep in the same thread
             
         except Exception as e:
             self.signals.error.emit(str(e))
     
+    def request_preview(self):
+        """Render a few low-resolution framed frames of the current input in the background"""
+        input_path = self.input_entry.text()
+        frame_path = self.frame_entry.text()
+        if not (os.path.isfile(input_path) and os.path.isfile(frame_path)):
+            return
+        start = self.start_spin.value() or None
+        end = self.end_spin.value() or None
+        if end is not None and end <= (start or 0):
+            return
+        
+        self.preview_request += 1
+        preview_thread = threading.Thread(
+            target=self._preview_thread, args=(self.preview_request, input_path, frame_path, start, end)
+        )
+        preview_thread.daemon = True
+        preview_thread.start()
+    
+    def _preview_thread(self, request, input_path, frame_path, start, end):
+        try:
+            from processors.preview import PREVIEW_WIDTH, render_preview
+            frames = render_preview(input_path, frame_path, width=PREVIEW_WIDTH, start=start, end=end)
+        except Exception as e:
+            if request == self.preview_request:
+                self.preview_signals.error.emit(str(e))
+            return
+        
+        # Drop previews of an input, frame or trim that has been changed since
+        if request == self.preview_request:
+            self.preview_signals.preview.emit(frames)
+    
+    def show_preview(self, frames):
+        """Show preview frames, cycling through them when there are several"""
+        self.preview_frames = [self._preview_pixmap(frame) for frame in frames]
+        self.preview_index = 0
+        if not self.preview_frames:
+            return
+        self.preview_label.setPixmap(self.preview_frames[0])
+        if len(self.preview_frames) > 1:
+            self.preview_timer.start(PREVIEW_FRAME_MS)
+        else:
+            self.preview_timer.stop()
+    
+    def show_next_preview_frame(self):
+        if not self.preview_frames:
+            self.preview_timer.stop()
+            return
+        self.preview_index = (self.preview_index + 1) % len(self.preview_frames)
+        self.preview_label.setPixmap(self.preview_frames[self.preview_index])
+    
+    def preview_error(self, error_message):
+        self.preview_timer.stop()
+        self.preview_frames = []
+        # ffmpeg errors go on for many lines
+        first_line = (error_message.splitlines() or [""])[0]
+        self.preview_label.setText(f"No preview: {first_line}")
+    
+    def _preview_pixmap(self, image):
+        image = image.convert("RGBA")
+        data = image.tobytes()
+        # copy() so the QImage no longer points into data
+        qimage = QImage(data, image.width, image.height, image.width * 4, QImage.Format_RGBA8888).copy()
+        return QPixmap.fromImage(qimage).scaled(*PREVIEW_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    
     def update_progress(self, value):
         self.progress_bar.setValue(value)
     
@@ -1,7 +1,7 @@
 import os
 import sys
 import subprocess
-import pkg_resources
+import importlib.util
 
 def find_resource_path(filename, package_name='frame_tool'):
     """Find a resource file in various possible locations"""
@@ -14,13 +14,16 @@ def find_resource_path(filename, package_name='frame_tool'):
     if os.path.exists(local_path):
         return local_path
         
-    # Then check if it's available as a package resource
+    # Then check if it's available as a package resource, looking the
+    # package up without importing it (or the slow pkg_resources)
     try:
-        resource_path = pkg_resources.resource_filename(package_name, filename)
+        spec = importlib.util.find_spec(package_name)
+    except (ImportError, ValueError):
+        spec = None
+    for package_dir in (spec and spec.submodule_search_locations) or ():
+        resource_path = os.path.join(package_dir, filename)
         if os.path.exists(resource_path):
             return resource_path
-    except:
-        pass
         
     # If running as a bundled app, check relative to the executable
     if getattr(sys, 'frozen', False):
@@ -32,6 +35,20 @@ def find_resource_path(filename, package_name='frame_tool'):
     # Default to the current directory
     return os.path.join(script_dir, filename)
 
+def get_cache_dir(*parts):
+    """Return (and create) the tool's cache directory, or a subdirectory of it"""
+    base_dir = os.environ.get('GIFFRAMINGTOOL_CACHE_DIR')
+    if not base_dir:
+        if sys.platform == 'darwin':
+            base_dir = os.path.join(os.path.expanduser('~'), 'Library', 'Caches', 'gifframingtool')
+        else:
+            xdg_cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+            base_dir = os.path.join(xdg_cache, 'gifframingtool')
+    
+    cache_dir = os.path.join(base_dir, *parts)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
 def open_containing_folder(file_path):
     """Open the folder containing the file"""
     try:
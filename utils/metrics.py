@@ -0,0 +1,198 @@
+import contextlib
+import cProfile
+import json
+import os
+import platform
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_NO_STAGE = contextlib.nullcontext()
+
+
+class PerfRecorder:
+    """Collects per-stage timings, per-frame latency and peak memory for one job.
+
+    Stages can run on several threads at once. Each stage records its own
+    thread's CPU time, so summed CPU time can be larger than the job's wall
+    time. A disabled recorder does nearly nothing, so hot paths can call
+    it unconditionally.
+    """
+
+    def __init__(self, enabled=True, trace_memory=False, profile=False):
+        """
+        Args:
+            enabled: Record anything at all
+            trace_memory: Track Python/NumPy allocations with tracemalloc (slows things down)
+            profile: Run stage functions wrapped with profiled() under cProfile
+        """
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.profile = enabled and profile
+        self.stages = {}
+        self.latencies = []
+        self._started = deque()
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._local = threading.local()
+        self._start_wall = self._start_cpu = None
+        self._owns_tracemalloc = False
+
+    def start(self):
+        """Mark the start of the job"""
+        if not self.enabled:
+            return
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+
+    def stage(self, name, frames=0):
+        """Context manager adding the wall and CPU time of its body to a stage"""
+        if not self.enabled:
+            return _NO_STAGE
+        return self._stage(name, frames)
+
+    @contextlib.contextmanager
+    def _stage(self, name, frames):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.thread_time() - cpu, frames)
+
+    def add(self, name, wall, cpu, frames=0):
+        """Add time measured elsewhere, e.g. in a worker process, to a stage"""
+        with self._lock:
+            stage = self.stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0, 'frames': 0})
+            stage['wall'] += wall
+            stage['cpu'] += cpu
+            stage['calls'] += 1
+            stage['frames'] += frames
+
+    def timed_iter(self, name, iterable):
+        """Wrap an iterator so the time spent producing each item counts towards a stage"""
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(name, iterable)
+
+    def _timed_iter(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name, 1):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def frame_started(self):
+        """Mark a frame leaving the source; frames have to finish in the same order"""
+        if self.enabled:
+            with self._lock:
+                self._started.append(time.perf_counter())
+
+    def frame_finished(self):
+        """Mark the oldest started frame as written"""
+        if self.enabled:
+            with self._lock:
+                if self._started:
+                    self.latencies.append(time.perf_counter() - self._started.popleft())
+
+    def profiled(self, function):
+        """Wrap a stage function so its calls are profiled on whichever thread runs them"""
+        if not self.profile:
+            return function
+
+        def wrapper(*args, **kwargs):
+            profiler = getattr(self._local, 'profiler', None)
+            if profiler is None:
+                profiler = self._local.profiler = cProfile.Profile()
+                with self._lock:
+                    self._profiles.append(profiler)
+            try:
+                profiler.enable()
+            except ValueError:
+                # Some Pythons allow only one active profiler at a time
+                return function(*args, **kwargs)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.disable()
+        return wrapper
+
+    def report(self, **info):
+        """Return everything recorded as a JSON-serialisable dict, with info merged in"""
+        report = dict(info)
+        if self._start_wall is not None:
+            report['elapsed'] = time.perf_counter() - self._start_wall
+            report['cpu'] = time.process_time() - self._start_cpu
+        report['host'] = {
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+        }
+
+        stages = {}
+        for name, stage in self.stages.items():
+            stage = dict(stage)
+            if stage['frames']:
+                stage['wall_per_frame_ms'] = stage['wall'] * 1000 / stage['frames']
+            stages[name] = stage
+        report['stages'] = stages
+
+        latencies = np.array(self.latencies) * 1000
+        report['frame_latency_ms'] = {
+            'count': len(latencies),
+            'mean': float(latencies.mean()),
+            'p50': float(np.percentile(latencies, 50)),
+            'p90': float(np.percentile(latencies, 90)),
+            'p99': float(np.percentile(latencies, 99)),
+            'max': float(latencies.max()),
+        } if len(latencies) else {'count': 0}
+
+        report['memory'] = self.memory()
+        return report
+
+    def memory(self):
+        """Peak memory use in bytes, as far as this platform can tell"""
+        memory = {}
+        if resource is not None:
+            # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+            unit = 1 if sys.platform == 'darwin' else 1024
+            memory['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+            memory['children_peak_rss'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+        if self.trace_memory and tracemalloc.is_tracing():
+            memory['traced_current'], memory['traced_peak'] = tracemalloc.get_traced_memory()
+        return memory
+
+    def write(self, trace_path=None, profile_path=None, **info):
+        """Write the report as JSON and the merged cProfile stats, then stop tracing memory"""
+        report = self.report(**info)
+        if profile_path and self._profiles:
+            stats = pstats.Stats(*self._profiles)
+            stats.dump_stats(profile_path)
+            report['profile'] = profile_path
+        if trace_path:
+            with open(trace_path, 'w') as f:
+                json.dump(report, f, indent=2)
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
+        return report
+
+
+# Shared by everything that is not given a recorder
+DISABLED = PerfRecorder(enabled=False)
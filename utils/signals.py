@@ -1,7 +1,52 @@
-from PyQt5.QtCore import QObject, pyqtSignal
+import importlib.util
 
-class WorkerSignals(QObject):
-    progress = pyqtSignal(int)
-    status = pyqtSignal(str)
-    finished = pyqtSignal(str, float)
-    error = pyqtSignal(str)
\ No newline at end of file
+# Qt is imported when WorkerSignals is first used, so the command line and
+# the job server, which only use CallbackSignals, never load it
+QT_AVAILABLE = importlib.util.find_spec('PyQt5') is not None
+
+
+class Signal:
+    """Minimal stand-in for a Qt signal, for use without a Qt event loop"""
+    
+    def __init__(self):
+        self._callbacks = []
+    
+    def connect(self, callback):
+        self._callbacks.append(callback)
+    
+    def emit(self, *args):
+        for callback in self._callbacks:
+            callback(*args)
+
+
+class CallbackSignals:
+    """Same interface as WorkerSignals, but plain callbacks so it works headless"""
+    
+    def __init__(self):
+        self.progress = Signal()
+        self.status = Signal()
+        self.finished = Signal()
+        self.error = Signal()
+        self.preview = Signal()
+
+
+def _define_worker_signals():
+    from PyQt5.QtCore import QObject, pyqtSignal
+    
+    class WorkerSignals(QObject):
+        progress = pyqtSignal(int)
+        status = pyqtSignal(str)
+        finished = pyqtSignal(str, float)
+        error = pyqtSignal(str)
+        # A list of small PIL images of framed output
+        preview = pyqtSignal(object)
+    
+    return WorkerSignals
+
+
+def __getattr__(name):
+    if name == 'WorkerSignals' and QT_AVAILABLE:
+        global WorkerSignals
+        WorkerSignals = _define_worker_signals()
+        return WorkerSignals
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")